@@ -3,12 +3,32 @@
 // #include <numpy/arrayobject.h> // remove dependencies
 
 #include <cmath>
+#include <cstdint>
+#include <cstdlib>
+#include <cstring>
+
+#if defined(__x86_64__) || defined(_M_X64) || defined(__i386__) || defined(_M_IX86)
+#define PIXEL_SIMD  // The pixel kernels also have SSE4.1 and AVX2 versions, chosen at import
+#include <immintrin.h>
+#ifdef _MSC_VER
+#include <intrin.h>
+#define TARGET_SSE4
+#define TARGET_AVX2
+#else
+#define TARGET_SSE4 __attribute__((target("sse4.1")))
+#define TARGET_AVX2 __attribute__((target("avx2")))
+#endif
+#endif
 
 #define M_PI 3.14159265358979323846f
 
-#define RED 0
-#define GREEN -1
-#define BLUE -2
+// Channels of a pixel, in the order of a 32 bits Surface (little endian)
+#define BLUE 0
+#define GREEN 1
+#define RED 2
+#define ALPHA 3
+
+#define ALPHA_MASK (0xffu << (8 * ALPHA))  // The alpha channel of a uint32_t pixel
 
 
 #define D_C_QUOT 1.8f
@@ -16,124 +36,414 @@
 #define MIN(a, b) ((a) < (b) ? (a) : (b))
 #define MAX(a, b) ((a) > (b) ? (a) : (b))
 
-int _get_buffer_from_Surface(PyObject *img, Py_buffer *buffer) {
-    PyObject * get_view_method = PyObject_GetAttrString(img, "get_view");
-    if (get_view_method == NULL) {
-        return -1;
-    }
-
-    PyObject * view = PyObject_CallNoArgs(get_view_method); // array of width * height * color
-
-    Py_DECREF(get_view_method);
+/*
+ * The pixels of an image: a pygame Surface, or a (buffer, width, height[, pitch]) tuple.
+ */
+struct Pixels {
+    Py_buffer buffer;
+    uint32_t *buf;  // The first pixel
+    Py_ssize_t width;
+    Py_ssize_t height;
+    Py_ssize_t pitch;  // Number of pixels between the start of two rows
+};
 
-    if (PyObject_GetBuffer(view, buffer, PyBUF_STRIDES) == -1) {
+/*
+ * Get the pixels of a pygame Surface, or of a (buffer, width, height[, pitch]) tuple.
+ * The buffer of the tuple can be any C-contiguous object with the buffer protocol (bytearray, memoryview,
+ * NumPy array...) aligned on 4 bytes, holding 4 bytes per pixel in the order of a 32 bits Surface: blue, green, red, alpha.
+ * pitch is the number of bytes between the start of two rows, 4 * width by default.
+ * Returns true if the image is not valid: an exception is set if the tuple is not valid,
+ * nothing if the object is not a Surface.
+ */
+bool _get_pixels(PyObject *img, const char *name, bool writable, struct Pixels *pixels) {
+    Py_ssize_t pitch = -1;
+    if (PyTuple_Check(img)) {
+        PyObject *exporter;
+        if (!PyArg_ParseTuple(img, "Onn|n", &exporter, &(pixels->width), &(pixels->height), &pitch))
+            return true;
+        if (pixels->width <= 0 || pixels->height <= 0) {
+            PyErr_Format(PyExc_ValueError, "the width and height of %s must be greater than 0", name);
+            return true;
+        }
+        if (pitch == -1)
+            pitch = 4 * pixels->width;
+        if (pitch < 4 * pixels->width || pitch % 4 != 0) {
+            PyErr_Format(PyExc_ValueError, "the pitch of %s must be a multiple of 4, at least 4 * width", name);
+            return true;
+        }
+        if (PyObject_GetBuffer(exporter, &(pixels->buffer), writable ? PyBUF_WRITABLE : PyBUF_SIMPLE))
+            return true;
+        if (pixels->buffer.len < (pixels->height - 1) * pitch + 4 * pixels->width) {
+            PyBuffer_Release(&(pixels->buffer));
+            PyErr_Format(PyExc_ValueError, "the buffer of %s is too small for its width, height and pitch", name);
+            return true;
+        }
+        if ((uintptr_t)pixels->buffer.buf % 4 != 0) {  // The pixels are read as uint32_t
+            PyBuffer_Release(&(pixels->buffer));
+            PyErr_Format(PyExc_ValueError, "the buffer of %s must be aligned on 4 bytes", name);
+            return true;
+        }
+    } else {
+        PyObject *view = PyObject_CallMethod(img, "get_view", "y", "2");  // array of width * height pixels
+        if (view == NULL || PyObject_GetBuffer(view, &(pixels->buffer), PyBUF_STRIDES)) {
+            Py_XDECREF(view);
+            PyErr_Clear();
+            return true;
+        }
         Py_DECREF(view);
-        return -1;
+        if (pixels->buffer.ndim != 2 || pixels->buffer.itemsize != 4) {
+            PyBuffer_Release(&(pixels->buffer));
+            return true;
+        }
+        pixels->width = pixels->buffer.shape[0];
+        pixels->height = pixels->buffer.shape[1];
+        pitch = pixels->buffer.strides[1];
     }
 
-    Py_DECREF(view);
-
-    return 0;
+    pixels->buf = (uint32_t *) pixels->buffer.buf;
+    pixels->pitch = pitch / 4;
+    return false;
 }
 
-int _get_3DBuffer_from_Surface(PyObject *img, Py_buffer *buffer) {
-    PyObject * get_view_method = PyObject_GetAttrString(img, "get_view");
-    if (get_view_method == NULL) {
-        return -1;
-    }
+/*
+ * Get the pixels of an argument of a filter, with the message of an invalid image.
+ * Returns true if the image is not valid, the filter then returns _invalid_image().
+ */
+bool _get_image(PyObject *img, const char *name, bool writable, struct Pixels *pixels) {
+    if (!_get_pixels(img, name, writable, pixels))
+        return false;
+    if (!PyErr_Occurred())
+        printf("%s isn't a valid Surface\n", name);
+    return true;
+}
 
-    PyObject *arg = Py_BuildValue("y", "3");
-    PyObject * view = PyObject_CallOneArg(get_view_method, arg); // array of width * height * RGBA
+/*
+ * What a filter returns when an image is not valid: nothing for a Surface, an error for a tuple.
+ */
+PyObject *_invalid_image() {
+    if (PyErr_Occurred())
+        return NULL;
+    Py_RETURN_NONE;
+}
 
-    Py_DECREF(arg);
-    Py_DECREF(get_view_method);
+/*
+ * Pixel kernels: loops over rows of pixels, compiled for several instruction sets.
+ * The fastest version supported by the CPU is chosen when the module is imported, see select_kernels.
+ */
+
+struct ColorSelection {
+    // "p" stores an int
+    int red;
+    int green;
+    int blue;
+    int magenta;
+    int yellow;
+    int cyan;
+};
 
-    if (PyObject_GetBuffer(view, buffer, PyBUF_STRIDES) == -1) {
-        Py_DECREF(view);
-        return -1;
+/*
+ * Turn to sepia the pixels of a row whose colour is not selected.
+ */
+static void color_filter_row_scalar(uint32_t *row, Py_ssize_t count, const struct ColorSelection *colors) {
+    for (Py_ssize_t x = 0; x < count; ++x) {
+        unsigned char *pixel = (unsigned char *)(row + x);
+
+        unsigned char b = pixel[BLUE];
+        unsigned char g = pixel[GREEN];
+        unsigned char r = pixel[RED];
+
+        if(colors->red && r > g * D_C_QUOT && r > b * D_C_QUOT) continue; // _red
+        if(colors->green && g > r * D_C_QUOT && g > b * D_C_QUOT) continue; // green
+        if(colors->blue && b > r * D_C_QUOT && b > g * D_C_QUOT) continue; // blue
+
+        if(colors->magenta && ((r > D_C_QUOT * g && b > g) || (b > D_C_QUOT * g && r > g)) && r <= D_C_QUOT * b && b <= D_C_QUOT * r) continue; // magenta
+        if(colors->yellow && ((r > D_C_QUOT * b && g > b) || (g > D_C_QUOT * b && r > b)) && r <= D_C_QUOT * g && g <= D_C_QUOT * r) continue; // yellow
+        if(colors->cyan && ((b > D_C_QUOT * r && g > r) || (g > D_C_QUOT * r && b > r)) && g <= D_C_QUOT * b && b <= D_C_QUOT * g) continue; // cyan
+
+        if (colors->red && colors->green && colors->blue &&
+            r <= D_C_QUOT * g && r <= D_C_QUOT * b &&
+            g <= D_C_QUOT * r && g <= D_C_QUOT * b &&
+            b <= D_C_QUOT * r && b <= D_C_QUOT * g)
+            continue; // brown
+
+        int _blue = (int)(r * 0.272f + g * 0.504f + b * 0.131f);
+        int _green = (int)(r * 0.349f + g * 0.656f + b * 0.168f);
+        int _red = (int)(r * 0.393f + g * 0.739f + b * 0.189f);
+
+        pixel[BLUE] = (char)((_blue > 255) ? 255 : _blue);
+        pixel[GREEN] = (char)((_green > 255) ? 255 : _green);
+        pixel[RED] = (char)((_red > 255) ? 255 : _red);
     }
-
-    Py_DECREF(view);
-
-    return 0;
 }
 
-static PyObject *method_color_filter_from_buffer(PyObject *self, PyObject *args, PyObject *kwargs) {
-    PyObject * img;
-
-    bool red = true;
-    bool green = true;
-    bool blue = true;
-
-    bool magenta = true;
-    bool yellow = true;
-    bool cyan = true;
-
-    static char *kwlist[] = {"image", "red", "green", "blue", "magenta", "yellow", "cyan", NULL};
-    if (!PyArg_ParseTupleAndKeywords( args, kwargs, "O|pppppp", kwlist, &img, &red, &green, &blue, &magenta,&yellow, &cyan))
-        return NULL;
-
-    Py_buffer buffer;
-    if (_get_3DBuffer_from_Surface(img, &buffer)) {
-        printf("image isn't a valid Surface\n");
-        Py_RETURN_NONE;
+/*
+ * Darken the pixels of a row further than inner_radius from the center of the vignette, from the column first.
+ * dy2 is the square of the vertical distance from the row to the center, denominator is width - inner_radius.
+ */
+inline void vignette_pixels(uint32_t *row, Py_ssize_t first, Py_ssize_t count, double dy2, float center_x,
+                            float inner_radius, float strength, float denominator) {
+    for (Py_ssize_t x = first; x < count; ++x) {
+        float dx = (float)x - center_x;
+        float dist = (float)sqrt((double)dx * dx + dy2);
+        if (dist > inner_radius) {
+            float alpha = 1 - strength * ((dist - inner_radius) / denominator);
+            if (alpha < 0)
+                alpha = 0;
+
+            unsigned char *pixel = (unsigned char *)(row + x);
+
+            pixel[BLUE] = (char)( pixel[BLUE] * alpha );
+            pixel[GREEN] = (char)(pixel[GREEN] * alpha);
+            pixel[RED] = (char)(pixel[RED] * alpha);
+        }
     }
+}
 
-    Py_ssize_t width = buffer.shape[0];
-    Py_ssize_t height = buffer.shape[1];
-
-    long *buf = (long *) buffer.buf;
-
-//    printf("%d\n", buffer.ndim);
-//    for (int i = 0; i < buffer.ndim; i++){
-//        printf("%lld\n", buffer.shape[i]);
-//        printf("%lld\n", buffer.strides[i]);
-//    }
-//
-//    Py_RETURN_NONE;
+static void vignette_row_scalar(uint32_t *row, Py_ssize_t count, double dy2, float center_x,
+                                float inner_radius, float strength, float denominator) {
+    vignette_pixels(row, 0, count, dy2, center_x, inner_radius, strength, denominator);
+}
 
+#ifdef PIXEL_SIMD
+/*
+ * The SIMD kernels compute the same floats as the scalar ones, in the same order, so they give the same pixels.
+ */
+
+TARGET_SSE4 static void color_filter_row_sse4(uint32_t *row, Py_ssize_t count, const struct ColorSelection *colors) {
+    const __m128i channel = _mm_set1_epi32(0xff);
+    const __m128 quot = _mm_set1_ps(D_C_QUOT);
+    const __m128 none = _mm_setzero_ps();
+    const __m128i max = _mm_set1_epi32(255);
+    Py_ssize_t x = 0;
+    for (; x + 4 <= count; x += 4) {
+        __m128i pixels = _mm_loadu_si128((const __m128i *)(row + x));
+        __m128 b = _mm_cvtepi32_ps(_mm_and_si128(_mm_srli_epi32(pixels, 8 * BLUE), channel));
+        __m128 g = _mm_cvtepi32_ps(_mm_and_si128(_mm_srli_epi32(pixels, 8 * GREEN), channel));
+        __m128 r = _mm_cvtepi32_ps(_mm_and_si128(_mm_srli_epi32(pixels, 8 * RED), channel));
+        __m128 qr = _mm_mul_ps(r, quot);
+        __m128 qg = _mm_mul_ps(g, quot);
+        __m128 qb = _mm_mul_ps(b, quot);
+
+        __m128 kept = none;
+        if (colors->red)
+            kept = _mm_or_ps(kept, _mm_and_ps(_mm_cmpgt_ps(r, qg), _mm_cmpgt_ps(r, qb)));
+        if (colors->green)
+            kept = _mm_or_ps(kept, _mm_and_ps(_mm_cmpgt_ps(g, qr), _mm_cmpgt_ps(g, qb)));
+        if (colors->blue)
+            kept = _mm_or_ps(kept, _mm_and_ps(_mm_cmpgt_ps(b, qr), _mm_cmpgt_ps(b, qg)));
+        if (colors->magenta)
+            kept = _mm_or_ps(kept, _mm_and_ps(
+                _mm_or_ps(_mm_and_ps(_mm_cmpgt_ps(r, qg), _mm_cmpgt_ps(b, g)), _mm_and_ps(_mm_cmpgt_ps(b, qg), _mm_cmpgt_ps(r, g))),
+                _mm_and_ps(_mm_cmple_ps(r, qb), _mm_cmple_ps(b, qr))));
+        if (colors->yellow)
+            kept = _mm_or_ps(kept, _mm_and_ps(
+                _mm_or_ps(_mm_and_ps(_mm_cmpgt_ps(r, qb), _mm_cmpgt_ps(g, b)), _mm_and_ps(_mm_cmpgt_ps(g, qb), _mm_cmpgt_ps(r, b))),
+                _mm_and_ps(_mm_cmple_ps(r, qg), _mm_cmple_ps(g, qr))));
+        if (colors->cyan)
+            kept = _mm_or_ps(kept, _mm_and_ps(
+                _mm_or_ps(_mm_and_ps(_mm_cmpgt_ps(b, qr), _mm_cmpgt_ps(g, r)), _mm_and_ps(_mm_cmpgt_ps(g, qr), _mm_cmpgt_ps(b, r))),
+                _mm_and_ps(_mm_cmple_ps(g, qb), _mm_cmple_ps(b, qg))));
+        if (colors->red && colors->green && colors->blue)  // brown
+            kept = _mm_or_ps(kept, _mm_and_ps(
+                _mm_and_ps(_mm_and_ps(_mm_cmple_ps(r, qg), _mm_cmple_ps(r, qb)), _mm_and_ps(_mm_cmple_ps(g, qr), _mm_cmple_ps(g, qb))),
+                _mm_and_ps(_mm_cmple_ps(b, qr), _mm_cmple_ps(b, qg))));
+
+        __m128i _blue = _mm_cvttps_epi32(_mm_add_ps(_mm_add_ps(_mm_mul_ps(r, _mm_set1_ps(0.272f)), _mm_mul_ps(g, _mm_set1_ps(0.504f))), _mm_mul_ps(b, _mm_set1_ps(0.131f))));
+        __m128i _green = _mm_cvttps_epi32(_mm_add_ps(_mm_add_ps(_mm_mul_ps(r, _mm_set1_ps(0.349f)), _mm_mul_ps(g, _mm_set1_ps(0.656f))), _mm_mul_ps(b, _mm_set1_ps(0.168f))));
+        __m128i _red = _mm_cvttps_epi32(_mm_add_ps(_mm_add_ps(_mm_mul_ps(r, _mm_set1_ps(0.393f)), _mm_mul_ps(g, _mm_set1_ps(0.739f))), _mm_mul_ps(b, _mm_set1_ps(0.189f))));
+        __m128i sepia = _mm_or_si128(_mm_and_si128(pixels, _mm_set1_epi32((int)ALPHA_MASK)),
+                                     _mm_or_si128(_mm_slli_epi32(_mm_min_epi32(_blue, max), 8 * BLUE),
+                                                  _mm_or_si128(_mm_slli_epi32(_mm_min_epi32(_green, max), 8 * GREEN),
+                                                               _mm_slli_epi32(_mm_min_epi32(_red, max), 8 * RED))));
+        _mm_storeu_si128((__m128i *)(row + x), _mm_blendv_epi8(sepia, pixels, _mm_castps_si128(kept)));
+    }
+    color_filter_row_scalar(row + x, count - x, colors);
+}
 
-    for (Py_ssize_t x = 0; x < width; ++x){
+TARGET_AVX2 static void color_filter_row_avx2(uint32_t *row, Py_ssize_t count, const struct ColorSelection *colors) {
+    const __m256i channel = _mm256_set1_epi32(0xff);
+    const __m256 quot = _mm256_set1_ps(D_C_QUOT);
+    const __m256 none = _mm256_setzero_ps();
+    const __m256i max = _mm256_set1_epi32(255);
+    Py_ssize_t x = 0;
+    for (; x + 8 <= count; x += 8) {
+        __m256i pixels = _mm256_loadu_si256((const __m256i *)(row + x));
+        __m256 b = _mm256_cvtepi32_ps(_mm256_and_si256(_mm256_srli_epi32(pixels, 8 * BLUE), channel));
+        __m256 g = _mm256_cvtepi32_ps(_mm256_and_si256(_mm256_srli_epi32(pixels, 8 * GREEN), channel));
+        __m256 r = _mm256_cvtepi32_ps(_mm256_and_si256(_mm256_srli_epi32(pixels, 8 * RED), channel));
+        __m256 qr = _mm256_mul_ps(r, quot);
+        __m256 qg = _mm256_mul_ps(g, quot);
+        __m256 qb = _mm256_mul_ps(b, quot);
+
+        __m256 kept = none;
+        if (colors->red)
+            kept = _mm256_or_ps(kept, _mm256_and_ps(_mm256_cmp_ps(r, qg, _CMP_GT_OQ), _mm256_cmp_ps(r, qb, _CMP_GT_OQ)));
+        if (colors->green)
+            kept = _mm256_or_ps(kept, _mm256_and_ps(_mm256_cmp_ps(g, qr, _CMP_GT_OQ), _mm256_cmp_ps(g, qb, _CMP_GT_OQ)));
+        if (colors->blue)
+            kept = _mm256_or_ps(kept, _mm256_and_ps(_mm256_cmp_ps(b, qr, _CMP_GT_OQ), _mm256_cmp_ps(b, qg, _CMP_GT_OQ)));
+        if (colors->magenta)
+            kept = _mm256_or_ps(kept, _mm256_and_ps(
+                _mm256_or_ps(_mm256_and_ps(_mm256_cmp_ps(r, qg, _CMP_GT_OQ), _mm256_cmp_ps(b, g, _CMP_GT_OQ)),
+                             _mm256_and_ps(_mm256_cmp_ps(b, qg, _CMP_GT_OQ), _mm256_cmp_ps(r, g, _CMP_GT_OQ))),
+                _mm256_and_ps(_mm256_cmp_ps(r, qb, _CMP_LE_OQ), _mm256_cmp_ps(b, qr, _CMP_LE_OQ))));
+        if (colors->yellow)
+            kept = _mm256_or_ps(kept, _mm256_and_ps(
+                _mm256_or_ps(_mm256_and_ps(_mm256_cmp_ps(r, qb, _CMP_GT_OQ), _mm256_cmp_ps(g, b, _CMP_GT_OQ)),
+                             _mm256_and_ps(_mm256_cmp_ps(g, qb, _CMP_GT_OQ), _mm256_cmp_ps(r, b, _CMP_GT_OQ))),
+                _mm256_and_ps(_mm256_cmp_ps(r, qg, _CMP_LE_OQ), _mm256_cmp_ps(g, qr, _CMP_LE_OQ))));
+        if (colors->cyan)
+            kept = _mm256_or_ps(kept, _mm256_and_ps(
+                _mm256_or_ps(_mm256_and_ps(_mm256_cmp_ps(b, qr, _CMP_GT_OQ), _mm256_cmp_ps(g, r, _CMP_GT_OQ)),
+                             _mm256_and_ps(_mm256_cmp_ps(g, qr, _CMP_GT_OQ), _mm256_cmp_ps(b, r, _CMP_GT_OQ))),
+                _mm256_and_ps(_mm256_cmp_ps(g, qb, _CMP_LE_OQ), _mm256_cmp_ps(b, qg, _CMP_LE_OQ))));
+        if (colors->red && colors->green && colors->blue)  // brown
+            kept = _mm256_or_ps(kept, _mm256_and_ps(
+                _mm256_and_ps(_mm256_and_ps(_mm256_cmp_ps(r, qg, _CMP_LE_OQ), _mm256_cmp_ps(r, qb, _CMP_LE_OQ)),
+                              _mm256_and_ps(_mm256_cmp_ps(g, qr, _CMP_LE_OQ), _mm256_cmp_ps(g, qb, _CMP_LE_OQ))),
+                _mm256_and_ps(_mm256_cmp_ps(b, qr, _CMP_LE_OQ), _mm256_cmp_ps(b, qg, _CMP_LE_OQ))));
+
+        __m256i _blue = _mm256_cvttps_epi32(_mm256_add_ps(_mm256_add_ps(_mm256_mul_ps(r, _mm256_set1_ps(0.272f)), _mm256_mul_ps(g, _mm256_set1_ps(0.504f))), _mm256_mul_ps(b, _mm256_set1_ps(0.131f))));
+        __m256i _green = _mm256_cvttps_epi32(_mm256_add_ps(_mm256_add_ps(_mm256_mul_ps(r, _mm256_set1_ps(0.349f)), _mm256_mul_ps(g, _mm256_set1_ps(0.656f))), _mm256_mul_ps(b, _mm256_set1_ps(0.168f))));
+        __m256i _red = _mm256_cvttps_epi32(_mm256_add_ps(_mm256_add_ps(_mm256_mul_ps(r, _mm256_set1_ps(0.393f)), _mm256_mul_ps(g, _mm256_set1_ps(0.739f))), _mm256_mul_ps(b, _mm256_set1_ps(0.189f))));
+        __m256i sepia = _mm256_or_si256(_mm256_and_si256(pixels, _mm256_set1_epi32((int)ALPHA_MASK)),
+                                        _mm256_or_si256(_mm256_slli_epi32(_mm256_min_epi32(_blue, max), 8 * BLUE),
+                                                        _mm256_or_si256(_mm256_slli_epi32(_mm256_min_epi32(_green, max), 8 * GREEN),
+                                                                        _mm256_slli_epi32(_mm256_min_epi32(_red, max), 8 * RED))));
+        _mm256_storeu_si256((__m256i *)(row + x), _mm256_blendv_epi8(sepia, pixels, _mm256_castps_si256(kept)));
+    }
+    color_filter_row_scalar(row + x, count - x, colors);
+}
 
-        for(Py_ssize_t y = 0; y < height; ++y){
+TARGET_SSE4 static void vignette_row_sse4(uint32_t *row, Py_ssize_t count, double dy2, float center_x,
+                                          float inner_radius, float strength, float denominator) {
+    const __m128i channel = _mm_set1_epi32(0xff);
+    Py_ssize_t x = 0;
+    for (; x + 4 <= count; x += 4) {
+        __m128 dx = _mm_sub_ps(_mm_cvtepi32_ps(_mm_setr_epi32((int)x, (int)x + 1, (int)x + 2, (int)x + 3)), _mm_set1_ps(center_x));
+        __m128d dx_low = _mm_cvtps_pd(dx);
+        __m128d dx_high = _mm_cvtps_pd(_mm_movehl_ps(dx, dx));
+        __m128 dist = _mm_movelh_ps(_mm_cvtpd_ps(_mm_sqrt_pd(_mm_add_pd(_mm_mul_pd(dx_low, dx_low), _mm_set1_pd(dy2)))),
+                                    _mm_cvtpd_ps(_mm_sqrt_pd(_mm_add_pd(_mm_mul_pd(dx_high, dx_high), _mm_set1_pd(dy2)))));
+        __m128 outside = _mm_cmpgt_ps(dist, _mm_set1_ps(inner_radius));
+        if (_mm_movemask_ps(outside) == 0)
+            continue;
+        __m128 alpha = _mm_sub_ps(_mm_set1_ps(1.f), _mm_mul_ps(_mm_set1_ps(strength),
+                                  _mm_div_ps(_mm_sub_ps(dist, _mm_set1_ps(inner_radius)), _mm_set1_ps(denominator))));
+        alpha = _mm_max_ps(alpha, _mm_setzero_ps());
+
+        __m128i pixels = _mm_loadu_si128((const __m128i *)(row + x));
+        __m128i dark = _mm_and_si128(pixels, _mm_set1_epi32((int)ALPHA_MASK));
+        for (int shift = 8 * BLUE; shift <= 8 * RED; shift += 8) {
+            __m128 value = _mm_cvtepi32_ps(_mm_and_si128(_mm_srli_epi32(pixels, shift), channel));
+            __m128i darker = _mm_and_si128(_mm_cvttps_epi32(_mm_mul_ps(value, alpha)), channel);
+            dark = _mm_or_si128(dark, _mm_slli_epi32(darker, shift));
+        }
+        _mm_storeu_si128((__m128i *)(row + x), _mm_blendv_epi8(pixels, dark, _mm_castps_si128(outside)));
+    }
+    vignette_pixels(row, x, count, dy2, center_x, inner_radius, strength, denominator);
+}
 
-            unsigned char *pixel = (unsigned char *)(buf + (y * width + x));
+TARGET_AVX2 static void vignette_row_avx2(uint32_t *row, Py_ssize_t count, double dy2, float center_x,
+                                          float inner_radius, float strength, float denominator) {
+    const __m256i channel = _mm256_set1_epi32(0xff);
+    Py_ssize_t x = 0;
+    for (; x + 8 <= count; x += 8) {
+        __m256 dx = _mm256_sub_ps(_mm256_cvtepi32_ps(_mm256_add_epi32(_mm256_set1_epi32((int)x), _mm256_setr_epi32(0, 1, 2, 3, 4, 5, 6, 7))),
+                                  _mm256_set1_ps(center_x));
+        __m256d dx_low = _mm256_cvtps_pd(_mm256_castps256_ps128(dx));
+        __m256d dx_high = _mm256_cvtps_pd(_mm256_extractf128_ps(dx, 1));
+        __m256 dist = _mm256_insertf128_ps(
+            _mm256_castps128_ps256(_mm256_cvtpd_ps(_mm256_sqrt_pd(_mm256_add_pd(_mm256_mul_pd(dx_low, dx_low), _mm256_set1_pd(dy2))))),
+            _mm256_cvtpd_ps(_mm256_sqrt_pd(_mm256_add_pd(_mm256_mul_pd(dx_high, dx_high), _mm256_set1_pd(dy2)))), 1);
+        __m256 outside = _mm256_cmp_ps(dist, _mm256_set1_ps(inner_radius), _CMP_GT_OQ);
+        if (_mm256_movemask_ps(outside) == 0)
+            continue;
+        __m256 alpha = _mm256_sub_ps(_mm256_set1_ps(1.f), _mm256_mul_ps(_mm256_set1_ps(strength),
+                                     _mm256_div_ps(_mm256_sub_ps(dist, _mm256_set1_ps(inner_radius)), _mm256_set1_ps(denominator))));
+        alpha = _mm256_max_ps(alpha, _mm256_setzero_ps());
+
+        __m256i pixels = _mm256_loadu_si256((const __m256i *)(row + x));
+        __m256i dark = _mm256_and_si256(pixels, _mm256_set1_epi32((int)ALPHA_MASK));
+        for (int shift = 8 * BLUE; shift <= 8 * RED; shift += 8) {
+            __m256 value = _mm256_cvtepi32_ps(_mm256_and_si256(_mm256_srli_epi32(pixels, shift), channel));
+            __m256i darker = _mm256_and_si256(_mm256_cvttps_epi32(_mm256_mul_ps(value, alpha)), channel);
+            dark = _mm256_or_si256(dark, _mm256_slli_epi32(darker, shift));
+        }
+        _mm256_storeu_si256((__m256i *)(row + x), _mm256_blendv_epi8(pixels, dark, _mm256_castps_si256(outside)));
+    }
+    vignette_pixels(row, x, count, dy2, center_x, inner_radius, strength, denominator);
+}
+#endif
 
-            unsigned char b = pixel[BLUE];
-            unsigned char g = pixel[GREEN];
-            unsigned char r = pixel[RED];
+struct PixelKernels {
+    const char *name;  // The instruction set, "scalar", "sse4" or "avx2"
+    void (*color_filter_row)(uint32_t *row, Py_ssize_t count, const struct ColorSelection *colors);
+    void (*vignette_row)(uint32_t *row, Py_ssize_t count, double dy2, float center_x,
+                         float inner_radius, float strength, float denominator);
+};
 
-//            printf("0 - %hhu\n", r);
-//            printf("-1 - %hhu\n", g);
-//            printf("-2 - %hhu\n", b);
-//            printf("\n");
+static const struct PixelKernels KERNELS[] = {
+    {"scalar", color_filter_row_scalar, vignette_row_scalar},
+#ifdef PIXEL_SIMD
+    {"sse4", color_filter_row_sse4, vignette_row_sse4},
+    {"avx2", color_filter_row_avx2, vignette_row_avx2},
+#endif
+};
 
+static const struct PixelKernels *kernels = KERNELS;  // The kernels used, set by select_kernels
+
+/*
+ * Choose the fastest kernels the CPU supports. The NOSTALGIAE_SIMD environment variable can name slower ones
+ * ("scalar", "sse4"), to compare them.
+ */
+static void select_kernels() {
+    int level = 0;  // Index in KERNELS
+#ifdef PIXEL_SIMD
+#ifdef _MSC_VER
+    int info[4];
+    __cpuid(info, 0);
+    int max_leaf = info[0];
+    __cpuid(info, 1);
+    bool sse4 = info[2] & (1 << 19);
+    bool avx = (info[2] & (1 << 27)) && (info[2] & (1 << 28)) && (_xgetbv(0) & 6) == 6;  // OSXSAVE, AVX, YMM saved
+    bool avx2 = false;
+    if (avx && max_leaf >= 7) {
+        __cpuidex(info, 7, 0);
+        avx2 = info[1] & (1 << 5);
+    }
+#else
+    __builtin_cpu_init();
+    bool sse4 = __builtin_cpu_supports("sse4.1");
+    bool avx2 = __builtin_cpu_supports("avx2");
+#endif
+    level = avx2 ? 2 : sse4 ? 1 : 0;
+#endif
+    const char *limit = getenv("NOSTALGIAE_SIMD");
+    for (int i = 0; limit != nullptr && i < level; ++i)
+        if (strcmp(limit, KERNELS[i].name) == 0)
+            level = i;
+    kernels = KERNELS + level;
+}
 
-            if(red && r > g * D_C_QUOT && r > b * D_C_QUOT) continue; // _red
-            if(green && g > r * D_C_QUOT && g > b * D_C_QUOT) continue; // green
-            if(blue && b > r * D_C_QUOT && b > g * D_C_QUOT) continue; // blue
+static PyObject *method_color_filter_from_buffer(PyObject *self, PyObject *args, PyObject *kwargs) {
+    PyObject * img;
 
-            if(magenta && ((r > D_C_QUOT * g && b > g) || (b > D_C_QUOT * g && r > g)) && r <= D_C_QUOT * b && b <= D_C_QUOT * r) continue; // magenta
-            if(yellow && ((r > D_C_QUOT * b && g > b) || (g > D_C_QUOT * b && r > b)) && r <= D_C_QUOT * g && g <= D_C_QUOT * r) continue; // yellow
-            if(cyan && ((b > D_C_QUOT * r && g > r) || (g > D_C_QUOT * r && b > r)) && g <= D_C_QUOT * b && b <= D_C_QUOT * g) continue; // cyan
+    struct ColorSelection colors = {true, true, true, true, true, true};
 
-            if (red && green && blue &&
-                r <= D_C_QUOT * g && r <= D_C_QUOT * b &&
-                g <= D_C_QUOT * r && g <= D_C_QUOT * b &&
-                b <= D_C_QUOT * r && b <= D_C_QUOT * g)
-                continue; // brown
+    static char *kwlist[] = {"image", "red", "green", "blue", "magenta", "yellow", "cyan", NULL};
+    if (!PyArg_ParseTupleAndKeywords( args, kwargs, "O|pppppp", kwlist, &img, &colors.red, &colors.green, &colors.blue,
+                                      &colors.magenta, &colors.yellow, &colors.cyan))
+        return NULL;
 
-            int _blue = (int)(r * 0.272f + g * 0.504f + b * 0.131f);
-            int _green = (int)(r * 0.349f + g * 0.656f + b * 0.168f);
-            int _red = (int)(r * 0.393f + g * 0.739f + b * 0.189f);
+    struct Pixels pixels;
+    if (_get_image(img, "image", true, &pixels))
+        return _invalid_image();
 
-            pixel[BLUE] = (char)((_blue > 255) ? 255 : _blue);
-            pixel[GREEN] = (char)((_green > 255) ? 255 : _green);
-            pixel[RED] = (char)((_red > 255) ? 255 : _red);
-        }
-    }
+    for (Py_ssize_t y = 0; y < pixels.height; ++y)
+        kernels->color_filter_row(pixels.buf + y * pixels.pitch, pixels.width, &colors);
 
-    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&pixels.buffer);
     Py_RETURN_NONE;
 }
 
@@ -148,8 +458,8 @@ static PyObject *method_distortion_from_buffer(PyObject *self, PyObject *args, P
     float frequency = 1.0f;
     float speed = 1.0f;
 
-    bool vertical_distortion = false;
-    bool horizontal_distortion = false;
+    int vertical_distortion = false;  // "p" stores an int
+    int horizontal_distortion = false;
 
 
     static char *kwlist[] = {"src_image", "dst_image", "horizontal_distortion", "vertical_distortion", "amplitude", "frequency", "speed", NULL};
@@ -157,32 +467,29 @@ static PyObject *method_distortion_from_buffer(PyObject *self, PyObject *args, P
                                       &src_img, &dst_img, &horizontal_distortion, &vertical_distortion, &amplitude, &frequency, &speed))
         return NULL;
 
-    Py_buffer src_buf;
-    Py_buffer dst_buf;
-
+    struct Pixels src;
+    struct Pixels dst;
 
-    if (_get_buffer_from_Surface(src_img, &src_buf)) {
-        printf("src_img isn't a valid Surface\n");
-        Py_RETURN_NONE;
-    }
+    if (_get_image(src_img, "src_img", false, &src))
+        return _invalid_image();
 
-    if (_get_buffer_from_Surface(dst_img, &dst_buf)) {
-        printf("dst_img isn't a valid Surface\n");
-        Py_RETURN_NONE;
+    if (_get_image(dst_img, "dst_img", true, &dst)) {
+        PyBuffer_Release(&src.buffer);
+        return _invalid_image();
     }
 
-    Py_ssize_t width = src_buf.shape[0];
-    Py_ssize_t height = src_buf.shape[1];
-    Py_ssize_t width2 = dst_buf.shape[0];
-    Py_ssize_t height2 = dst_buf.shape[1];
+    Py_ssize_t width = src.width;
+    Py_ssize_t height = src.height;
 
-    if (width != width2 || height != height2) {
+    if (width != dst.width || height != dst.height) {
+        PyBuffer_Release(&src.buffer);
+        PyBuffer_Release(&dst.buffer);
         PyErr_SetString(PyExc_ValueError, "src_img and dst_img must have the same size");
         return NULL;
     }
 
-    long *sbuf = (long *) src_buf.buf;
-    long *dbuf = (long *) dst_buf.buf;
+    uint32_t *sbuf = src.buf;
+    uint32_t *dbuf = dst.buf;
 
     for (Py_ssize_t x = 0; x < width; ++x){
         Py_ssize_t xu = (Py_ssize_t)(x + (horizontal_distortion ? (amplitude * sin( frequency*x + speed*distortion_time )) : 0));
@@ -196,13 +503,13 @@ static PyObject *method_distortion_from_buffer(PyObject *self, PyObject *args, P
                 yu += height;
             yu = yu % height;
 
-            dbuf[(y * width + x)] = sbuf[(yu * width + xu)];
+            dbuf[(y * dst.pitch + x)] = sbuf[(yu * src.pitch + xu)];
         }
     }
 
 
-    PyBuffer_Release(&src_buf);
-    PyBuffer_Release(&dst_buf);
+    PyBuffer_Release(&src.buffer);
+    PyBuffer_Release(&dst.buffer);
 
     distortion_time++;
 
@@ -222,43 +529,30 @@ static PyObject *method_vignette(PyObject *self, PyObject *args, PyObject *kwarg
     float center_x;
     float center_y;
 
-    Py_buffer src_buf;
-    if (_get_3DBuffer_from_Surface(src_img, &src_buf)) {
-        printf("src_img isn't a valid Surface\n");
-        Py_RETURN_NONE;
-    }
+    struct Pixels src;
+    if (_get_image(src_img, "src_img", true, &src))
+        return _invalid_image();
 
-    Py_ssize_t width = src_buf.shape[0];
-    Py_ssize_t height = src_buf.shape[1];
+    Py_ssize_t width = src.width;
+    Py_ssize_t height = src.height;
 
     // By default, the center of the vignette is the center of the image
     if (pos == NULL) {
         center_x = (float)width / 2;
         center_y = (float)height / 2;
     }  // Otherwise, the center of the vignette is the given position
-    else if (!PyArg_ParseTuple(pos, "ff", &center_x, &center_y))
+    else if (!PyArg_ParseTuple(pos, "ff", &center_x, &center_y)) {
+        PyBuffer_Release(&src.buffer);
         return NULL;
+    }
 
-    long *buf = (long *) src_buf.buf;
-
-    for (Py_ssize_t x = 0; x < width; ++x) {
-        for (Py_ssize_t y = 0; y < height; ++y) {
-            float dist = (float)sqrt(pow(x - center_x, 2) + pow(y - center_y, 2));
-            if (dist > inner_radius) {
-                float alpha = 1 - strength * ((dist - inner_radius) / ((float)width - inner_radius));
-                if (alpha < 0)
-                    alpha = 0;
-
-                unsigned char *pixel = (unsigned char *)(buf + (y * width + x));
-
-                pixel[BLUE] = (char)( pixel[BLUE] * alpha );
-                pixel[GREEN] = (char)(pixel[GREEN] * alpha);
-                pixel[RED] = (char)(pixel[RED] * alpha);
-            }
-        }
+    for (Py_ssize_t y = 0; y < height; ++y) {
+        float dy = (float)y - center_y;
+        kernels->vignette_row(src.buf + y * src.pitch, width, (double)dy * dy, center_x,
+                              inner_radius, strength, (float)width - inner_radius);
     }
 
-    PyBuffer_Release(&src_buf);
+    PyBuffer_Release(&src.buffer);
 
     Py_RETURN_NONE;
 }
@@ -339,27 +633,25 @@ static PyObject *method_display_surface_in_3D_space(PyObject *self, PyObject *ar
         step = step * M_PI / 180.0f;
     }
 
-    Py_buffer src_buf;
-    Py_buffer dst_buf;
+    struct Pixels src;
+    struct Pixels dst;
 
-    if (_get_buffer_from_Surface(src_img, &src_buf)) {
-        printf("src_img isn't a valid Surface\n");
-        Py_RETURN_NONE;
-    }
+    if (_get_image(src_img, "src_img", false, &src))
+        return _invalid_image();
 
-    if (_get_buffer_from_Surface(dst_img, &dst_buf)) {
-        printf("dst_img isn't a valid Surface\n");
-        Py_RETURN_NONE;
+    if (_get_image(dst_img, "dst_img", true, &dst)) {
+        PyBuffer_Release(&src.buffer);
+        return _invalid_image();
     }
 
-    long *sbuf = (long*)src_buf.buf;
-    long *dbuf = (long*)dst_buf.buf;
+    uint32_t *sbuf = src.buf;
+    uint32_t *dbuf = dst.buf;
 
-    Py_ssize_t image_width = src_buf.shape[0];
-    Py_ssize_t image_height = src_buf.shape[1];
+    Py_ssize_t image_width = src.width;
+    Py_ssize_t image_height = src.height;
 
-    Py_ssize_t dst_width = dst_buf.shape[0];
-    Py_ssize_t dst_height = dst_buf.shape[1];
+    Py_ssize_t dst_width = dst.width;
+    Py_ssize_t dst_height = dst.height;
 
     double line_length = sqrt(pow(A_x - B_x, 2) + pow(A_z - B_z, 2));
     double src_x_ratio = (double)image_width / line_length;
@@ -403,12 +695,12 @@ static PyObject *method_display_surface_in_3D_space(PyObject *self, PyObject *ar
                     if (dst_y < 0 || dst_y >= dst_height)
                         continue;
                     Py_ssize_t src_y = (Py_ssize_t)(y * y_dec);
-                    dbuf[dst_y * dst_width + dst_x] = sbuf[src_y * image_width + src_x];
+                    dbuf[dst_y * dst.pitch + dst_x] = sbuf[src_y * src.pitch + src_x];
                 }
     }
 
-    PyBuffer_Release(&src_buf);
-    PyBuffer_Release(&dst_buf);
+    PyBuffer_Release(&src.buffer);
+    PyBuffer_Release(&dst.buffer);
 
     Py_RETURN_NONE;
 }
@@ -425,26 +717,24 @@ static PyObject *method_mode_seven(PyObject *self, PyObject *args, PyObject *kwa
     if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OOffffff", kwlist, &src_img, &dst_img, &x0, &y0, &a, &b, &c, &d))
         return NULL;
 
-    Py_buffer src_buf;
-    Py_buffer dst_buf;
+    struct Pixels src;
+    struct Pixels dst;
 
-    if (_get_buffer_from_Surface(src_img, &src_buf)) {
-        printf("src_img isn't a valid Surface\n");
-        Py_RETURN_NONE;
-    }
+    if (_get_image(src_img, "src_img", false, &src))
+        return _invalid_image();
 
-    if (_get_buffer_from_Surface(dst_img, &dst_buf)) {
-        printf("dst_img isn't a valid Surface\n");
-        Py_RETURN_NONE;
+    if (_get_image(dst_img, "dst_img", true, &dst)) {
+        PyBuffer_Release(&src.buffer);
+        return _invalid_image();
     }
 
-    Py_ssize_t width = src_buf.shape[0];
-    Py_ssize_t height = src_buf.shape[1];
-    Py_ssize_t width2 = dst_buf.shape[0];
-    Py_ssize_t height2 = dst_buf.shape[1];
+    Py_ssize_t width = src.width;
+    Py_ssize_t height = src.height;
+    Py_ssize_t width2 = dst.width;
+    Py_ssize_t height2 = dst.height;
 
-    long *sbuf = (long *) src_buf.buf;
-    long *dbuf = (long *) dst_buf.buf;
+    uint32_t *sbuf = src.buf;
+    uint32_t *dbuf = dst.buf;
 
     for (Py_ssize_t x = 0; x < width; ++x) {
         for (Py_ssize_t y = 0; y < height; ++y) {
@@ -452,12 +742,12 @@ static PyObject *method_mode_seven(PyObject *self, PyObject *args, PyObject *kwa
             Py_ssize_t y_ = (Py_ssize_t)(c * x - c * x0 + d * y - d * y0 + y0);
             if (x_ < 0 || x_ >= width2 || y_ < 0 || y_ >= height2)
                 continue;
-            dbuf[(y_ * width2 + x_)] = sbuf[(y * width + x)];
+            dbuf[(y_ * dst.pitch + x_)] = sbuf[(y * src.pitch + x)];
         }
     }
 
-    PyBuffer_Release(&src_buf);
-    PyBuffer_Release(&dst_buf);
+    PyBuffer_Release(&src.buffer);
+    PyBuffer_Release(&dst.buffer);
 
     Py_RETURN_NONE;
 }
@@ -471,32 +761,29 @@ static PyObject *method_fish_from_buffer(PyObject *self, PyObject *args) {
     if (!PyArg_ParseTuple(args, "OOf", &src_img, &dst_img, &distortion_coefficient))
         return NULL;
 
-    Py_buffer src_buf;
-    Py_buffer dst_buf;
-
+    struct Pixels src;
+    struct Pixels dst;
 
-    if (_get_buffer_from_Surface(src_img, &src_buf)) {
-        printf("src_img isn't a valid Surface\n");
-        Py_RETURN_NONE;
-    }
+    if (_get_image(src_img, "src_img", false, &src))
+        return _invalid_image();
 
-    if (_get_buffer_from_Surface(dst_img, &dst_buf)) {
-        printf("dst_img isn't a valid Surface\n");
-        Py_RETURN_NONE;
+    if (_get_image(dst_img, "dst_img", true, &dst)) {
+        PyBuffer_Release(&src.buffer);
+        return _invalid_image();
     }
 
-    Py_ssize_t width = src_buf.shape[0];
-    Py_ssize_t height = src_buf.shape[1];
-    Py_ssize_t width2 = dst_buf.shape[0];
-    Py_ssize_t height2 = dst_buf.shape[1];
+    Py_ssize_t width = src.width;
+    Py_ssize_t height = src.height;
 
-    if (width != width2 || height != height2) {
+    if (width != dst.width || height != dst.height) {
+        PyBuffer_Release(&src.buffer);
+        PyBuffer_Release(&dst.buffer);
         PyErr_SetString(PyExc_ValueError, "src_img and dst_img must have the same size");
         return NULL;
     }
 
-    long *sbuf = (long *) src_buf.buf;
-    long *dbuf = (long *) dst_buf.buf;
+    uint32_t *sbuf = src.buf;
+    uint32_t *dbuf = dst.buf;
 
     float minus_width = 2.0f / width;
     float minus_height = 2.0f / height;
@@ -522,15 +809,15 @@ static PyObject *method_fish_from_buffer(PyObject *self, PyObject *args) {
             short yu = (short)(((ynd + 1) / 2.0f) * height);
 
             if (0 <= xu && xu < width && 0 <= yu && yu < height)
-                dbuf[(y * width + x)] = sbuf[(yu * width + xu)];
+                dbuf[(y * dst.pitch + x)] = sbuf[(yu * src.pitch + xu)];
 
             yn += minus_height;
         }
         xn += minus_width;
     }
 
-    PyBuffer_Release(&src_buf);
-    PyBuffer_Release(&dst_buf);
+    PyBuffer_Release(&src.buffer);
+    PyBuffer_Release(&dst.buffer);
 
     Py_RETURN_NONE;
 }
@@ -559,5 +846,14 @@ static struct PyModuleDef filtermodule = {
 
 PyMODINIT_FUNC PyInit_nostalgiaefilters(void) {
 	// import_array()
-    return PyModule_Create(&filtermodule);
+    PyObject *m = PyModule_Create(&filtermodule);
+    if (m == NULL)
+        return NULL;
+
+    select_kernels();
+    if (PyModule_AddStringConstant(m, "SIMD", kernels->name) < 0) {  // The instruction set of the pixel kernels
+        Py_DECREF(m);
+        return NULL;
+    }
+    return m;
 }
\ No newline at end of file
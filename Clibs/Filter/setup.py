@@ -1,7 +1,26 @@
 from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
 # import numpy
 
 
+# The SSE4.1 and AVX2 kernels are compiled for their own instruction set whatever the flags, see select_kernels
+# /fp:precise: the SIMD kernels must compute the same floats as the scalar ones, in the same order
+COMPILE_ARGS = {
+    "msvc": ["/O2", "/GS-", "/fp:precise"],
+}
+DEFAULT_COMPILE_ARGS = ["-O3", "-fno-math-errno"]  # gcc, mingw32 and clang
+
+
+class BuildExt(build_ext):
+    """Pass the flags of the compiler actually used."""
+
+    def build_extensions(self):
+        args = COMPILE_ARGS.get(self.compiler.compiler_type, DEFAULT_COMPILE_ARGS)
+        for extension in self.extensions:
+            extension.extra_compile_args = args
+        super().build_extensions()
+
+
 def main():
     setup(name="nostalgiaefilters",
           version="1.0.0",
@@ -13,9 +32,9 @@ def main():
                   "nostalgiaefilters",
                   ["filter.cpp"],
                   # include_dirs=[numpy.get_include()],
-                  extra_compile_args=["/O2", "/GS-", "/fp:fast"]
               )
-          ]
+          ],
+          cmdclass={"build_ext": BuildExt},
           )
 
 
@@ -1,27 +1,77 @@
 #include <Python.h>
 #define _USE_MATH_DEFINES
 #include <cmath>
+#include <cstdint>
+#include <cstdio>
+#include <cstring>
+#include <cstdlib>
+#include <utility>
+#include <algorithm>
+
+#if defined(__x86_64__) || defined(_M_X64) || defined(__i386__) || defined(_M_IX86)
+#define PIXEL_SIMD  // The pixel kernels also have SSE4.1 and AVX2 versions, chosen at import
+#include <immintrin.h>
+#ifdef _MSC_VER
+#include <intrin.h>
+#define TARGET_SSE4
+#define TARGET_AVX2
+#else
+#define TARGET_SSE4 __attribute__((target("sse4.1")))
+#define TARGET_AVX2 __attribute__((target("avx2")))
+#endif
+#endif
+
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
 
 #define EPSILON 0.001f
+#define TILE_SIZE 16  // Size of the tiles of the screen the surfaces are sorted into before casting
+#define MAX_ROOMS 32  // Rooms of the surfaces, only seen through their portals (see create_portal)
+#define DEPTH_LEVELS 8  // Most levels of the depth pyramids, the first one has a cell per tile
 
-#define ALPHA 1
-#define RED 0
-#define GREEN -1
-#define BLUE -2
+#define OPACITY_BLOCK_SHIFT 3  // The opacity masks have one bit per block of 8x8 pixels
 
-#define P_RED 3
-#define P_GREEN 2
-#define P_BLUE 1
-#define P_ALPHA 0
+// Channels of a pixel, in the order of a 32 bits Surface (little endian)
+#define BLUE 0
+#define GREEN 1
+#define RED 2
+#define ALPHA 3
+
+#define ALPHA_MASK (0xffu << (8 * ALPHA))  // The alpha channel of a uint32_t pixel
 
 #define MIN(a, b) ((a) < (b) ? (a) : (b))
 #define MAX(a, b) ((a) > (b) ? (a) : (b))
 
+typedef struct t_SceneObject SceneObject;  // Static surfaces shared by casters, see make_scene
+
 typedef struct t_RayCasterObject{
     PyObject_HEAD
+    SceneObject *scene = nullptr;  // Static surfaces shared with other casters, drawn behind the caster's own surfaces
+    Py_ssize_t *scene_seen = nullptr;  // Indexes of the surfaces of the scene that may be seen by the cast, by distance
+    Py_ssize_t scene_seen_count = 0;
     struct Surface *surfaces = nullptr;
+    struct Image *images = nullptr;  // Images used by the surfaces, shared between the surfaces
+    struct Animation *animations = nullptr;  // Animations registered with register_animation, by id
+    Py_ssize_t animation_count = 0;
+    struct Group *groups = nullptr;  // Groups created with create_group, by handle
+    Py_ssize_t group_count = 0;
+    struct Portal *portals = nullptr;  // Portals created with create_portal, by handle
+    Py_ssize_t portal_count = 0;
+    uint32_t hidden_rooms = 0;  // Bit r is set if the surfaces of room r were left out of the last cast
     struct Light *lights = nullptr;
+    struct Light **light_handles = nullptr;  // Lights created with create_light, by handle
+    Py_ssize_t light_handle_count = 0;
     bool use_lighting = false;
+    struct Pose *poses = nullptr;  // Static layers cached with the "pose" argument of raycasting
+    struct RayTable *ray_tables = nullptr;  // Ray directions of the screens cast, by size and fov
+    unsigned long static_version = 0;  // Changed each time the persistent surfaces change
+    unsigned long surface_version = 0;  // Changed each time surfaces other than the volatile ones are removed
 } RayCasterObject;
 
 typedef struct vec3 {
@@ -65,42 +115,282 @@ struct Light {
     float r; // Red component of the light
     float g; // Green component of the light
     float b; // Blue component of the light
+    bool spot;  // If the light is directional, otherwise it is a point light
+    bool enabled;  // If the light is used by the casts
+    bool persistent;  // If the light has a handle and is kept by clear_lights
+    // Computed by update_light when the light changes
+    vec3 axis;  // From the position to the direction of a spotlight
+    float axis_length2;  // Squared length of the axis
+    float axis_length;  // Length of the axis (further = concentrated)
+    float range2;  // Squared distance lit by a point light
     struct Light *next;
 };
 
 
+struct Texture {
+    uint32_t *pixels;  // The first pixel, with the same layout as get_view("2")
+    Py_ssize_t width;  // Width of the texture in pixels
+    Py_ssize_t height;  // Height of the texture in pixels
+    Py_ssize_t pitch;  // Number of pixels between the start of two rows
+    Py_ssize_t x;  // Position of the texture in its image
+    Py_ssize_t y;
+};
+
+struct SceneFile {
+    /* A compiled scene file mapped in memory, shared by all the surfaces loaded from it. */
+    unsigned char *data;  // Start of the mapping
+    size_t size;  // Size of the mapping in bytes
+    Py_ssize_t refcount;  // Number of surfaces using the mapping
+#ifdef _WIN32
+    HANDLE file;
+    HANDLE mapping;
+#endif
+};
+
+struct Image {
+    /*
+     * The pixels of a pygame Surface or of a scene file texture.
+     * An image is acquired once and shared by all the surfaces using it,
+     * for example all the surfaces using different parts of the same atlas.
+     */
+    struct Image *prev;  // The previous image in its list
+    struct Image *next;  // The next image in its list
+    struct Image **list;  // The list holding the image, of a caster or of a scene. nullptr if it has no parent
+    PyObject *parent;  // The parent py_object, NULL if the image comes from a scene file
+    Py_buffer buffer;  // The buffer of the parent
+    struct SceneFile *scene_file;  // The scene file holding the pixels, NULL if the image has a parent
+    struct Texture texture;  // The whole image
+    Py_ssize_t refcount;  // Number of surfaces using the image
+    uint8_t *opacity;  // One bit per block of pixels, set if the block has a visible pixel. In the file for a scene file
+    Py_ssize_t opacity_pitch;  // Number of blocks in a row
+    bool prepared;  // If the opacity mask was computed, see prepare_image. Every block is visible until then
+    struct Texture opaque;  // The bounding box of the visible pixels of the whole image
+    float crop[4];  // The same bounding box, in fractions of the image: left, top, right, bottom
+};
+
+struct Frame {
+    struct Image *image;  // The image holding the frame
+    struct Texture texture;  // The part of the image displayed, cropped to its visible pixels
+    float crop[4];  // The visible part of the requested texture, in fractions: left, top, right, bottom
+};
+
+struct Animation {
+    struct Frame *frames;
+    Py_ssize_t frame_count;
+};
+
+/*
+ * Surfaces moved together. The geometry of each surface is computed from its points in the space of the group
+ * each time the group is moved, the surfaces are removed from the caster while the group is hidden.
+ */
+struct Group {
+    struct Surface **surfaces;
+    struct pos3 *local;  // The points A, B and C of each surface, in the space of the group
+    Py_ssize_t surface_count;
+    bool visible;
+};
+
+/*
+ * An opening through which the surfaces of a room are seen, such as a door.
+ */
+struct Portal {
+    vec3 min;  // Bounding box of the quad of the portal
+    vec3 max;
+    int room;
+    bool open;
+};
+
 struct Surface {
     struct Surface *next;  // The next surface in the list
-    PyObject *parent;  // The parent py_object
+    struct Image *image;  // The image holding the texture
     struct pos3 pos;  // The position of the surface
     vec3 bc;  // barycentric coordinates
-    Py_buffer buffer;  // The buffer of the surface
-    float distance;
+    vec3 min;  // Lower corner of the bounding box of the surface
+    vec3 max;  // Upper corner of the bounding box of the surface
+    int axis;  // The axis the surface is perpendicular to (0, 1 or 2 for x, y or z), -1 if it is not axis-aligned
+    float width_length;  // Distance from C to B
+    float height_length;  // Distance from C to A
+    struct Texture texture;  // The part of the image displayed on the surface
+    float distance;  // Distance from the camera to the plane of the surface, computed by aim_surface
+    float facing;  // -normal . (camera - A), the same for all the rays of a cast, computed by aim_surface
     bool del;  // If the surface is volatile and need to be deleted
+    bool billboard;  // If the surface is turned toward the camera before each cast
+    bool grouped;  // If the surface is moved by a group
+    int room;  // The room of the surface, 0 if it is always traversed
+    vec3 anchor;  // Bottom center of the billboard
+    float shift;  // Horizontal offset of the center of the billboard, along its width
+    float half_width;  // Half of the width of the billboard
+    float height;  // Height of the billboard
+    struct Surface *faces;  // The 6 faces of a box (see add_box), nullptr if the surface is a quad
+};
+
+/*
+ * What a ray hits: the pixel before the lights are applied, and where it was found.
+ */
+struct Hit {
+    uint32_t pixel;
+    float distance;
+    vec3 inter;
+    struct Surface *surface;  // nullptr if nothing was hit
+    bool ahead;  // If the surface was tested before its turn, so the surfaces before it in the list win the ties
+};
+
+struct StaticSample {
+    struct Hit hit;  // The closest persistent surface hit by the ray of the pixel
+    bool baked;  // If the hit was already computed
+    uint32_t pixel;  // Pixel displayed by the last cast, 0 if it was empty: the unrefined pixels copy it
+};
+
+/*
+ * The static layer seen from a named camera pose.
+ * The persistent surfaces are only traced once per pixel, as long as the pose and the surfaces don't change.
+ */
+struct Pose {
+    struct Pose *next;
+    PyObject *name;  // nullptr for the pose used by the progressive casts without a name
+    Py_ssize_t width;
+    Py_ssize_t height;
+    float camera[7];  // x, y, z, angle_x, angle_y, fov, view_distance
+    unsigned long static_version;  // static_version of the caster when the samples were baked
+    struct StaticSample *samples;  // width * height samples
+    int progressive;  // Size of the blocks refined progressively
+    int level;  // Rank of the last pixel of each block baked, see refine_rank
 };
 
+inline void free_poses(RayCasterObject *caster) {
+    struct Pose *next;
+    for (struct Pose *pose = caster->poses; pose != nullptr; pose = next) {
+        next = pose->next;
+        Py_XDECREF(pose->name);
+        free(pose->samples);
+        free(pose);
+    }
+    caster->poses = nullptr;
+}
+
+/*
+ * Order in which the pixels of a size x size block are refined (size is a power of 2).
+ * The pixels of the coarser grids come first, so the block gets sharper at each step:
+ * for a 2x2 block the order is top left, bottom right, top right then bottom left.
+ */
+inline int refine_rank(int x, int y, int size) {
+    int rank = 0;
+    int weight = 1;
+    for (int half = size / 2; half >= 1; half /= 2) {
+        int quarter_x = (x / half) % 2;
+        int quarter_y = (y / half) % 2;
+        rank += weight * (quarter_x == quarter_y ? quarter_x : 3 - quarter_x);
+        weight *= 4;
+    }
+    return rank;
+}
+
+inline void release_scene_file(struct SceneFile *scene_file) {
+    if (--scene_file->refcount > 0)
+        return;
+#ifdef _WIN32
+    UnmapViewOfFile(scene_file->data);
+    CloseHandle(scene_file->mapping);
+    CloseHandle(scene_file->file);
+#else
+    munmap(scene_file->data, scene_file->size);
+#endif
+    free(scene_file);
+}
+
+inline void link_image(struct Image *image, struct Image **list) {
+    image->prev = nullptr;
+    image->list = list;
+    image->next = *list;
+    if (*list != nullptr)
+        (*list)->prev = image;
+    *list = image;
+}
+
+inline void unlink_image(struct Image *image) {
+    if (image->prev == nullptr)
+        *(image->list) = image->next;
+    else
+        image->prev->next = image->next;
+    if (image->next != nullptr)
+        image->next->prev = image->prev;
+}
+
+inline void destroy_image(struct Image *image) {
+    if (image->parent != nullptr) {
+        PyBuffer_Release(&(image->buffer));
+        Py_DECREF(image->parent);
+        unlink_image(image);  // Only the images with a parent are in a list.
+    }
+    if (image->scene_file != nullptr)
+        release_scene_file(image->scene_file);
+    else
+        free(image->opacity);
+    free(image);
+}
+
+/*
+ * The images of pygame Surfaces are kept until the next call to sweep_images when they are not used anymore,
+ * so the images of the volatile surfaces don't need to be prepared again at each frame.
+ */
+inline void release_image(struct Image *image) {
+    if (--image->refcount > 0 || image->parent != nullptr)
+        return;
+    destroy_image(image);
+}
+
+inline void sweep_images(struct Image **images) {
+    struct Image *next;
+    for (struct Image *image = *images; image != nullptr; image = next) {
+        next = image->next;
+        if (image->refcount == 0)
+            destroy_image(image);
+    }
+}
+
+/*
+ * The surfaces holding the textures of a surface: the surface itself, or the faces of a box that have a texture.
+ * Returns their number, at most 6.
+ */
+inline int get_textured(struct Surface *surface, struct Surface *textured[6]) {
+    if (surface->faces == nullptr) {
+        textured[0] = surface;
+        return 1;
+    }
+    int count = 0;
+    for (int face = 0; face < 6; ++face)
+        if (surface->faces[face].image != nullptr)
+            textured[count++] = surface->faces + face;
+    return count;
+}
+
 inline void free_surface(struct Surface *surface) {
-    PyBuffer_Release(&(surface->buffer));
-    Py_DECREF(surface->parent);
+    struct Surface *textured[6];
+    int count = get_textured(surface, textured);
+    for (int i = 0; i < count; ++i)
+        release_image(textured[i]->image);
+    free(surface->faces);
     free(surface);
 }
 
-inline void free_temp_surfaces(struct Surface **surfaces) {
+inline void free_temp_surfaces(RayCasterObject *caster) {
     /*
-     * Takes a double ptr surfaces and remove from the chained list all surfaces
+     * Remove from the chained list of surfaces of the caster all surfaces
      * that have the "del" attribute set to true.
      * When a surface is removed, it needs to be freed with the free_surface function.
-     * If the new list is empty, surfaces is set to nullptr.
+     * If the new list is empty, the surfaces of the caster are set to nullptr.
      */
 
+    sweep_images(&(caster->images));  // The images not used during this frame
+
     struct Surface *prev = nullptr;
     struct Surface *next;
-    for (struct Surface *current = *surfaces; current != nullptr; current = next) {
+    for (struct Surface *current = caster->surfaces; current != nullptr; current = next) {
         next = current->next;
         if (current->del) {
             free_surface(current);
             if (prev == nullptr)
-                *surfaces = next;
+                caster->surfaces = next;
             else
                 prev->next = next;
         } else
@@ -176,33 +466,25 @@ inline float line_point_distance(vec3 point, vec3 line_point, vec3 line_directio
 }
 
 
-inline bool line_plane_collision(vec3 plane_point, vec3 plane_normal,
-                                 vec3 line_point, vec3 line_direction,
-                                 vec3* intersection) {
-    /*
-        Compute the intersection of a line and a plane.
-        The line is defined by a point and a direction
-        The plane is defined by a point and a normal
-        The intersection is the point (vec3) where the line intersects the plane
+/*
+ * Returns the distance from a point to the axis of a spotlight, like line_point_distance.
+ * w is the vector from the light to the point.
+ */
+inline float spot_distance(const struct Light *light, vec3 point, vec3 w) {
+    float ps = vec3_dot(w, light->axis);
 
-        @return: true if the line intersects the plane, false otherwise
-    */
-    float normal_dot_direction = vec3_dot(plane_normal, line_direction);
-    if (abs(normal_dot_direction) < EPSILON)
-        return false; // The line is parallel to the plane.
+    if (ps <= 0)
+        return vec3_length(w);
 
-    vec3 w = vec3_sub(line_point, plane_point);
-    float fac = -vec3_dot(plane_normal, w) / normal_dot_direction;
-    if (fac < 0 || fac > 1) // The intersection is outside the segment
-        return false;
-    *intersection = vec3_add(
-                        line_point,
-                        vec3_dot_float(
-                            line_direction,
-                            fac)
-                        );
+    if (ps >= light->axis_length2)
+        return vec3_length(vec3_sub(point, light->direction));
 
-    return true;
+    return vec3_length(vec3_sub(point, vec3_add(light->pos, vec3_dot_float(light->axis, ps / light->axis_length2))));
+}
+
+
+inline float vec3_axis(vec3 a, int axis) {
+    return axis == 0 ? a.x : axis == 1 ? a.y : a.z;
 }
 
 /*
@@ -216,6 +498,8 @@ inline bool line_plane_collision(vec3 plane_point, vec3 plane_normal,
         plane.A = point
         plane.B = end point
         plane.C = normal
+    The bounding box of the surface (min, max) is computed when the surface is added.
+    segment.A must be the camera given to aim_surface: the ray parameter is surface->facing / (normal . direction).
     @param intersection: the point where the segment intersects the plane
     The intersection is set if the line intersects with the plane, even if
     the segment does not intersect with the surface.
@@ -223,12 +507,29 @@ inline bool line_plane_collision(vec3 plane_point, vec3 plane_normal,
 
     @return: true if the segment intersects the surface, false otherwise
 */
-inline bool segment_plane_collision(struct pos3 plane, struct pos2 segment,
+/*
+ * If a point is outside the bounding box of a surface, by more than EPSILON.
+ */
+inline bool out_of_bounds(const struct Surface *surface, vec3 point) {
+    return surface->min.x - point.x > EPSILON || point.x - surface->max.x > EPSILON
+           || surface->min.y - point.y > EPSILON || point.y - surface->max.y > EPSILON
+           || surface->min.z - point.z > EPSILON || point.z - surface->max.z > EPSILON;
+}
+
+inline bool segment_plane_collision(const struct Surface *surface, struct pos2 segment,
                                     vec3 *intersection, float *distance) {
 
-    if (!line_plane_collision(plane.A, plane.C, segment.A, segment.B, intersection))
+    // Only one component of the normal of an axis-aligned surface is not null
+    float normal_dot_direction = surface->axis < 0 ? vec3_dot(surface->pos.C, segment.B)
+                                 : vec3_axis(surface->pos.C, surface->axis) * vec3_axis(segment.B, surface->axis);
+    if (abs(normal_dot_direction) < EPSILON)
         return false; // The segment is parallel to the plane.
 
+    float fac = surface->facing / normal_dot_direction;
+    if (fac < 0 || fac > 1) // The intersection is outside the segment
+        return false;
+    *intersection = vec3_add(segment.A, vec3_dot_float(segment.B, fac));
+
     *distance = vec3_dist(segment.A, *intersection);
 
     if (*distance > vec3_length(segment.B))
@@ -237,26 +538,61 @@ inline bool segment_plane_collision(struct pos3 plane, struct pos2 segment,
     if (*distance < EPSILON)
         return false; // The distance is null.
 
-    vec3 i = *intersection;
     // Now we need to check if the intersection is between the surface's points.
-    if (
-        (EPSILON < plane.A.x-i.x && EPSILON < plane.B.x-i.x) || (i.x-plane.A.x > EPSILON && i.x-plane.B.x > EPSILON)
-        || (EPSILON < plane.A.y-i.y && EPSILON < plane.B.y-i.y) || (i.y-plane.A.y > EPSILON && i.y-plane.B.y > EPSILON)
-        || (EPSILON < plane.A.z-i.z && EPSILON < plane.B.z-i.z) || (i.z-plane.A.z > EPSILON && i.z-plane.B.z > EPSILON)
-       )
+    if (out_of_bounds(surface, *intersection))
         return false; // The intersection is outside the surface.
 
     return true;
 
 }
 
-inline unsigned char *get_pixel_3d(struct Surface *surface, vec3 point) {
+/*
+ * Find where a segment enters and leaves a box with the slab test: the segment is clipped between the two planes
+ * of each axis. The faces are numbered by axis, the lower one first (see add_box).
+ * t receives the positions of both points along the segment, from 0 at its start to 1 at its end,
+ * and faces the faces crossed there. Returns false if the segment misses the box.
+ */
+inline bool slab_test(const struct Surface *box, struct pos2 segment, float t[2], int faces[2]) {
+    t[0] = -INFINITY;
+    t[1] = INFINITY;
+    faces[0] = faces[1] = 0;
+    for (int axis = 0; axis < 3; ++axis) {
+        float origin = vec3_axis(segment.A, axis);
+        float direction = vec3_axis(segment.B, axis);
+        float low = vec3_axis(box->min, axis);
+        float high = vec3_axis(box->max, axis);
+        if (direction == 0.f) {
+            if (origin < low || origin > high)
+                return false;  // Parallel to the slab, and out of it
+            continue;
+        }
+        float t_low = (low - origin) / direction;
+        float t_high = (high - origin) / direction;
+        int face_low = 2 * axis;
+        int face_high = 2 * axis + 1;
+        if (t_low > t_high) {  // Going down the axis, the upper face is crossed first
+            std::swap(t_low, t_high);
+            std::swap(face_low, face_high);
+        }
+        if (t_low > t[0]) {
+            t[0] = t_low;
+            faces[0] = face_low;
+        }
+        if (t_high < t[1]) {
+            t[1] = t_high;
+            faces[1] = face_high;
+        }
+    }
+    return t[0] <= t[1] && t[1] >= 0.f && t[0] <= 1.f;
+}
+
+inline const uint32_t *get_pixel_3d(struct Surface *surface, vec3 point) {
     vec3 ab = vec3_sub(surface->bc, surface->pos.A);
     vec3 av = vec3_sub(point, surface->pos.A);
 
-    float x_dist = vec3_length(vec3_cross(ab, av)) / vec3_length(ab);
-    float x_len = vec3_dist(surface->bc, surface->pos.B);
-    Py_ssize_t width = surface->buffer.shape[0];
+    float x_dist = vec3_length(vec3_cross(ab, av)) / surface->height_length;
+    float x_len = surface->width_length;
+    Py_ssize_t width = surface->texture.width;
     Py_ssize_t x = (Py_ssize_t)(x_dist * width / x_len);
     if (x < 0 || x >= width)
         return nullptr;
@@ -264,313 +600,3208 @@ inline unsigned char *get_pixel_3d(struct Surface *surface, vec3 point) {
     vec3 bc = vec3_sub(surface->pos.B, surface->bc);
     vec3 bv = vec3_sub(point, surface->bc);
 
-    float y_dist = vec3_length(vec3_cross(bc, bv)) / vec3_length(bc);
-    float y_len = vec3_dist(surface->bc, surface->pos.A);
-    Py_ssize_t height = surface->buffer.shape[1];
+    float y_dist = vec3_length(vec3_cross(bc, bv)) / surface->width_length;
+    float y_len = surface->height_length;
+    Py_ssize_t height = surface->texture.height;
     Py_ssize_t y = height - (Py_ssize_t)(y_dist * height / y_len);
 
     if (y >= height || y < 0)
         return nullptr;
 
-    long *buf = (long *)surface->buffer.buf;
-    long *pixel = buf + (y * width + x);
-    return (unsigned char*) pixel;
+    // Most rays crossing the transparent parts of a sprite are rejected by the opacity mask
+    const struct Image *image = surface->image;
+    Py_ssize_t block = ((surface->texture.y + y) >> OPACITY_BLOCK_SHIFT) * image->opacity_pitch
+                       + ((surface->texture.x + x) >> OPACITY_BLOCK_SHIFT);
+    if (!(image->opacity[block >> 3] & (1 << (block & 7))))
+        return nullptr;
+
+    return surface->texture.pixels + y * surface->texture.pitch + x;
 }
 
 
-inline unsigned long get_pixel_sum(struct pos2 ray, struct Surface *surface, struct Light *lights, float max_dist, bool use_lights) {
-    unsigned long pixel = 0;  // alloc 4 bytes for the pixel
+#define ALL_SURFACES 0
+#define STATIC_SURFACES 1
+#define DYNAMIC_SURFACES 2
 
-    unsigned char *pixel_ptr = (unsigned char*)&pixel;  // Get the pointer to the pixel
-    float min_distance = max_dist;  // The distance to the closest surface found so far
-    vec3 inter;
-    for (; surface != nullptr; surface = surface->next) {  // For each surface
+/*
+ * Persistent surfaces never move, unlike the volatile ones, the billboards and the groups.
+ */
+inline bool is_static(const struct Surface *surface) {
+    return !surface->del && !surface->billboard && !surface->grouped;
+}
 
-        vec3 intersection;
-        float distance;
-        if (!segment_plane_collision(surface->pos, ray, &intersection, &distance))  // Make sure the ray intersects the surface
-            continue;
+/*
+ * What a pixel costs: how many surfaces were tested against the ray and how many lights were evaluated.
+ * A surface rejected by its distance alone isn't counted.
+ */
+struct Cost {
+    int surfaces;
+    int lights;
+};
 
-        if (distance >= min_distance)  // Then check if the surface is closer than the closest one found so far
-            continue;  // If the surface is further than the closest one, skip it
+/*
+ * Intersect the ray with a box: one slab test finds where the ray enters and leaves it, then the texel is read
+ * on the face it enters, or on the face it leaves if the first one is missing or transparent there.
+ * Only the points closer than the hit are kept, with the same ties as trace_surface.
+ * Returns the texel and sets the intersection, nullptr if the ray doesn't hit an opaque texel of the box.
+ */
+inline const unsigned char *trace_box(struct pos2 ray, const struct Surface *box, const struct Hit *hit,
+                                      vec3 *intersection, float *distance, struct Cost *cost) {
+    float t[2];
+    int faces[2];
+    if (!slab_test(box, ray, t, faces))
+        return nullptr;
 
-        unsigned char *new_pixel_ptr = get_pixel_3d(surface, intersection);  // Get the pixel from the surface
-        if (new_pixel_ptr == nullptr || new_pixel_ptr[ALPHA] == 0)  // If for some reason the pixel is null or transparent, skip it
+    for (int i = 0; i < 2; ++i) {
+        struct Surface *face = box->faces + faces[i];
+        if (t[i] < 0.f || t[i] > 1.f || face->image == nullptr)
+            continue;  // Behind the camera, beyond the view distance or not displayed
+        *intersection = vec3_add(ray.A, vec3_dot_float(ray.B, t[i]));
+        *distance = vec3_dist(ray.A, *intersection);
+        if (*distance < EPSILON)
             continue;
+        if (hit->ahead ? *distance > hit->distance : *distance >= hit->distance)
+            return nullptr;  // The other face is even further
+        if (out_of_bounds(face, *intersection))
+            continue;  // Out of the visible part of the texture
+        const unsigned char *pixel = (const unsigned char *)get_pixel_3d(face, *intersection);
+        if (pixel != nullptr && pixel[ALPHA] != 0)
+            return pixel;
+    }
+    return nullptr;
+}
 
-        min_distance = distance;  // We found a closer surface, so update the min_distance
-        inter = intersection;
-
-        float quotient = (1.0f - distance / max_dist);
-
-        pixel_ptr[P_BLUE] = (unsigned char)(new_pixel_ptr[BLUE] * quotient);  // Set the pixel's blue value
-        pixel_ptr[P_GREEN] = (unsigned char)(new_pixel_ptr[GREEN] * quotient);  // Set the pixel's green value
-        pixel_ptr[P_RED] = (unsigned char)(new_pixel_ptr[RED] * quotient);  // Set the pixel's red value
-        //pixel = (unsigned long)(*((unsigned long *)(new_pixel_ptr - 3)));  // Copy the pixel to the pixel pointer
-    }
-
-    if (use_lights && pixel) {
-        float red = 0.0f;
-        float green = 0.0f;
-        float blue = 0.0f;
-        for (struct Light* temp_light = lights; temp_light != nullptr; temp_light = temp_light->next) {
-            float dist = vec3_dist(temp_light->pos, inter);  // distance between the light and the intersection
-            float ratio;
-            if (temp_light->direction.x == FP_NAN){  // if the light is a point light, calculate the ratio
-                ratio = dist / temp_light->intensity;
-            } else {  // if the light is a directional light, calculate the ratio
-                float dist2 = line_point_distance(inter, temp_light->pos, temp_light->direction);  // distance between the direction and the intersection
-                float dist3 = vec3_dist(temp_light->pos, temp_light->direction);  // distance between the light and the direction (further = concentrated)
-                ratio = (dist2*dist3) / (dist*temp_light->intensity);
-            }
+/*
+ * Intersect the ray with one surface, and update the hit if the surface is closer than it.
+ * With ties, the hit only changes if it is ahead.
+ */
+inline void trace_surface(struct pos2 ray, struct Surface *surface, float max_dist, struct Hit *hit, struct Cost *cost) {
+    // The distance to the plane of the surface is a lower bound of the distance of the intersection,
+    // so the surfaces behind the closest one found so far are rejected without computing the intersection.
+    if (surface->distance * (1.f - EPSILON) > hit->distance)
+        return;
+    cost->surfaces++;  // The intersection test is what the culling saves
+
+    vec3 intersection;
+    float distance;
+    const unsigned char *new_pixel_ptr;
+    if (surface->faces != nullptr) {
+        new_pixel_ptr = trace_box(ray, surface, hit, &intersection, &distance, cost);
+        if (new_pixel_ptr == nullptr)
+            return;
+    } else {
+        if (!segment_plane_collision(surface, ray, &intersection, &distance))  // Make sure the ray intersects the surface
+            return;
+
+        // Then check if the surface is closer than the closest one found so far
+        if (hit->ahead ? distance > hit->distance : distance >= hit->distance)
+            return;  // If the surface is further than the closest one, skip it
+
+        new_pixel_ptr = (const unsigned char *)get_pixel_3d(surface, intersection);  // Get the pixel from the surface
+        if (new_pixel_ptr == nullptr || new_pixel_ptr[ALPHA] == 0)  // If for some reason the pixel is null or transparent, skip it
+            return;
+    }
 
-            if (ratio < 1.0f) {  // ratio > 1 means the light is too far away, we don't see anything
-                float temp = 1.0f - ratio;
-                red += temp * temp_light->r;
-                green += temp * temp_light->g;
-                blue += temp * temp_light->b;
-            }
-        }
-        // Prevent the pixel from being too bright
-        if (red > 1.0f)
-            red = 1.0f;
-        if (green > 1.0f)
-            green = 1.0f;
-        if (blue > 1.0f)
-            blue = 1.0f;
+    hit->distance = distance;  // We found a closer surface, so update the distance
+    hit->inter = intersection;
+    hit->surface = surface;
+    hit->ahead = false;
 
-        pixel_ptr[P_BLUE] = (unsigned char)(pixel_ptr[P_BLUE] * blue);
-        pixel_ptr[P_GREEN] = (unsigned char)(pixel_ptr[P_GREEN] * green);
-        pixel_ptr[P_RED] = (unsigned char)(pixel_ptr[P_RED] * red);
-    }
+    unsigned char *pixel_ptr = (unsigned char*)&(hit->pixel);  // Get the pointer to the pixel
+    float quotient = (1.0f - distance / max_dist);
 
-    pixel_ptr[P_ALPHA] = 0;  // Make sure the alpha is 0
+    pixel_ptr[BLUE] = (unsigned char)(new_pixel_ptr[BLUE] * quotient);  // Set the pixel's blue value
+    pixel_ptr[GREEN] = (unsigned char)(new_pixel_ptr[GREEN] * quotient);  // Set the pixel's green value
+    pixel_ptr[RED] = (unsigned char)(new_pixel_ptr[RED] * quotient);  // Set the pixel's red value
+}
 
-    return pixel;
+/*
+ * Test first the surface hit by the ray of the pixel at the last cast: it is most likely hit again,
+ * and then most of the other surfaces are rejected by their distance.
+ */
+inline void trace_hint(struct pos2 ray, struct Surface *hint, float max_dist, struct Hit *hit, struct Cost *cost) {
+    if (hint == nullptr)
+        return;
+    trace_surface(ray, hint, max_dist, hit, cost);
+    if (hit->surface == hint)
+        hit->ahead = true;
 }
 
 /*
- * Get the closest intersection between a ray and a list of surfaces.
+ * Find the closest opaque pixel hit by the ray among the given layer of surfaces.
+ * Only the surfaces closer than hit->distance are considered, hit is updated when one is found.
  */
-float get_closest_intersection(pos2 ray, float max_distance, struct Surface *surfaces) {
-    float min_distance = max_distance;
-    for (; surfaces != nullptr; surfaces = surfaces->next) {
-        vec3 temp_intersection;
-        float distance;
-        if (!segment_plane_collision(surfaces->pos, ray, &temp_intersection, &distance))
-            continue;
+inline void trace_pixel(struct pos2 ray, struct Surface **surfaces, Py_ssize_t count, float max_dist, int layer,
+                        struct Hit *hit, struct Cost *cost) {
+    for (Py_ssize_t i = 0; i < count; ++i) {  // For each surface
+        struct Surface *surface = surfaces[i];
 
-        if (distance >= min_distance)
+        if (hit->ahead && surface == hit->surface) {
+            hit->ahead = false;  // Already tested, the next surfaces lose the ties as usual
             continue;
+        }
 
-        unsigned char *new_pixel_ptr = get_pixel_3d(surfaces, temp_intersection);
-        if (new_pixel_ptr == nullptr || new_pixel_ptr[ALPHA] == 0)
+        if (layer != ALL_SURFACES && is_static(surface) != (layer == STATIC_SURFACES))
             continue;
 
-        min_distance = distance;
+        trace_surface(ray, surface, max_dist, hit, cost);
     }
-
-    return min_distance;
 }
 
-inline bool _get_3DBuffer_from_Surface(PyObject *img, Py_buffer *buffer) {
-    PyObject * get_view_method = PyObject_GetAttrString(img, "get_view");
-    if (get_view_method == NULL) {
-        return true;
+/*
+ * Add the light reaching a point to the factor of each channel (red, green, blue).
+ */
+inline void add_light(const struct Light *light, vec3 inter, float lighting[3]) {
+    vec3 w = vec3_sub(inter, light->pos);
+    float dist_sq = vec3_dot(w, w);
+    if (!light->spot && dist_sq >= light->range2)
+        return;  // Out of the range of the point light, no need for a square root
+    float dist = sqrtf(dist_sq);  // distance between the light and the intersection
+    float ratio;
+    if (!light->spot){  // if the light is a point light, calculate the ratio
+        ratio = dist / light->intensity;
+    } else {  // if the light is a directional light, calculate the ratio
+        float dist2 = spot_distance(light, inter, w);  // distance between the direction and the intersection
+        ratio = (dist2*light->axis_length) / (dist*light->intensity);
     }
 
-    PyObject *arg = Py_BuildValue("y", "3");
-    PyObject * view = PyObject_CallOneArg(get_view_method, arg); // array of width * height * RGBA
-
-    Py_DECREF(arg);
-    Py_DECREF(get_view_method);
-
-    if (PyObject_GetBuffer(view, buffer, PyBUF_STRIDES) == -1) {
-        Py_DECREF(view);
-        return true;
+    if (ratio < 1.0f) {  // ratio > 1 means the light is too far away, we don't see anything
+        float temp = 1.0f - ratio;
+        lighting[0] += temp * light->r;
+        lighting[1] += temp * light->g;
+        lighting[2] += temp * light->b;
     }
+}
 
-    Py_DECREF(view);
+/*
+ * Prevent the pixel from being too bright.
+ */
+inline void clamp_lighting(float lighting[3]) {
+    for (int i = 0; i < 3; ++i)
+        if (lighting[i] > 1.0f)
+            lighting[i] = 1.0f;
+}
 
-    return false;
+/*
+ * Sum the lights reaching a point, as a factor for each channel (red, green, blue).
+ */
+inline void get_lighting(vec3 inter, struct Light *lights, float lighting[3], struct Cost *cost) {
+    lighting[0] = lighting[1] = lighting[2] = 0.0f;
+    for (struct Light* temp_light = lights; temp_light != nullptr; temp_light = temp_light->next) {
+        if (!temp_light->enabled)
+            continue;
+        cost->lights++;
+        add_light(temp_light, inter, lighting);
+    }
+    clamp_lighting(lighting);
 }
 
-//inline int count_surfaces(struct Surface *surface) {
-//    int count;
-//    for (count = 0; surface != nullptr; surface = surface->next)
-//        count++;
-//    return count;
-//}
-//
-//inline void print_surfaces(struct Surface *surface) {
-//    for (int i = 0; surface != nullptr; surface = surface->next, i++)
-//        printf("Surface %d: %p\n", i, surface);
-//    printf("\n");
-//}
+/*
+ * Multiply the channels of a pixel by the lighting factors.
+ */
+inline uint32_t apply_lighting(uint32_t pixel, const float lighting[3]) {
+    unsigned char *pixel_ptr = (unsigned char*)&pixel;  // Get the pointer to the pixel
+    pixel_ptr[BLUE] = (unsigned char)(pixel_ptr[BLUE] * lighting[2]);
+    pixel_ptr[GREEN] = (unsigned char)(pixel_ptr[GREEN] * lighting[1]);
+    pixel_ptr[RED] = (unsigned char)(pixel_ptr[RED] * lighting[0]);
+    pixel_ptr[ALPHA] = 0;  // Make sure the alpha is 0
+    return pixel;
+}
 
-inline float get_closest(vec3 camera_pos, struct Surface *surface) {
-//    float a_dist = vec3_dist(camera_pos, surface->pos.A);
-//    float b_dist = vec3_dist(camera_pos, surface->pos.B);
-//    return a_dist < b_dist ? a_dist : b_dist;
-    return fabsf( vec3_dot(surface->pos.C, surface->pos.A) - vec3_dot(surface->pos.C, camera_pos)) / vec3_length(surface->pos.C);
+/*
+ * Write the colour of a pixel (see apply_lighting) on the screen, keeping the alpha channel of the screen.
+ */
+inline void put_pixel(uint32_t *dst, uint32_t pixel) {
+    *dst = (*dst & ALPHA_MASK) | pixel;
 }
 
+/*
+ * Pixel kernels: loops over rows of pixels, compiled for several instruction sets.
+ * The fastest version supported by the CPU is chosen when the module is imported, see select_kernels.
+ * Only the merge of the scaled frame into the screen is one: tracing and lighting branch on each surface and each
+ * light per pixel, they are left to the compiler.
+ */
 
 /*
- * Sort all given Surface objects by their distance to the camera.
+ * Write the pixels of a row that are not empty over another row, with put_pixel.
  */
-inline void depth_sort(vec3 camera_pos, RayCasterObject* caster) {
-    for (struct Surface *temp_surface = caster->surfaces; temp_surface != nullptr; temp_surface = temp_surface->next) {
-        temp_surface->distance = get_closest(camera_pos, temp_surface);
-    }
+static void merge_row_scalar(uint32_t *dst, const uint32_t *src, Py_ssize_t count) {
+    for (Py_ssize_t i = 0; i < count; ++i)
+        if (src[i] != 0)
+            put_pixel(dst + i, src[i]);
+}
 
-    bool swapped = true;
-    while (swapped) {
-        swapped = false;
-        struct Surface *prev = nullptr;
-        for (struct Surface *temp_surface = caster->surfaces; temp_surface->next != nullptr; temp_surface = temp_surface->next) {
-            if (temp_surface->distance > temp_surface->next->distance) {
-                swapped = true;
-                struct Surface *temp = temp_surface->next;
-                if (prev == nullptr) {
-                    caster->surfaces = temp;
-                    temp_surface->next = temp->next;
-                    temp->next = temp_surface;
-                } else {
-                    prev->next = temp;
-                    temp_surface->next = temp->next;
-                    temp->next = temp_surface;
-                }
-                break;
-            }
+#ifdef PIXEL_SIMD
+TARGET_SSE4 static void merge_row_sse4(uint32_t *dst, const uint32_t *src, Py_ssize_t count) {
+    const __m128i alpha = _mm_set1_epi32((int)ALPHA_MASK);
+    const __m128i zero = _mm_setzero_si128();
+    Py_ssize_t i = 0;
+    for (; i + 4 <= count; i += 4) {
+        __m128i pixels = _mm_loadu_si128((const __m128i *)(src + i));
+        __m128i old = _mm_loadu_si128((const __m128i *)(dst + i));
+        __m128i merged = _mm_or_si128(_mm_and_si128(old, alpha), pixels);
+        __m128i empty = _mm_cmpeq_epi32(pixels, zero);
+        _mm_storeu_si128((__m128i *)(dst + i), _mm_blendv_epi8(merged, old, empty));
+    }
+    merge_row_scalar(dst + i, src + i, count - i);
+}
 
-            prev = temp_surface;
-        }
+TARGET_AVX2 static void merge_row_avx2(uint32_t *dst, const uint32_t *src, Py_ssize_t count) {
+    const __m256i alpha = _mm256_set1_epi32((int)ALPHA_MASK);
+    const __m256i zero = _mm256_setzero_si256();
+    Py_ssize_t i = 0;
+    for (; i + 8 <= count; i += 8) {
+        __m256i pixels = _mm256_loadu_si256((const __m256i *)(src + i));
+        __m256i old = _mm256_loadu_si256((const __m256i *)(dst + i));
+        __m256i merged = _mm256_or_si256(_mm256_and_si256(old, alpha), pixels);
+        __m256i empty = _mm256_cmpeq_epi32(pixels, zero);
+        _mm256_storeu_si256((__m256i *)(dst + i), _mm256_blendv_epi8(merged, old, empty));
     }
+    merge_row_scalar(dst + i, src + i, count - i);
 }
+#endif
 
+struct PixelKernels {
+    const char *name;  // The instruction set, "scalar", "sse4" or "avx2"
+    void (*merge_row)(uint32_t *dst, const uint32_t *src, Py_ssize_t count);
+};
 
-static PyObject *method_add_surface(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
-    PyObject *surface_image;
+static const struct PixelKernels KERNELS[] = {
+    {"scalar", merge_row_scalar},
+#ifdef PIXEL_SIMD
+    {"sse4", merge_row_sse4},
+    {"avx2", merge_row_avx2},
+#endif
+};
 
-    float A_x;
-    float A_y;
-    float A_z;
+static const struct PixelKernels *kernels = KERNELS;  // The kernels used, set by select_kernels
 
-    float B_x;
-    float B_y;
-    float B_z;
+/*
+ * Choose the fastest kernels the CPU supports. The NOSTALGIAE_SIMD environment variable can name slower ones
+ * ("scalar", "sse4"), to compare them.
+ */
+static void select_kernels() {
+    int level = 0;  // Index in KERNELS
+#ifdef PIXEL_SIMD
+#ifdef _MSC_VER
+    int info[4];
+    __cpuid(info, 0);
+    int max_leaf = info[0];
+    __cpuid(info, 1);
+    bool sse4 = info[2] & (1 << 19);
+    bool avx = (info[2] & (1 << 27)) && (info[2] & (1 << 28)) && (_xgetbv(0) & 6) == 6;  // OSXSAVE, AVX, YMM saved
+    bool avx2 = false;
+    if (avx && max_leaf >= 7) {
+        __cpuidex(info, 7, 0);
+        avx2 = info[1] & (1 << 5);
+    }
+#else
+    __builtin_cpu_init();
+    bool sse4 = __builtin_cpu_supports("sse4.1");
+    bool avx2 = __builtin_cpu_supports("avx2");
+#endif
+    level = avx2 ? 2 : sse4 ? 1 : 0;
+#endif
+    const char *limit = getenv("NOSTALGIAE_SIMD");
+    for (int i = 0; limit != nullptr && i < level; ++i)
+        if (strcmp(limit, KERNELS[i].name) == 0)
+            level = i;
+    kernels = KERNELS + level;
+}
 
-    float C_x = FP_NAN;
-    float C_y = FP_NAN;
-    float C_z = FP_NAN;
+/*
+ * Apply the lights to the pixel of a hit.
+ */
+inline uint32_t shade_pixel(const struct Hit *hit, struct Light *lights, bool use_lights, struct Cost *cost) {
+    float lighting[3] = {1.0f, 1.0f, 1.0f};  // Without lights, the pixel is kept as it is
+    if (use_lights && hit->pixel)
+        get_lighting(hit->inter, lights, lighting, cost);
+    return apply_lighting(hit->pixel, lighting);
+}
 
-    bool del = false;
+/*
+ * The surface to test first at the next cast. The volatile surfaces are freed after the cast, so they can't be kept.
+ */
+inline struct Surface *next_hint(struct Surface *surface) {
+    return surface != nullptr && !surface->del ? surface : nullptr;
+}
 
-    static char *kwlist[] = {"image", "A_x", "A_y", "A_z", "B_x", "B_y", "B_z","C_x", "C_y", "C_z", "rm",NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "Offffff|fffp", kwlist,
-                                     &surface_image, &A_x, &A_y, &A_z, &B_x, &B_y, &B_z, &C_x, &C_y, &C_z, &del))
-        return NULL;
+/*
+ * The surfaces that may be hit by the rays of a tile of TILE_SIZE x TILE_SIZE pixels.
+ * They are in the order of the lists: first the ones of the caster, then the ones of the scene,
+ * which are static, so the own surfaces win the ties.
+ */
+struct Tile {
+    struct Surface **surfaces;
+    Py_ssize_t own_count;  // Number of surfaces of the caster
+    Py_ssize_t count;
+};
 
-    struct Surface *surface = (Surface *) malloc(sizeof(struct Surface));
-    surface->pos.A.x = A_x;
-    surface->pos.A.y = A_y;
-    surface->pos.A.z = A_z;
-    surface->pos.B.x = B_x;
-    surface->pos.B.y = B_y;
-    surface->pos.B.z = B_z;
-    surface->parent = surface_image;
-    surface->del = del;
+/*
+ * Find the closest pixel hit by the ray among the surfaces of its tile.
+ */
+inline struct Hit trace_hit(struct pos2 ray, const struct Tile *tile, float max_dist, struct Surface **hint,
+                            struct Cost *cost) {
+    struct Hit hit;
+    hit.pixel = 0;  // alloc 4 bytes for the pixel
+    hit.distance = max_dist;
+    hit.surface = nullptr;
+    hit.ahead = false;
+    trace_hint(ray, *hint, max_dist, &hit, cost);
+    trace_pixel(ray, tile->surfaces, tile->count, max_dist, ALL_SURFACES, &hit, cost);
+    *hint = next_hint(hit.surface);
+    return hit;
+}
 
-    if (_get_3DBuffer_from_Surface(surface_image, &(surface->buffer))) {
-        PyErr_SetString(PyExc_ValueError, "Not a valid surface");
-        free(surface);
-        return NULL;
-    }
-    Py_INCREF(surface_image); // We need to keep the surface alive to make sure the buffer is valid.
+/*
+ * What the deferred mode keeps of a pixel in the G-buffer: the pixel before the lights, and where it was found.
+ * A pixel of 0 was not cast, or nothing was hit.
+ */
+struct GSample {
+    uint32_t pixel;
+    vec3 inter;
+};
+static_assert(sizeof(struct GSample) == 16, "Unexpected GSample layout");
 
-    surface->next = self->surfaces; // Push the surface on top of the stack.
-    self->surfaces = surface;
+inline void store_sample(struct GSample *sample, const struct Hit *hit) {
+    sample->pixel = hit->pixel;
+    sample->inter = hit->inter;
+}
 
-    vec3 C;
-    if (C_x == FP_NAN || C_y == FP_NAN || C_z == FP_NAN)
-        C = {A_x, B_y, A_z}; // define a new vector C bellow A and at the same level as B
-    else
-        C = {C_x, C_y, C_z};
+/*
+ * Second pass of the deferred mode: apply the lights to the samples of a G-buffer and write them on the screen.
+ * The lights are culled by tile of TILE_SIZE x TILE_SIZE pixels: the point lights not reaching the bounding box
+ * of the points seen in a tile are not evaluated by its pixels.
+ */
+static bool shade_gbuffer(const struct GSample *samples, uint32_t *buf, Py_ssize_t pitch, Py_ssize_t width, Py_ssize_t height,
+                          struct Light *lights, bool use_lights, uint16_t *costs) {
+    Py_ssize_t light_count = 0;
+    for (struct Light *light = lights; light != nullptr; light = light->next)
+        light_count++;
+    struct Light **tile_lights = (Light **) malloc(sizeof(struct Light *) * MAX(light_count, 1));
+    if (tile_lights == nullptr) {
+        PyErr_NoMemory();
+        return false;
+    }
 
-    surface->bc = C;
+    for (Py_ssize_t top = 0; top < height; top += TILE_SIZE) {
+        Py_ssize_t bottom = MIN(top + TILE_SIZE, height);
+        for (Py_ssize_t left = 0; left < width; left += TILE_SIZE) {
+            Py_ssize_t right = MIN(left + TILE_SIZE, width);
+
+            vec3 min = {INFINITY, INFINITY, INFINITY};
+            vec3 max = {-INFINITY, -INFINITY, -INFINITY};
+            for (Py_ssize_t y = top; y < bottom; ++y)
+                for (Py_ssize_t x = left; x < right; ++x) {
+                    const struct GSample *sample = samples + y * width + x;
+                    if (!sample->pixel)
+                        continue;
+                    min = {MIN(min.x, sample->inter.x), MIN(min.y, sample->inter.y), MIN(min.z, sample->inter.z)};
+                    max = {MAX(max.x, sample->inter.x), MAX(max.y, sample->inter.y), MAX(max.z, sample->inter.z)};
+                }
+            if (min.x > max.x)
+                continue;  // Nothing was hit in the tile
+
+            Py_ssize_t count = 0;
+            for (struct Light *light = lights; use_lights && light != nullptr; light = light->next) {
+                if (!light->enabled)
+                    continue;
+                if (!light->spot) {
+                    vec3 gap = {MAX(0.f, MAX(min.x - light->pos.x, light->pos.x - max.x)),
+                                MAX(0.f, MAX(min.y - light->pos.y, light->pos.y - max.y)),
+                                MAX(0.f, MAX(min.z - light->pos.z, light->pos.z - max.z))};
+                    if (vec3_dot(gap, gap) > light->range2 * (1.f + EPSILON))
+                        continue;  // Out of range of the whole tile
+                }
+                tile_lights[count++] = light;
+            }
 
-    get_norm_of_plane(surface->pos.A, surface->pos.B, C, &(surface->pos.C));
+            for (Py_ssize_t y = top; y < bottom; ++y)
+                for (Py_ssize_t x = left; x < right; ++x) {
+                    const struct GSample *sample = samples + y * width + x;
+                    if (!sample->pixel)
+                        continue;
+                    float lighting[3] = {1.0f, 1.0f, 1.0f};  // Without lights, the pixel is kept as it is
+                    if (use_lights) {
+                        lighting[0] = lighting[1] = lighting[2] = 0.0f;
+                        for (Py_ssize_t i = 0; i < count; ++i)
+                            add_light(tile_lights[i], sample->inter, lighting);
+                        clamp_lighting(lighting);
+                        if (costs != nullptr)
+                            costs[2 * (y * width + x) + 1] = (uint16_t)MIN(count, UINT16_MAX);
+                    }
+                    uint32_t pixel = apply_lighting(sample->pixel, lighting);
+                    if (pixel != 0)   // If the pixel is empty, don't write it.
+                        put_pixel(buf + y * pitch + x, pixel);
+                }
+        }
+    }
 
-    Py_RETURN_NONE;
+    free(tile_lights);
+    return true;
 }
 
-static PyObject *method_add_light(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+/*
+ * Compute the data of a light used by each pixel, after the light changed.
+ */
+inline void update_light(struct Light *light) {
+    light->axis = vec3_sub(light->direction, light->pos);
+    light->axis_length2 = vec3_dot(light->axis, light->axis);
+    light->axis_length = sqrtf(light->axis_length2);
+    light->range2 = light->intensity * light->intensity;
+}
+
+/*
+ * Get the closest intersection between a ray and a list of surfaces.
+ */
+float get_closest_intersection(pos2 ray, float max_distance, struct Surface *surfaces) {
+    struct Hit hit;
+    hit.pixel = 0;
+    hit.distance = max_distance;
+    hit.surface = nullptr;
+    hit.ahead = false;
+    struct Cost cost = {0, 0};
+    for (; surfaces != nullptr; surfaces = surfaces->next)
+        trace_surface(ray, surfaces, max_distance, &hit, &cost);
+
+    return hit.distance;
+}
+
+/*
+ * Get the pixels of a pygame Surface, or of a (buffer, width, height[, pitch]) tuple.
+ * The buffer of the tuple can be any C-contiguous object with the buffer protocol (bytearray, memoryview,
+ * NumPy array...) aligned on 4 bytes, holding 4 bytes per pixel in the order of a 32 bits Surface: blue, green, red, alpha.
+ * pitch is the number of bytes between the start of two rows, 4 * width by default.
+ * The buffer must be released with PyBuffer_Release once the pixels are not used anymore.
+ * Returns true and sets an exception if the object is not valid, name is the argument given in the message.
+ */
+static bool _get_pixels(PyObject *object, const char *name, bool writable, Py_buffer *buffer, struct Texture *texture) {
+    Py_ssize_t width, height, pitch = -1;
+    if (PyTuple_Check(object)) {
+        PyObject *exporter;
+        if (!PyArg_ParseTuple(object, "Onn|n", &exporter, &width, &height, &pitch))
+            return true;
+        if (width <= 0 || height <= 0) {
+            PyErr_Format(PyExc_ValueError, "the width and height of %s must be greater than 0", name);
+            return true;
+        }
+        if (pitch == -1)
+            pitch = 4 * width;
+        if (pitch < 4 * width || pitch % 4 != 0) {
+            PyErr_Format(PyExc_ValueError, "the pitch of %s must be a multiple of 4, at least 4 * width", name);
+            return true;
+        }
+        if (PyObject_GetBuffer(exporter, buffer, writable ? PyBUF_WRITABLE : PyBUF_SIMPLE))
+            return true;
+        if (buffer->len < (height - 1) * pitch + 4 * width) {
+            PyBuffer_Release(buffer);
+            PyErr_Format(PyExc_ValueError, "the buffer of %s is too small for its width, height and pitch", name);
+            return true;
+        }
+        if ((uintptr_t)buffer->buf % 4 != 0) {  // The pixels are read as uint32_t
+            PyBuffer_Release(buffer);
+            PyErr_Format(PyExc_ValueError, "the buffer of %s must be aligned on 4 bytes", name);
+            return true;
+        }
+    } else {
+        PyObject *view = PyObject_CallMethod(object, "get_view", "y", "2");  // width * height pixels
+        if (view == NULL || PyObject_GetBuffer(view, buffer, PyBUF_STRIDES)) {
+            Py_XDECREF(view);
+            PyErr_Format(PyExc_ValueError, "%s is not a valid surface", name);
+            return true;
+        }
+        Py_DECREF(view);
+        if (buffer->ndim != 2 || buffer->itemsize != 4) {
+            PyBuffer_Release(buffer);
+            PyErr_Format(PyExc_ValueError, "%s is not a valid surface", name);
+            return true;
+        }
+        width = buffer->shape[0];
+        height = buffer->shape[1];
+        pitch = buffer->strides[1];
+    }
+
+    texture->pixels = (uint32_t *)buffer->buf;
+    texture->width = width;
+    texture->height = height;
+    texture->pitch = pitch / 4;
+    texture->x = texture->y = 0;
+    return false;
+}
+
+/*
+ * Shrink a texture of an image to the bounding box of its visible pixels.
+ * crop receives the bounding box in fractions of the texture: left, top, right, bottom.
+ * Only the blocks of the opacity mask with a visible pixel are looked at.
+ * A texture without any visible pixel is left as it is.
+ */
+static void crop_texture(const struct Image *image, struct Texture *texture, float crop[4]) {
+    Py_ssize_t min_x = texture->width, min_y = texture->height, max_x = -1, max_y = -1;
+
+    Py_ssize_t first_x = texture->x >> OPACITY_BLOCK_SHIFT;
+    Py_ssize_t last_x = (texture->x + texture->width - 1) >> OPACITY_BLOCK_SHIFT;
+    Py_ssize_t first_y = texture->y >> OPACITY_BLOCK_SHIFT;
+    Py_ssize_t last_y = (texture->y + texture->height - 1) >> OPACITY_BLOCK_SHIFT;
+    for (Py_ssize_t block_y = first_y; block_y <= last_y; ++block_y)
+        for (Py_ssize_t block_x = first_x; block_x <= last_x; ++block_x) {
+            Py_ssize_t block = block_y * image->opacity_pitch + block_x;
+            if (!(image->opacity[block >> 3] & (1 << (block & 7))))
+                continue;
+            // The pixels of the block inside the texture
+            Py_ssize_t start_x = MAX(0, (block_x << OPACITY_BLOCK_SHIFT) - texture->x);
+            Py_ssize_t end_x = MIN(texture->width, ((block_x + 1) << OPACITY_BLOCK_SHIFT) - texture->x);
+            Py_ssize_t start_y = MAX(0, (block_y << OPACITY_BLOCK_SHIFT) - texture->y);
+            Py_ssize_t end_y = MIN(texture->height, ((block_y + 1) << OPACITY_BLOCK_SHIFT) - texture->y);
+            for (Py_ssize_t y = start_y; y < end_y; ++y)
+                for (Py_ssize_t x = start_x; x < end_x; ++x)
+                    if (((const unsigned char *)(texture->pixels + y * texture->pitch + x))[ALPHA]) {
+                        min_x = MIN(min_x, x);
+                        max_x = MAX(max_x, x);
+                        min_y = MIN(min_y, y);
+                        max_y = MAX(max_y, y);
+                    }
+        }
+
+    if (max_x < 0) {  // Nothing is visible
+        crop[0] = crop[1] = 0.f;
+        crop[2] = crop[3] = 1.f;
+        return;
+    }
+
+    crop[0] = (float)min_x / (float)texture->width;
+    crop[1] = (float)min_y / (float)texture->height;
+    crop[2] = (float)(max_x + 1) / (float)texture->width;
+    crop[3] = (float)(max_y + 1) / (float)texture->height;
+
+    texture->pixels += min_y * texture->pitch + min_x;
+    texture->x += min_x;
+    texture->y += min_y;
+    texture->width = max_x + 1 - min_x;
+    texture->height = max_y + 1 - min_y;
+}
+
+/*
+ * Number of bytes of the opacity mask of an image, pitch receives its number of blocks in a row.
+ */
+inline Py_ssize_t opacity_size(Py_ssize_t width, Py_ssize_t height, Py_ssize_t *pitch) {
+    *pitch = ((width - 1) >> OPACITY_BLOCK_SHIFT) + 1;
+    return ((*pitch * (((height - 1) >> OPACITY_BLOCK_SHIFT) + 1)) >> 3) + 1;
+}
+
+/*
+ * Give an image an opacity mask where every block is visible, without reading its pixels.
+ * The image of a volatile surface is often drawn once (a copy made for the frame),
+ * reading all its pixels would cost more than the mask saves. It is prepared if it is used again.
+ * Returns false and sets an exception if there is not enough memory.
+ */
+static bool skip_image_preparation(struct Image *image) {
+    Py_ssize_t size = opacity_size(image->texture.width, image->texture.height, &(image->opacity_pitch));
+    image->opacity = (uint8_t *) malloc(size);
+    if (image->opacity == nullptr) {
+        PyErr_NoMemory();
+        return false;
+    }
+    memset(image->opacity, 0xff, size);
+    image->prepared = false;
+    image->opaque = image->texture;
+    image->crop[0] = image->crop[1] = 0.f;
+    image->crop[2] = image->crop[3] = 1.f;
+    return true;
+}
+
+/*
+ * Compute the opacity mask of an image, and the bounding box of its visible pixels.
+ * The pixels of the image are expected to stay the same while the image is used.
+ * Returns false and sets an exception if there is not enough memory, the image is then left as it was.
+ */
+static bool prepare_image(struct Image *image) {
+    const struct Texture *texture = &(image->texture);
+    Py_ssize_t pitch;
+    uint8_t *opacity = (uint8_t *) calloc(opacity_size(texture->width, texture->height, &pitch), 1);
+    if (opacity == nullptr) {
+        PyErr_NoMemory();
+        return false;
+    }
+    free(image->opacity);  // The mask of skip_image_preparation
+    image->opacity = opacity;
+    image->opacity_pitch = pitch;
+    image->prepared = true;
+
+    for (Py_ssize_t y = 0; y < texture->height; ++y) {
+        const unsigned char *row = (const unsigned char *)(texture->pixels + y * texture->pitch);
+        Py_ssize_t row_block = (y >> OPACITY_BLOCK_SHIFT) * image->opacity_pitch;
+        for (Py_ssize_t x = 0; x < texture->width; ++x)
+            if (row[4 * x + ALPHA]) {
+                Py_ssize_t block = row_block + (x >> OPACITY_BLOCK_SHIFT);
+                image->opacity[block >> 3] |= 1 << (block & 7);
+            }
+    }
+
+    image->opaque = image->texture;
+    crop_texture(image, &(image->opaque), image->crop);
+    return true;
+}
+
+/*
+ * Create the image of a pygame Surface or of a pixel buffer tuple (see _get_pixels), used once,
+ * and add it to a list of images. The opacity mask is only computed if prepare is true.
+ * Returns NULL and sets an exception if the object is not a valid image.
+ */
+static struct Image *create_image(PyObject *parent, struct Image **list, bool prepare) {
+    struct Image *image = (Image *) malloc(sizeof(struct Image));
+    if (image == nullptr)
+        return (Image *) PyErr_NoMemory();
+    if (_get_pixels(parent, "image", false, &(image->buffer), &(image->texture))) {
+        free(image);
+        return NULL;
+    }
+    image->opacity = nullptr;
+    if (prepare ? !prepare_image(image) : !skip_image_preparation(image)) {
+        PyBuffer_Release(&(image->buffer));
+        free(image);
+        return NULL;
+    }
+    Py_INCREF(parent); // We need to keep the surface alive to make sure the buffer is valid.
+    image->parent = parent;
+    image->scene_file = nullptr;
+    image->refcount = 1;
+    link_image(image, list);
+    return image;
+}
+
+/*
+ * Get the image of a pygame Surface or of a pixel buffer tuple, sharing it with the other surfaces of the caster
+ * if possible. A new image is only prepared for a persistent surface (prepare), a shared one always is.
+ * Returns NULL and sets an exception if the object is not a valid image.
+ */
+static struct Image *acquire_image(RayCasterObject *caster, PyObject *parent, bool prepare) {
+    for (struct Image *image = caster->images; image != nullptr; image = image->next) {
+        if (image->parent == parent) {
+            if (!image->prepared && !prepare_image(image))
+                return NULL;
+            image->refcount++;
+            return image;
+        }
+    }
+    return create_image(parent, &(caster->images), prepare);
+}
+
+/*
+ * Select the part of the image displayed by a surface.
+ * rect is a (x, y, width, height) tuple in pixels, or NULL to use the whole image.
+ * Returns true and sets an exception if the rect is not valid.
+ */
+inline bool _get_texture_from_rect(struct Image *image, PyObject *rect, struct Texture *texture) {
+    *texture = image->texture;
+    if (rect == NULL || rect == Py_None)
+        return false;
+
+    Py_ssize_t x, y, width, height;
+    if (!PyArg_ParseTuple(rect, "nnnn", &x, &y, &width, &height))
+        return true;
+
+    if (x < 0 || y < 0 || width <= 0 || height <= 0
+        || x + width > image->texture.width || y + height > image->texture.height) {
+        PyErr_SetString(PyExc_ValueError, "rect must be inside the image");
+        return true;
+    }
+
+    texture->pixels += y * texture->pitch + x;
+    texture->x = x;
+    texture->y = y;
+    texture->width = width;
+    texture->height = height;
+    return false;
+}
+
+/*
+ * Classify a surface and compute the length of its sides, once its points and its normal are known.
+ */
+inline void set_surface_constants(struct Surface *surface) {
+    vec3 normal = surface->pos.C;
+    if (normal.y == 0.f && normal.z == 0.f)
+        surface->axis = 0;  // A wall with a constant x
+    else if (normal.x == 0.f && normal.z == 0.f)
+        surface->axis = 1;  // A floor, a ceiling or a tabletop
+    else if (normal.x == 0.f && normal.y == 0.f)
+        surface->axis = 2;  // A wall with a constant z
+    else
+        surface->axis = -1;
+    surface->width_length = vec3_dist(surface->bc, surface->pos.B);
+    surface->height_length = vec3_dist(surface->bc, surface->pos.A);
+}
+
+/*
+ * Compute the corner C, the normal and the bounding box of a surface from its points.
+ */
+inline void set_surface_geometry(struct Surface *surface, vec3 A, vec3 B, vec3 C) {
+    surface->pos.A = A;
+    surface->pos.B = B;
+    surface->bc = C;
+    get_norm_of_plane(A, B, C, &(surface->pos.C));
+    surface->min = {MIN(A.x, B.x), MIN(A.y, B.y), MIN(A.z, B.z)};
+    surface->max = {MAX(A.x, B.x), MAX(A.y, B.y), MAX(A.z, B.z)};
+    set_surface_constants(surface);
+}
+
+/*
+ * Set the geometry of a surface displaying a frame: the quad A, B, C is shrunk to the visible part of the texture.
+ */
+inline void set_cropped_geometry(struct Surface *surface, const float crop[4], vec3 A, vec3 B, vec3 C) {
+    // C is the bottom left corner, u goes from C to the bottom right corner B, and v from C to the top left corner A.
+    vec3 u = vec3_sub(B, C);
+    vec3 v = vec3_sub(A, C);
+    vec3 left = vec3_add(C, vec3_dot_float(u, crop[0]));
+    vec3 right = vec3_add(C, vec3_dot_float(u, crop[2]));
+    vec3 top = vec3_dot_float(v, 1.f - crop[1]);
+    vec3 bottom = vec3_dot_float(v, 1.f - crop[3]);
+
+    set_surface_geometry(surface, vec3_add(left, top), vec3_add(right, bottom), vec3_add(left, bottom));
+}
+
+/*
+ * Set the geometry of a billboard so it spreads along the horizontal direction (dx, 0, dz).
+ */
+inline void orient_billboard(struct Surface *surface, float dx, float dz) {
+    vec3 anchor = {surface->anchor.x + surface->shift * dx, surface->anchor.y, surface->anchor.z + surface->shift * dz};
+    vec3 A = {anchor.x + surface->half_width * dx, anchor.y + surface->height, anchor.z + surface->half_width * dz};
+    vec3 B = {anchor.x - surface->half_width * dx, anchor.y, anchor.z - surface->half_width * dz};
+    set_surface_geometry(surface, A, B, {A.x, B.y, A.z});
+}
+
+/*
+ * Turn all the billboards of the caster toward a camera looking at the given angle around the y axis.
+ */
+inline void orient_billboards(RayCasterObject *caster, float angle_y) {
+    // The billboards are perpendicular to the direction of the camera (cos(angle_y), 0, sin(angle_y)).
+    float dx = -sinf(angle_y);
+    float dz = cosf(angle_y);
+    for (struct Surface *surface = caster->surfaces; surface != nullptr; surface = surface->next)
+        if (surface->billboard)
+            orient_billboard(surface, dx, dz);
+}
+
+/*
+ * Acquire the image of a frame, given as a pygame Surface or as a (Surface, rect) tuple.
+ * The frame is only cropped to its visible pixels if the image is prepared, see acquire_image.
+ * Returns true and sets an exception if the frame is not valid.
+ */
+static bool acquire_frame(RayCasterObject *caster, PyObject *surface_image, PyObject *rect, bool prepare,
+                          struct Frame *frame) {
+    frame->image = acquire_image(caster, surface_image, prepare);
+    if (frame->image == NULL)
+        return true;
+    if (rect == NULL || rect == Py_None) {  // The whole image was already cropped
+        frame->texture = frame->image->opaque;
+        memcpy(frame->crop, frame->image->crop, sizeof(frame->crop));
+        return false;
+    }
+    if (_get_texture_from_rect(frame->image, rect, &(frame->texture))) {
+        release_image(frame->image);
+        return true;
+    }
+    if (frame->image->prepared) {
+        crop_texture(frame->image, &(frame->texture), frame->crop);
+    } else {
+        frame->crop[0] = frame->crop[1] = 0.f;
+        frame->crop[2] = frame->crop[3] = 1.f;
+    }
+    return false;
+}
+
+/*
+ * Select the frame displayed by a surface.
+ * surface_image is either a pygame Surface, displayed whole or only its rect,
+ * or the id of an animation, displaying the frame index or the frame shown at time for the frame rate fps.
+ * prepare is true for a persistent surface, see acquire_image.
+ * Returns true and sets an exception if the image, the rect or the animation is not valid.
+ */
+static bool select_frame(RayCasterObject *caster, PyObject *surface_image, PyObject *rect, bool prepare,
+                         Py_ssize_t index, float time, float fps, struct Frame *frame) {
+    if (!PyLong_Check(surface_image))
+        return acquire_frame(caster, surface_image, rect, prepare, frame);
+
+    Py_ssize_t id = PyLong_AsSsize_t(surface_image);
+    if (id < 0 || id >= caster->animation_count) {
+        if (!PyErr_Occurred())
+            PyErr_SetString(PyExc_ValueError, "Unknown animation");
+        return true;
+    }
+    if (rect != NULL && rect != Py_None) {
+        PyErr_SetString(PyExc_ValueError, "rect can not be used with an animation");
+        return true;
+    }
+
+    struct Animation *animation = caster->animations + id;
+    if (fps > 0.f)
+        index = (Py_ssize_t)floorf(time * fps);
+    index %= animation->frame_count;  // Animations loop
+    if (index < 0)
+        index += animation->frame_count;
+
+    *frame = animation->frames[index];
+    frame->image->refcount++;
+    return false;
+}
+
+/*
+ * Create a surface displaying a frame and push it on top of the surfaces of the caster.
+ * The surface takes the reference of the frame on its image, the geometry of the surface is not set.
+ */
+static struct Surface *push_surface(RayCasterObject *caster, struct Frame *frame, bool del) {
+    struct Surface *surface = (Surface *) malloc(sizeof(struct Surface));
+    surface->image = frame->image;
+    surface->texture = frame->texture;
+    surface->del = del;
+    surface->billboard = false;
+    surface->grouped = false;
+    surface->room = 0;
+    surface->faces = nullptr;
+
+    surface->next = caster->surfaces; // Push the surface on top of the stack.
+    caster->surfaces = surface;
+    return surface;
+}
+
+/*
+ * Make sure a room is one of the MAX_ROOMS rooms, from first. Sets an exception if it is not.
+ */
+inline bool check_room(int room, int first) {
+    if (room >= first && room < MAX_ROOMS)
+        return true;
+    PyErr_Format(PyExc_ValueError, "room must be between %d and %d", first, MAX_ROOMS - 1);
+    return false;
+}
+
+//inline int count_surfaces(struct Surface *surface) {
+//    int count;
+//    for (count = 0; surface != nullptr; surface = surface->next)
+//        count++;
+//    return count;
+//}
+//
+//inline void print_surfaces(struct Surface *surface) {
+//    for (int i = 0; surface != nullptr; surface = surface->next, i++)
+//        printf("Surface %d: %p\n", i, surface);
+//    printf("\n");
+//}
+
+/*
+ * The shortest distance from the camera to the bounding box of a surface, so to any of its intersections.
+ */
+inline float box_distance(vec3 origin, const struct Surface *surface) {
+    vec3 outside = {
+        MAX(0.f, MAX(surface->min.x - EPSILON - origin.x, origin.x - surface->max.x - EPSILON)),
+        MAX(0.f, MAX(surface->min.y - EPSILON - origin.y, origin.y - surface->max.y - EPSILON)),
+        MAX(0.f, MAX(surface->min.z - EPSILON - origin.z, origin.z - surface->max.z - EPSILON)),
+    };
+    return vec3_length(outside);
+}
+
+inline float get_closest(vec3 camera_pos, struct Surface *surface) {
+//    float a_dist = vec3_dist(camera_pos, surface->pos.A);
+//    float b_dist = vec3_dist(camera_pos, surface->pos.B);
+//    return a_dist < b_dist ? a_dist : b_dist;
+    return fabsf( vec3_dot(surface->pos.C, surface->pos.A) - vec3_dot(surface->pos.C, camera_pos)) / vec3_length(surface->pos.C);
+}
+
+/*
+ * Compute what all the rays cast from the camera have in common for a surface, before casting them.
+ */
+inline void aim_surface(struct Surface *surface, vec3 camera_pos) {
+    if (surface->faces != nullptr) {  // The slab test of a box only needs its distance
+        surface->distance = box_distance(camera_pos, surface);
+        return;
+    }
+    surface->distance = get_closest(camera_pos, surface);
+    surface->facing = -vec3_dot(surface->pos.C, vec3_sub(camera_pos, surface->pos.A));
+}
+
+inline void aim_surfaces(struct Surface *surfaces, vec3 camera_pos) {
+    for (struct Surface *surface = surfaces; surface != nullptr; surface = surface->next)
+        aim_surface(surface, camera_pos);
+}
+
+
+/*
+ * Sort all given Surface objects by their distance to the camera.
+ */
+inline void depth_sort(vec3 camera_pos, RayCasterObject* caster) {
+    if (caster->surfaces == nullptr)
+        return;  // Everything may be in the scene
+    aim_surfaces(caster->surfaces, camera_pos);
+
+    bool swapped = true;
+    while (swapped) {
+        swapped = false;
+        struct Surface *prev = nullptr;
+        for (struct Surface *temp_surface = caster->surfaces; temp_surface->next != nullptr; temp_surface = temp_surface->next) {
+            if (temp_surface->distance > temp_surface->next->distance) {
+                swapped = true;
+                struct Surface *temp = temp_surface->next;
+                if (prev == nullptr) {
+                    caster->surfaces = temp;
+                    temp_surface->next = temp->next;
+                    temp->next = temp_surface;
+                } else {
+                    prev->next = temp;
+                    temp_surface->next = temp->next;
+                    temp->next = temp_surface;
+                }
+                break;
+            }
+
+            prev = temp_surface;
+        }
+    }
+}
+
+/*
+ * Parse the arguments of add_surface and push the surface on top of the surfaces of the caster.
+ * Returns NULL with an exception set on failure.
+ */
+static struct Surface *add_surface(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    PyObject *surface_image;
+
+    float A_x;
+    float A_y;
+    float A_z;
+
+    float B_x;
+    float B_y;
+    float B_z;
+
+    float C_x = NAN;
+    float C_y = NAN;
+    float C_z = NAN;
+
+    int del = false;  // "p" stores an int
+
+    PyObject *rect = NULL;
+
+    Py_ssize_t index = 0;
+    float time = 0.f;
+    float fps = 0.f;
+
+    int room = 0;
+
+    static char *kwlist[] = {"image", "A_x", "A_y", "A_z", "B_x", "B_y", "B_z","C_x", "C_y", "C_z", "rm", "rect",
+                             "frame", "time", "fps", "room", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "Offffff|fffpOnffi", kwlist,
+                                     &surface_image, &A_x, &A_y, &A_z, &B_x, &B_y, &B_z, &C_x, &C_y, &C_z, &del, &rect,
+                                     &index, &time, &fps, &room))
+        return NULL;
+
+    if (!check_room(room, 0))
+        return NULL;
+
+    struct Frame frame;
+    if (select_frame(self, surface_image, rect, !del, index, time, fps, &frame))
+        return NULL;
+    struct Surface *surface = push_surface(self, &frame, del);
+    surface->room = room;
+
+    vec3 C;
+    if (std::isnan(C_x) || std::isnan(C_y) || std::isnan(C_z))  // C was not given
+        C = {A_x, B_y, A_z}; // define a new vector C bellow A and at the same level as B
+    else
+        C = {C_x, C_y, C_z};
+
+    set_cropped_geometry(surface, frame.crop, {A_x, A_y, A_z}, {B_x, B_y, B_z}, C);
+    return surface;
+}
+
+static PyObject *method_add_surface(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    struct Surface *surface = add_surface(self, args, kwargs);
+    if (surface == nullptr)
+        return NULL;
+    if (is_static(surface))
+        self->static_version++;  // The static layers of the poses need to be traced again
+    Py_RETURN_NONE;
+}
+
+// The corners A, B and C of each face of a box, one bit per axis set where the corner is on the upper side
+static const int BOX_FACE_CORNERS[6][3] = {{6, 0, 4}, {3, 5, 1}, {0, 5, 4}, {6, 3, 2}, {2, 1, 0}, {7, 4, 5}};
+
+inline vec3 box_corner(vec3 min, vec3 max, int corner) {
+    return {corner & 1 ? max.x : min.x, corner & 2 ? max.y : min.y, corner & 4 ? max.z : min.z};
+}
+
+/*
+ * Add an axis-aligned box, traced with a single slab test instead of an intersection per face (see trace_box).
+ * faces holds the texture of each face, in the order -x, +x, -y, +y, -z, +z: a pygame Surface,
+ * a (Surface, rect) tuple such as an atlas frame, or None if the face is not displayed.
+ * Seen from outside the box, the textures of the sides are upright, and the top of the textures of the top
+ * and bottom faces is toward +z and -z.
+ */
+static PyObject *method_add_box(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    vec3 min;
+    vec3 max;
+    PyObject *faces;
+
+    int del = false;  // "p" stores an int
+    int room = 0;
+
+    static char *kwlist[] = {"min_x", "min_y", "min_z", "max_x", "max_y", "max_z", "faces", "rm", "room", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "ffffffO|pi", kwlist,
+                                     &min.x, &min.y, &min.z, &max.x, &max.y, &max.z, &faces, &del, &room))
+        return NULL;
+
+    if (min.x > max.x || min.y > max.y || min.z > max.z) {
+        PyErr_SetString(PyExc_ValueError, "min can't be greater than max");
+        return NULL;
+    }
+    if (!check_room(room, 0))
+        return NULL;
+
+    PyObject *sequence = PySequence_Fast(faces, "faces must be a sequence");
+    if (sequence == NULL)
+        return NULL;
+    if (PySequence_Fast_GET_SIZE(sequence) != 6) {
+        Py_DECREF(sequence);
+        PyErr_SetString(PyExc_ValueError, "faces must hold the texture of the 6 faces");
+        return NULL;
+    }
+
+    // A face is a pygame Surface or a (Surface, rect) tuple, such as an atlas frame.
+    struct Frame frames[6];
+    for (int i = 0; i < 6; ++i) {
+        PyObject *item = PySequence_Fast_GET_ITEM(sequence, i);
+        PyObject *surface_image = item;
+        PyObject *rect = NULL;
+        if (item == Py_None) {
+            frames[i].image = nullptr;
+            continue;
+        }
+        if (PyTuple_Check(item) && PyTuple_GET_SIZE(item) == 2) {
+            surface_image = PyTuple_GET_ITEM(item, 0);
+            rect = PyTuple_GET_ITEM(item, 1);
+        }
+        if (acquire_frame(self, surface_image, rect, !del, frames + i)) {
+            for (int j = 0; j < i; ++j)
+                if (frames[j].image != nullptr)
+                    release_image(frames[j].image);
+            Py_DECREF(sequence);
+            return NULL;
+        }
+    }
+    Py_DECREF(sequence);
+
+    struct Surface *box_faces = (Surface *) malloc(sizeof(struct Surface) * 6);
+    if (box_faces == nullptr) {
+        for (int i = 0; i < 6; ++i)
+            if (frames[i].image != nullptr)
+                release_image(frames[i].image);
+        return PyErr_NoMemory();
+    }
+    struct Frame box_frame = {};  // The textures are on the faces
+    struct Surface *box = push_surface(self, &box_frame, del);
+    box->room = room;
+    box->min = min;
+    box->max = max;
+    box->axis = -1;
+    box->faces = box_faces;
+    for (int i = 0; i < 6; ++i) {
+        struct Surface *face = box->faces + i;
+        face->image = frames[i].image;
+        if (face->image == nullptr)
+            continue;
+        face->texture = frames[i].texture;
+        face->faces = nullptr;
+        const int *corners = BOX_FACE_CORNERS[i];
+        set_cropped_geometry(face, frames[i].crop, box_corner(min, max, corners[0]),
+                             box_corner(min, max, corners[1]), box_corner(min, max, corners[2]));
+    }
+    if (is_static(box))
+        self->static_version++;  // The static layers of the poses need to be traced again
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *method_add_billboard(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    PyObject *surface_image;
+
+    float x;
+    float y;
+    float z;
+
+    float width;
+    float height;
+
+    int del = false;  // "p" stores an int
+
+    PyObject *rect = NULL;
+
+    Py_ssize_t index = 0;
+    float time = 0.f;
+    float fps = 0.f;
+
+    int room = 0;
+
+    static char *kwlist[] = {"image", "x", "y", "z", "width", "height", "rm", "rect", "frame", "time", "fps", "room", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "Offfff|pOnffi", kwlist,
+                                     &surface_image, &x, &y, &z, &width, &height, &del, &rect, &index, &time, &fps, &room))
+        return NULL;
+
+    if (width <= 0.f || height <= 0.f) {
+        PyErr_SetString(PyExc_ValueError, "width and height must be greater than 0");
+        return NULL;
+    }
+    if (!check_room(room, 0))
+        return NULL;
+
+    struct Frame frame;
+    if (select_frame(self, surface_image, rect, !del, index, time, fps, &frame))
+        return NULL;
+    struct Surface *surface = push_surface(self, &frame, del);
+    surface->room = room;
+
+    // The geometry is computed from the camera at each cast, a persistent billboard keeps facing it.
+    surface->billboard = true;
+    // Only the visible part of the texture is kept. The billboard spreads from +half_width (left of the texture)
+    // to -half_width (right of the texture) around its center.
+    surface->anchor = {x, y + height * (1.f - frame.crop[3]), z};
+    surface->shift = width / 2.f * (1.f - frame.crop[0] - frame.crop[2]);
+    surface->half_width = width / 2.f * (frame.crop[2] - frame.crop[0]);
+    surface->height = height * (frame.crop[3] - frame.crop[1]);
+    orient_billboard(surface, 0.f, 1.f);  // Until the next cast
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *method_register_animation(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    PyObject *frames;
+
+    static char *kwlist[] = {"frames", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O", kwlist, &frames))
+        return NULL;
+
+    PyObject *sequence = PySequence_Fast(frames, "frames must be a sequence");
+    if (sequence == NULL)
+        return NULL;
+
+    Py_ssize_t frame_count = PySequence_Fast_GET_SIZE(sequence);
+    if (frame_count == 0) {
+        Py_DECREF(sequence);
+        PyErr_SetString(PyExc_ValueError, "An animation needs at least one frame");
+        return NULL;
+    }
+
+    struct Animation animation;
+    animation.frames = (Frame *) malloc(sizeof(struct Frame) * frame_count);
+    if (animation.frames == nullptr) {
+        Py_DECREF(sequence);
+        return PyErr_NoMemory();
+    }
+    animation.frame_count = 0;
+
+    // A frame is a pygame Surface or a (Surface, rect) tuple, such as an atlas frame.
+    for (Py_ssize_t i = 0; i < frame_count; ++i) {
+        PyObject *item = PySequence_Fast_GET_ITEM(sequence, i);
+        PyObject *surface_image = item;
+        PyObject *rect = NULL;
+        if (PyTuple_Check(item) && PyTuple_GET_SIZE(item) == 2) {
+            surface_image = PyTuple_GET_ITEM(item, 0);
+            rect = PyTuple_GET_ITEM(item, 1);
+        }
+        if (acquire_frame(self, surface_image, rect, true, animation.frames + i)) {
+            for (Py_ssize_t j = 0; j < animation.frame_count; ++j)
+                release_image(animation.frames[j].image);
+            free(animation.frames);
+            Py_DECREF(sequence);
+            return NULL;
+        }
+        animation.frame_count++;
+    }
+    Py_DECREF(sequence);
+
+    struct Animation *animations = (Animation *) realloc(self->animations,
+                                                         sizeof(struct Animation) * (self->animation_count + 1));
+    if (animations == nullptr) {
+        for (Py_ssize_t i = 0; i < animation.frame_count; ++i)
+            release_image(animation.frames[i].image);
+        free(animation.frames);
+        return PyErr_NoMemory();
+    }
+    self->animations = animations;
+    self->animations[self->animation_count] = animation;
+
+    return PyLong_FromSsize_t(self->animation_count++);
+}
+
+/*
+ * Parse the arguments of add_light and create_light into a new light.
+ * Returns NULL if the arguments are not valid or the light can't be allocated.
+ */
+static struct Light *parse_light(PyObject *args, PyObject *kwargs) {
+
+    float light_x;
+    float light_y;
+    float light_z;
+
+    float light_intensity = 1.0;
+
+    float red = 1.0;
+    float green = 1.0;
+    float blue = 1.0;
+
+    float direction_x = NAN;
+    float direction_y = NAN;
+    float direction_z = NAN;
+
+    int enabled = true;  // "p" stores an int
+
+    static char *kwlist[] = {"x", "y", "z", "intensity", "red", "green", "blue", "direction_x", "direction_y", "direction_z",
+                             "enabled", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "fff|fffffffp", kwlist, &light_x, &light_y, &light_z, &light_intensity,
+                                     &red, &green, &blue, &direction_x, &direction_y, &direction_z, &enabled))
+        return NULL;
+
+    if (red > 1.0f)
+        red = 1.0f;
+    if (green > 1.0f)
+        green = 1.0f;
+    if (blue > 1.0f)
+        blue = 1.0f;
+
+    struct Light *light = (Light *) malloc(sizeof(struct Light));
+    if (light == nullptr)
+        return (Light *) PyErr_NoMemory();
+    light->pos.x = light_x;
+    light->pos.y = light_y;
+    light->pos.z = light_z;
+    light->intensity = light_intensity;
+    light->r = red;
+    light->g = green;
+    light->b = blue;
+    light->direction.x = direction_x;
+    light->direction.y = direction_y;
+    light->direction.z = direction_z;
+    light->spot = !std::isnan(direction_x);
+    light->enabled = enabled;
+    light->persistent = false;
+    update_light(light);
+
+    return light;
+}
+
+static PyObject *method_add_light(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    struct Light *light = parse_light(args, kwargs);
+    if (light == NULL)
+        return NULL;
+
+    light->next = self->lights;
+
+    self->use_lighting = true;
+    self->lights = light;
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *method_create_light(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    struct Light *light = parse_light(args, kwargs);
+    if (light == NULL)
+        return NULL;
+
+    light->persistent = true;  // The light stays until the caster is destroyed
+    light->next = self->lights;
+
+    self->use_lighting = true;
+    self->lights = light;
+
+    struct Light **light_handles = (Light **) realloc(self->light_handles,
+                                                      sizeof(struct Light *) * (self->light_handle_count + 1));
+    if (light_handles == nullptr) {
+        self->lights = light->next;
+        free(light);
+        return PyErr_NoMemory();
+    }
+    self->light_handles = light_handles;
+    self->light_handles[self->light_handle_count] = light;
+
+    return PyLong_FromSsize_t(self->light_handle_count++);
+}
+
+/*
+ * Parse an optional (x, y, z) tuple.
+ * Returns true and sets an exception if the object is not a valid tuple.
+ */
+inline bool _get_vec3(PyObject *object, vec3 *vec) {
+    return !PyArg_ParseTuple(object, "fff", &(vec->x), &(vec->y), &(vec->z));
+}
+
+static PyObject *method_set_light(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    Py_ssize_t handle;
+
+    PyObject *pos = NULL;
+    PyObject *intensity = NULL;
+    PyObject *color = NULL;
+    PyObject *direction = NULL;
+    PyObject *enabled = NULL;
+
+    static char *kwlist[] = {"handle", "pos", "intensity", "color", "direction", "enabled", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "n|$OOOOO", kwlist, &handle, &pos, &intensity, &color, &direction, &enabled))
+        return NULL;
+
+    if (handle < 0 || handle >= self->light_handle_count) {
+        PyErr_SetString(PyExc_ValueError, "Unknown light");
+        return NULL;
+    }
+
+    // Parse everything before changing the light, so a wrong argument does not leave it half updated.
+    struct Light light = *(self->light_handles[handle]);
+
+    if (pos != NULL && _get_vec3(pos, &(light.pos)))
+        return NULL;
+
+    if (intensity != NULL) {
+        light.intensity = (float)PyFloat_AsDouble(intensity);
+        if (PyErr_Occurred())
+            return NULL;
+    }
+
+    if (color != NULL) {
+        vec3 rgb;
+        if (_get_vec3(color, &rgb))
+            return NULL;
+        light.r = MIN(rgb.x, 1.0f);
+        light.g = MIN(rgb.y, 1.0f);
+        light.b = MIN(rgb.z, 1.0f);
+    }
+
+    if (direction == Py_None)  // A light without direction is a point light
+        light.spot = false;
+    else if (direction != NULL) {
+        if (_get_vec3(direction, &(light.direction)))
+            return NULL;
+        light.spot = true;
+    }
+
+    if (enabled != NULL) {
+        int is_enabled = PyObject_IsTrue(enabled);
+        if (is_enabled < 0)
+            return NULL;
+        light.enabled = is_enabled;
+    }
+
+    update_light(&light);
+    *(self->light_handles[handle]) = light;
+
+    Py_RETURN_NONE;
+}
+
+/*
+ * Add or remove the surfaces of a group from the surfaces of the caster.
+ */
+inline void show_group(RayCasterObject *caster, struct Group *group, bool visible) {
+    if (group->visible == visible)
+        return;
+    group->visible = visible;
+    if (!visible)
+        caster->surface_version++;  // The hidden surfaces must not be hit anymore
+    for (Py_ssize_t i = 0; i < group->surface_count; ++i) {
+        struct Surface *surface = group->surfaces[i];
+        if (visible) {
+            surface->next = caster->surfaces;
+            caster->surfaces = surface;
+            continue;
+        }
+        for (struct Surface **link = &(caster->surfaces); *link != nullptr; link = &((*link)->next))
+            if (*link == surface) {
+                *link = surface->next;
+                break;
+            }
+    }
+}
+
+/*
+ * Free the surfaces of the hidden groups, the other ones are freed with the surfaces of the caster.
+ */
+inline void free_hidden_groups(RayCasterObject *caster) {
+    for (Py_ssize_t i = 0; i < caster->group_count; ++i)
+        if (!caster->groups[i].visible)
+            for (Py_ssize_t j = 0; j < caster->groups[i].surface_count; ++j)
+                free_surface(caster->groups[i].surfaces[j]);
+}
+
+inline vec3 group_point(vec3 point, vec3 translation, float cos_yaw, float sin_yaw) {
+    return {
+        point.x * cos_yaw + point.z * sin_yaw + translation.x,
+        point.y + translation.y,
+        point.z * cos_yaw - point.x * sin_yaw + translation.z,
+    };
+}
+
+/*
+ * Free a group that create_group could not finish, with the surfaces it already added on top of the stack.
+ */
+static void discard_group(RayCasterObject *caster, struct Group *group) {
+    for (Py_ssize_t i = 0; i < group->surface_count; ++i) {
+        struct Surface *grouped = caster->surfaces;
+        caster->surfaces = grouped->next;
+        free_surface(grouped);
+    }
+    free(group->surfaces);
+    free(group->local);
+}
+
+static PyObject *method_create_group(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    PyObject *surfaces;
+
+    static char *kwlist[] = {"surfaces", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O", kwlist, &surfaces))
+        return NULL;
+
+    PyObject *sequence = PySequence_Fast(surfaces, "surfaces must be a sequence");
+    if (sequence == NULL)
+        return NULL;
+
+    Py_ssize_t surface_count = PySequence_Fast_GET_SIZE(sequence);
+    struct Group group;
+    group.surfaces = (Surface **) malloc(sizeof(struct Surface *) * (surface_count + 1));
+    group.local = (pos3 *) malloc(sizeof(struct pos3) * (surface_count + 1));
+    group.surface_count = 0;
+    group.visible = true;
+    if (group.surfaces == nullptr || group.local == nullptr) {
+        discard_group(self, &group);
+        Py_DECREF(sequence);
+        return PyErr_NoMemory();
+    }
+
+    // A surface is given as the arguments of add_surface: a tuple of positional arguments or a dict of keyword arguments.
+    // Its points are in the space of the group.
+    PyObject *no_args = PyTuple_New(0);
+    for (Py_ssize_t i = 0; i < surface_count; ++i) {
+        PyObject *item = PySequence_Fast_GET_ITEM(sequence, i);
+        struct Surface *surface = nullptr;
+        if (PyTuple_Check(item))
+            surface = add_surface(self, item, NULL);
+        else if (PyDict_Check(item))
+            surface = add_surface(self, no_args, item);
+        else
+            PyErr_SetString(PyExc_TypeError, "A surface must be a tuple or a dict of the arguments of add_surface");
+
+        if (surface == nullptr) {
+            discard_group(self, &group);
+            Py_DECREF(no_args);
+            Py_DECREF(sequence);
+            return NULL;
+        }
+
+        // The grouped surfaces move, they are never in the static layers of the poses
+        surface->del = false;  // The group keeps its surfaces
+        surface->grouped = true;
+        group.surfaces[group.surface_count] = surface;
+        group.local[group.surface_count] = {surface->pos.A, surface->pos.B, surface->bc};
+        group.surface_count++;
+    }
+    Py_DECREF(no_args);
+    Py_DECREF(sequence);
+
+    struct Group *groups = (Group *) realloc(self->groups, sizeof(struct Group) * (self->group_count + 1));
+    if (groups == nullptr) {
+        discard_group(self, &group);
+        return PyErr_NoMemory();
+    }
+    self->groups = groups;
+    self->groups[self->group_count] = group;
+
+    return PyLong_FromSsize_t(self->group_count++);
+}
+
+/*
+ * Move a group: its surfaces are turned around the y axis by yaw, then translated.
+ */
+static PyObject *method_set_group_transform(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    Py_ssize_t handle;
+    PyObject *translation_object = NULL;
+    float yaw = 0.f;
+    int visible = true;  // "p" stores an int
+    int rad = false;
+
+    static char *kwlist[] = {"group", "translation", "yaw", "visible", "rad", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "n|Ofpp", kwlist, &handle, &translation_object, &yaw, &visible, &rad))
+        return NULL;
+
+    if (handle < 0 || handle >= self->group_count) {
+        PyErr_SetString(PyExc_ValueError, "Unknown group");
+        return NULL;
+    }
+
+    vec3 translation = {0.f, 0.f, 0.f};
+    if (translation_object != NULL && translation_object != Py_None && _get_vec3(translation_object, &translation))
+        return NULL;
+
+    if (!rad)
+        yaw = yaw * (float)M_PI / 180.f;
+
+    struct Group *group = self->groups + handle;
+    show_group(self, group, visible);
+
+    float cos_yaw = cosf(yaw);
+    float sin_yaw = sinf(yaw);
+    for (Py_ssize_t i = 0; i < group->surface_count; ++i) {
+        struct pos3 *local = group->local + i;
+        set_surface_geometry(group->surfaces[i],
+                             group_point(local->A, translation, cos_yaw, sin_yaw),
+                             group_point(local->B, translation, cos_yaw, sin_yaw),
+                             group_point(local->C, translation, cos_yaw, sin_yaw));
+    }
+
+    Py_RETURN_NONE;
+}
+
+/*
+ * Add an opening through which the surfaces of a room are seen, such as a door. A and B are opposite corners of its quad.
+ */
+static PyObject *method_create_portal(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    float A_x;
+    float A_y;
+    float A_z;
+
+    float B_x;
+    float B_y;
+    float B_z;
+
+    int room;
+    int open = true;  // "p" stores an int
+
+    static char *kwlist[] = {"A_x", "A_y", "A_z", "B_x", "B_y", "B_z", "room", "open", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "ffffffi|p", kwlist,
+                                     &A_x, &A_y, &A_z, &B_x, &B_y, &B_z, &room, &open))
+        return NULL;
+
+    if (!check_room(room, 1))  // The room 0 is always traversed
+        return NULL;
+
+    struct Portal *portals = (Portal *) realloc(self->portals, sizeof(struct Portal) * (self->portal_count + 1));
+    if (portals == nullptr)
+        return PyErr_NoMemory();
+    self->portals = portals;
+
+    struct Portal *portal = portals + self->portal_count;
+    portal->min = {MIN(A_x, B_x), MIN(A_y, B_y), MIN(A_z, B_z)};
+    portal->max = {MAX(A_x, B_x), MAX(A_y, B_y), MAX(A_z, B_z)};
+    portal->room = room;
+    portal->open = open;
+
+    return PyLong_FromSsize_t(self->portal_count++);
+}
+
+static PyObject *method_set_portal(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    Py_ssize_t handle;
+    int open;  // "p" stores an int
+
+    static char *kwlist[] = {"portal", "open", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "np", kwlist, &handle, &open))
+        return NULL;
+
+    if (handle < 0 || handle >= self->portal_count) {
+        PyErr_SetString(PyExc_ValueError, "Unknown portal");
+        return NULL;
+    }
+
+    self->portals[handle].open = open;  // The rooms seen are found again at the next cast, by traverse_rooms
+    Py_RETURN_NONE;
+}
+
+static PyObject *method_clear_surfaces(RayCasterObject *self) {
+    // The groups are kept, without any surface.
+    free_hidden_groups(self);
+    for (Py_ssize_t i = 0; i < self->group_count; ++i) {
+        self->groups[i].surface_count = 0;
+        self->groups[i].visible = true;
+    }
+
+    struct Surface *next;
+    for (struct Surface *surface = self->surfaces; surface != nullptr; surface = next) {
+        next = surface->next;
+        free_surface(surface);
+    }
+    self->surfaces = nullptr;
+    self->static_version++;
+    self->surface_version++;
+    sweep_images(&(self->images));
+    Py_RETURN_NONE;
+}
+
+#define SCENE_LEAF_SIZE 4  // The largest number of surfaces in a leaf of the tree of a scene
+
+/*
+ * A node of the bounding volume hierarchy of a scene, built by make_scene.
+ * The nodes are stored depth first: the first child of an inner node follows it.
+ */
+struct SceneNode {
+    vec3 min;  // Bounding box of the surfaces below the node, EPSILON larger like the intersections
+    vec3 max;
+    uint32_t rooms;  // Bit r is set if a surface of room r is below the node
+    Py_ssize_t start;  // For a leaf, its first surface in SceneObject.leaves. For an inner node, its second child
+    Py_ssize_t count;  // Number of surfaces of a leaf, 0 for an inner node
+};
+
+struct t_SceneObject {
+    PyObject_HEAD
+    struct Surface *surfaces;  // The static surfaces, never changed once the scene is made
+    struct Image *images;  // Images used by the surfaces of the scene
+    struct Surface **list;  // The surfaces in the order of the list, so the ties between them keep that order
+    Py_ssize_t surface_count;
+    Py_ssize_t *leaves;  // Indexes in list of the surfaces of the leaves of the tree, one leaf after the other
+    struct SceneNode *nodes;  // The tree, nodes[0] is the root
+    Py_ssize_t node_count;
+    uint32_t used_rooms;  // Bit r is set if the scene has a surface of room r, except the room 0
+    vec3 room_min[MAX_ROOMS];  // The bounding box of the surfaces of each room used, see traverse_rooms
+    vec3 room_max[MAX_ROOMS];
+};
+
+void Scene_dealloc(SceneObject *self) {
+    struct Surface *next;
+    for (struct Surface *surface = self->surfaces; surface != nullptr; surface = next) {
+        next = surface->next;
+        free_surface(surface);
+    }
+    sweep_images(&(self->images));
+    free(self->list);
+    free(self->leaves);
+    free(self->nodes);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+inline vec3 surface_center(const struct Surface *surface) {
+    return {(surface->min.x + surface->max.x) / 2.f, (surface->min.y + surface->max.y) / 2.f,
+            (surface->min.z + surface->max.z) / 2.f};
+}
+
+/*
+ * Build the node of the tree of a scene holding the surfaces leaves[start, start + count), and the nodes below it.
+ * The surfaces are split in two halves along the longest side of the box of their centers.
+ * Returns the index of the node.
+ */
+static Py_ssize_t build_scene_node(SceneObject *scene, Py_ssize_t start, Py_ssize_t count) {
+    Py_ssize_t index = scene->node_count++;
+    struct SceneNode *node = scene->nodes + index;
+    vec3 center_min = {INFINITY, INFINITY, INFINITY};
+    vec3 center_max = {-INFINITY, -INFINITY, -INFINITY};
+    node->min = center_min;
+    node->max = center_max;
+    node->rooms = 0;
+    for (Py_ssize_t i = start; i < start + count; ++i) {
+        const struct Surface *surface = scene->list[scene->leaves[i]];
+        node->min = {MIN(node->min.x, surface->min.x - EPSILON), MIN(node->min.y, surface->min.y - EPSILON),
+                     MIN(node->min.z, surface->min.z - EPSILON)};
+        node->max = {MAX(node->max.x, surface->max.x + EPSILON), MAX(node->max.y, surface->max.y + EPSILON),
+                     MAX(node->max.z, surface->max.z + EPSILON)};
+        node->rooms |= 1u << surface->room;
+        vec3 center = surface_center(surface);
+        center_min = {MIN(center_min.x, center.x), MIN(center_min.y, center.y), MIN(center_min.z, center.z)};
+        center_max = {MAX(center_max.x, center.x), MAX(center_max.y, center.y), MAX(center_max.z, center.z)};
+    }
+
+    vec3 extent = vec3_sub(center_max, center_min);
+    int axis = extent.x >= extent.y && extent.x >= extent.z ? 0 : extent.y >= extent.z ? 1 : 2;
+    node->start = start;
+    node->count = count;
+    if (count <= SCENE_LEAF_SIZE || vec3_axis(extent, axis) <= 0.f)
+        return index;  // A leaf
+
+    Py_ssize_t half = count / 2;
+    struct Surface **list = scene->list;
+    std::nth_element(scene->leaves + start, scene->leaves + start + half, scene->leaves + start + count,
+                     [list, axis](Py_ssize_t a, Py_ssize_t b) {
+                         return vec3_axis(surface_center(list[a]), axis) < vec3_axis(surface_center(list[b]), axis);
+                     });
+    build_scene_node(scene, start, half);
+    Py_ssize_t second = build_scene_node(scene, start + half, count - half);
+    node = scene->nodes + index;
+    node->start = second;
+    node->count = 0;
+    return index;
+}
+
+/*
+ * Build the tree of the surfaces of a scene and the bounding box of each of its rooms, once all its surfaces are in.
+ * list, leaves and nodes must be allocated for the surfaces of the scene, see allocate_scene_tree.
+ */
+static void build_scene_tree(SceneObject *scene) {
+    scene->surface_count = 0;
+    scene->used_rooms = 0;
+    for (struct Surface *surface = scene->surfaces; surface != nullptr; surface = surface->next) {
+        scene->leaves[scene->surface_count] = scene->surface_count;
+        scene->list[scene->surface_count++] = surface;
+        int room = surface->room;
+        if (room == 0)
+            continue;
+        if (!(scene->used_rooms & (1u << room))) {
+            scene->used_rooms |= 1u << room;
+            scene->room_min[room] = surface->min;
+            scene->room_max[room] = surface->max;
+            continue;
+        }
+        scene->room_min[room] = {MIN(scene->room_min[room].x, surface->min.x), MIN(scene->room_min[room].y, surface->min.y),
+                                 MIN(scene->room_min[room].z, surface->min.z)};
+        scene->room_max[room] = {MAX(scene->room_max[room].x, surface->max.x), MAX(scene->room_max[room].y, surface->max.y),
+                                 MAX(scene->room_max[room].z, surface->max.z)};
+    }
+
+    scene->node_count = 0;
+    if (scene->surface_count > 0)
+        build_scene_node(scene, 0, scene->surface_count);
+}
+
+/*
+ * Allocate the tree of a scene of count surfaces. Returns false and sets an exception if there is not enough memory.
+ */
+static bool allocate_scene_tree(SceneObject *scene, Py_ssize_t count) {
+    scene->list = (Surface **) malloc(sizeof(struct Surface *) * (count + 1));
+    scene->leaves = (Py_ssize_t *) malloc(sizeof(Py_ssize_t) * (count + 1));
+    scene->nodes = (SceneNode *) malloc(sizeof(struct SceneNode) * (2 * count + 1));
+    if (scene->list == nullptr || scene->leaves == nullptr || scene->nodes == nullptr) {
+        PyErr_NoMemory();
+        return false;
+    }
+    return true;
+}
+
+/*
+ * If a segment enters the box of a node of a scene before max_t along it.
+ */
+inline bool segment_enters_node(const struct SceneNode *node, struct pos2 segment, float max_t) {
+    float t_min = 0.f;
+    float t_max = max_t;
+    for (int axis = 0; axis < 3; ++axis) {
+        float origin = vec3_axis(segment.A, axis);
+        float direction = vec3_axis(segment.B, axis);
+        float low = vec3_axis(node->min, axis);
+        float high = vec3_axis(node->max, axis);
+        if (direction == 0.f) {
+            if (origin < low || origin > high)
+                return false;
+            continue;
+        }
+        float t_low = (low - origin) / direction;
+        float t_high = (high - origin) / direction;
+        t_min = MAX(t_min, MIN(t_low, t_high));
+        t_max = MIN(t_max, MAX(t_low, t_high));
+    }
+    return t_min <= t_max;
+}
+
+/*
+ * Get the closest intersection between a ray and the surfaces of a scene, aimed at its origin.
+ * Only the nodes of the tree the ray enters before the closest intersection found so far are visited.
+ */
+float get_closest_scene_intersection(pos2 ray, float max_distance, const SceneObject *scene) {
+    struct Hit hit;
+    hit.pixel = 0;
+    hit.distance = max_distance;
+    hit.surface = nullptr;
+    hit.ahead = false;
+    struct Cost cost = {0, 0};
+    if (scene->node_count == 0)
+        return max_distance;
+
+    float length = vec3_length(ray.B);
+    Py_ssize_t stack[64];  // The tree is balanced, far less deep than that
+    int depth = 0;
+    stack[depth++] = 0;
+    while (depth > 0) {
+        const struct SceneNode *node = scene->nodes + stack[--depth];
+        if (!segment_enters_node(node, ray, hit.distance / length))
+            continue;
+        if (node->count == 0) {
+            stack[depth++] = node->start;
+            stack[depth++] = node - scene->nodes + 1;
+            continue;
+        }
+        for (Py_ssize_t i = node->start; i < node->start + node->count; ++i)
+            trace_surface(ray, scene->list[scene->leaves[i]], max_distance, &hit, &cost);
+    }
+    return hit.distance;
+}
+
+static PyTypeObject SceneType = {
+        .ob_base = PyVarObject_HEAD_INIT(NULL, 0)
+        .tp_name = "nostalgiaeraycasting.Scene",
+        .tp_basicsize = sizeof(SceneObject),
+        .tp_itemsize = 0,
+        .tp_dealloc = (destructor) Scene_dealloc,
+        .tp_flags = Py_TPFLAGS_DEFAULT,
+        .tp_doc = PyDoc_STR("Static surfaces shared by casters, made with RayCaster.make_scene"),
+};
+
+/*
+ * Move the persistent surfaces of the caster (not the billboards) into a new scene.
+ * The scene can't be changed anymore, any number of casters can be created with it.
+ */
+static PyObject *method_make_scene(RayCasterObject *self) {
+    SceneObject *scene = PyObject_New(SceneObject, &SceneType);
+    if (scene == NULL)
+        return NULL;
+    scene->surfaces = nullptr;
+    scene->images = nullptr;
+    scene->list = nullptr;
+    scene->leaves = nullptr;
+    scene->nodes = nullptr;
+    scene->node_count = 0;
+
+    Py_ssize_t static_count = 0;
+    for (struct Surface *surface = self->surfaces; surface != nullptr; surface = surface->next)
+        if (is_static(surface))
+            static_count++;
+    if (!allocate_scene_tree(scene, static_count)) {  // Before anything is moved
+        Py_DECREF(scene);
+        return NULL;
+    }
+
+    // The images also used by the other surfaces or the animations of the caster are duplicated for the scene,
+    // the others are given to the scene.
+    struct Surface *textured[6];
+    struct Surface *other_textured[6];
+    for (struct Surface *surface = self->surfaces; surface != nullptr; surface = surface->next) {
+        if (!is_static(surface))
+            continue;
+        int count = get_textured(surface, textured);
+        for (int i = 0; i < count; ++i) {
+            struct Image *image = textured[i]->image;
+            if (image->list != &(self->images))
+                continue;
+            Py_ssize_t static_uses = 0;
+            for (struct Surface *other = self->surfaces; other != nullptr; other = other->next) {
+                if (!is_static(other))
+                    continue;
+                int other_count = get_textured(other, other_textured);
+                for (int j = 0; j < other_count; ++j)
+                    if (other_textured[j]->image == image)
+                        static_uses++;
+            }
+            if (static_uses == image->refcount)
+                continue;
+            struct Image *copy;
+            for (copy = scene->images; copy != nullptr; copy = copy->next)
+                if (copy->parent == image->parent)
+                    break;
+            if (copy == nullptr && (copy = create_image(image->parent, &(scene->images), true)) == NULL) {
+                Py_DECREF(scene);
+                return NULL;
+            }
+            copy->refcount = 0;  // Until the surfaces are moved
+        }
+    }
+
+    // Move the surfaces, in the same order.
+    struct Surface **tail = &(scene->surfaces);
+    struct Surface **link = &(self->surfaces);
+    while (*link != nullptr) {
+        struct Surface *surface = *link;
+        if (!is_static(surface)) {
+            link = &(surface->next);
+            continue;
+        }
+        *link = surface->next;
+        surface->next = nullptr;
+        *tail = surface;
+        tail = &(surface->next);
+
+        int count = get_textured(surface, textured);
+        for (int i = 0; i < count; ++i) {
+            struct Image *image = textured[i]->image;
+            if (image->list != &(self->images))
+                continue;  // From a scene file, or already given to the scene
+            struct Image *copy;
+            for (copy = scene->images; copy != nullptr; copy = copy->next)
+                if (copy->parent == image->parent)
+                    break;
+            if (copy == nullptr) {
+                unlink_image(image);
+                link_image(image, &(scene->images));
+                continue;
+            }
+            textured[i]->texture.pixels = copy->texture.pixels + (textured[i]->texture.pixels - image->texture.pixels);
+            textured[i]->image = copy;
+            copy->refcount++;
+            release_image(image);
+        }
+    }
+
+    build_scene_tree(scene);
+    self->static_version++;
+    self->surface_version++;  // The hints point to the surfaces moved
+    return (PyObject *)scene;
+}
+
+static PyObject *method_clear_lights(RayCasterObject *self) {
+    // The lights created with create_light are kept, only their handles can change them.
+    struct Light *prev = nullptr;
+    struct Light *next;
+    for (struct Light *light = self->lights; light != nullptr; light = next) {
+        next = light->next;
+        if (light->persistent) {
+            prev = light;
+            continue;
+        }
+        free(light);
+        if (prev == nullptr)
+            self->lights = next;
+        else
+            prev->next = next;
+    }
+    self->use_lighting = self->lights != nullptr;
+    Py_RETURN_NONE;
+}
+
+/*
+ * Compiled scene files.
+ *
+ * A scene file holds the persistent surfaces of a caster, ready to be used without any computation:
+ *
+ *     SceneHeader
+ *     SceneTexture[texture_count]
+ *     SceneSurface[surface_count]
+ *     SceneBox[box_count]
+ *     pixels of every texture, BGRA, row by row, then its opacity mask, each aligned on 16 bytes
+ *
+ * A texture is a whole image (for example a texture atlas), each surface or face of a box displays a rect of it.
+ * Its opacity mask and the bounding box of its visible pixels are saved with it (see prepare_image),
+ * so loading a scene doesn't read any pixel: the pages of a texture are only touched when it is drawn.
+ *
+ * All the offsets are given in bytes from the start of the file, in the byte order of the machine.
+ * The file is mapped in memory, so the textures are never copied and the pages are shared between
+ * all the processes loading the same scene.
+ */
+
+#define SCENE_MAGIC "NSCN"
+#define SCENE_VERSION 5
+#define SCENE_NO_TEXTURE UINT32_MAX  // The texture of the faces of a box that are not displayed
+#define SCENE_ALIGNMENT 16
+
+struct SceneHeader {
+    char magic[4];  // SCENE_MAGIC
+    uint32_t version;  // SCENE_VERSION
+    uint32_t texture_count;
+    uint32_t surface_count;
+    uint64_t textures_offset;  // Offset of the SceneTexture array
+    uint64_t surfaces_offset;  // Offset of the SceneSurface array
+    uint64_t boxes_offset;  // Offset of the SceneBox array
+    uint32_t box_count;
+    uint32_t reserved;  // 0
+};
+
+struct SceneTexture {
+    uint32_t width;
+    uint32_t height;
+    uint64_t pixels_offset;  // Offset of the first pixel (the blue channel)
+    uint32_t opaque[4];  // Bounding box of the visible pixels: x, y, width, height (the whole texture if none is)
+    uint64_t opacity_offset;  // Offset of the opacity mask, one bit per block of pixels
+};
+
+struct SceneSurface {
+    uint32_t texture;  // Index of the texture of the surface
+    uint32_t rect[4];  // Part of the texture displayed on the surface: x, y, width, height
+    vec3 A;
+    vec3 B;
+    vec3 C;  // Corner C of the surface (Surface.bc)
+    vec3 normal;
+    vec3 min;
+    vec3 max;
+    uint32_t room;  // Room of the surface, 0 if it is always traversed
+};
+
+struct SceneBox {
+    vec3 min;
+    vec3 max;
+    uint32_t room;
+    struct SceneSurface faces[6];  // In the order of add_box, the texture is SCENE_NO_TEXTURE if it is not displayed
+};
+
+static_assert(sizeof(struct SceneHeader) == 48, "Unexpected SceneHeader layout");
+static_assert(sizeof(struct SceneTexture) == 40, "Unexpected SceneTexture layout");
+static_assert(sizeof(struct SceneSurface) == 96, "Unexpected SceneSurface layout");
+static_assert(sizeof(struct SceneBox) == 604, "Unexpected SceneBox layout");
+
+inline uint64_t scene_align(uint64_t offset) {
+    return (offset + SCENE_ALIGNMENT - 1) & ~(uint64_t)(SCENE_ALIGNMENT - 1);
+}
+
+/*
+ * Map a whole file in memory, read only.
+ * Returns NULL and sets an exception on error.
+ */
+static struct SceneFile *map_scene_file(const char *path) {
+    struct SceneFile *scene_file = (SceneFile *) malloc(sizeof(struct SceneFile));
+    if (scene_file == nullptr)
+        return (SceneFile *) PyErr_NoMemory();
+    scene_file->refcount = 1;
+
+#ifdef _WIN32
+    scene_file->file = CreateFileA(path, GENERIC_READ, FILE_SHARE_READ, NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (scene_file->file == INVALID_HANDLE_VALUE) {
+        PyErr_SetFromWindowsErrWithFilename(0, path);
+        free(scene_file);
+        return NULL;
+    }
+    LARGE_INTEGER size;
+    if (!GetFileSizeEx(scene_file->file, &size) || size.QuadPart < (LONGLONG)sizeof(struct SceneHeader)) {
+        PyErr_SetString(PyExc_ValueError, "Not a valid scene file");
+        CloseHandle(scene_file->file);
+        free(scene_file);
+        return NULL;
+    }
+    scene_file->size = (size_t)size.QuadPart;
+    scene_file->mapping = CreateFileMappingA(scene_file->file, NULL, PAGE_READONLY, 0, 0, NULL);
+    if (scene_file->mapping == NULL) {
+        PyErr_SetFromWindowsErrWithFilename(0, path);
+        CloseHandle(scene_file->file);
+        free(scene_file);
+        return NULL;
+    }
+    scene_file->data = (unsigned char *)MapViewOfFile(scene_file->mapping, FILE_MAP_READ, 0, 0, 0);
+    if (scene_file->data == NULL) {
+        PyErr_SetFromWindowsErrWithFilename(0, path);
+        CloseHandle(scene_file->mapping);
+        CloseHandle(scene_file->file);
+        free(scene_file);
+        return NULL;
+    }
+#else
+    int fd = open(path, O_RDONLY);
+    if (fd == -1) {
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+        free(scene_file);
+        return NULL;
+    }
+    struct stat st;
+    if (fstat(fd, &st) == -1 || st.st_size < (off_t)sizeof(struct SceneHeader)) {
+        PyErr_SetString(PyExc_ValueError, "Not a valid scene file");
+        close(fd);
+        free(scene_file);
+        return NULL;
+    }
+    scene_file->size = (size_t)st.st_size;
+    void *data = mmap(NULL, scene_file->size, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);  // The mapping stays valid after the file is closed.
+    if (data == MAP_FAILED) {
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+        free(scene_file);
+        return NULL;
+    }
+    scene_file->data = (unsigned char *)data;
+#endif
+
+    return scene_file;
+}
+
+/*
+ * Make sure a rect (x, y, width, height) is not empty and inside a texture of a scene file.
+ */
+inline bool check_scene_rect(const uint32_t rect[4], const struct SceneTexture *texture) {
+    return rect[2] != 0 && rect[3] != 0
+           && rect[0] <= texture->width && texture->width - rect[0] >= rect[2]
+           && rect[1] <= texture->height && texture->height - rect[1] >= rect[3];
+}
+
+/*
+ * Make sure a surface of a scene file displays a rect inside one of its textures.
+ */
+static bool check_scene_record(const struct SceneSurface *record, const struct SceneTexture *textures,
+                               uint32_t texture_count) {
+    if (record->texture >= texture_count || record->room >= MAX_ROOMS)
+        return false;
+    return check_scene_rect(record->rect, textures + record->texture);
+}
+
+/*
+ * Make sure every offset and index of a mapped scene file stays inside the file.
+ */
+static bool check_scene_file(struct SceneFile *scene_file) {
+    const struct SceneHeader *header = (const struct SceneHeader *)scene_file->data;
+    if (memcmp(header->magic, SCENE_MAGIC, 4) != 0 || header->version != SCENE_VERSION)
+        return false;
+
+    uint64_t size = scene_file->size;
+    if (header->textures_offset > size
+        || (size - header->textures_offset) / sizeof(struct SceneTexture) < header->texture_count
+        || header->surfaces_offset > size
+        || (size - header->surfaces_offset) / sizeof(struct SceneSurface) < header->surface_count
+        || header->boxes_offset > size
+        || (size - header->boxes_offset) / sizeof(struct SceneBox) < header->box_count
+        || header->textures_offset % alignof(struct SceneTexture)
+        || header->surfaces_offset % alignof(struct SceneSurface)
+        || header->boxes_offset % alignof(struct SceneBox))
+        return false;
+
+    const struct SceneTexture *textures = (const struct SceneTexture *)(scene_file->data + header->textures_offset);
+    for (uint32_t i = 0; i < header->texture_count; ++i) {
+        uint64_t length = (uint64_t)textures[i].width * textures[i].height * 4;
+        if (textures[i].width == 0 || textures[i].height == 0
+            || textures[i].pixels_offset > size || size - textures[i].pixels_offset < length
+            || !check_scene_rect(textures[i].opaque, textures + i))
+            return false;
+        Py_ssize_t pitch;
+        uint64_t mask_length = (uint64_t)opacity_size(textures[i].width, textures[i].height, &pitch);
+        if (textures[i].opacity_offset > size || size - textures[i].opacity_offset < mask_length)
+            return false;
+    }
+
+    const struct SceneSurface *surfaces = (const struct SceneSurface *)(scene_file->data + header->surfaces_offset);
+    for (uint32_t i = 0; i < header->surface_count; ++i)
+        if (!check_scene_record(surfaces + i, textures, header->texture_count))
+            return false;
+
+    const struct SceneBox *boxes = (const struct SceneBox *)(scene_file->data + header->boxes_offset);
+    for (uint32_t i = 0; i < header->box_count; ++i) {
+        if (boxes[i].room >= MAX_ROOMS)
+            return false;
+        for (int face = 0; face < 6; ++face)
+            if (boxes[i].faces[face].texture != SCENE_NO_TEXTURE
+                && !check_scene_record(boxes[i].faces + face, textures, header->texture_count))
+                return false;
+    }
+
+    return true;
+}
+
+/*
+ * Set the texture and the geometry of a surface or of a face of a box from its record in a scene file.
+ */
+static void load_scene_record(struct Surface *surface, const struct SceneSurface *record, struct Image **images) {
+    struct Image *image = images[record->texture];
+    surface->image = image;
+    image->refcount++;
+
+    surface->texture = image->texture;
+    surface->texture.pixels += record->rect[1] * surface->texture.pitch + record->rect[0];
+    surface->texture.x = record->rect[0];
+    surface->texture.y = record->rect[1];
+    surface->texture.width = record->rect[2];
+    surface->texture.height = record->rect[3];
+
+    // Everything was computed by the compiler, no need to call set_surface_geometry.
+    surface->pos.A = record->A;
+    surface->pos.B = record->B;
+    surface->pos.C = record->normal;
+    surface->bc = record->C;
+    surface->min = record->min;
+    surface->max = record->max;
+    set_surface_constants(surface);
+}
+
+static PyObject *method_load_scene(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    const char *path;
+
+    static char *kwlist[] = {"path", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s", kwlist, &path))
+        return NULL;
+
+    struct SceneFile *scene_file = map_scene_file(path);
+    if (scene_file == NULL)
+        return NULL;
+
+    if (!check_scene_file(scene_file)) {
+        PyErr_SetString(PyExc_ValueError, "Not a valid scene file");
+        release_scene_file(scene_file);
+        return NULL;
+    }
+
+    const struct SceneHeader *header = (const struct SceneHeader *)scene_file->data;
+    const struct SceneTexture *textures = (const struct SceneTexture *)(scene_file->data + header->textures_offset);
+    const struct SceneSurface *records = (const struct SceneSurface *)(scene_file->data + header->surfaces_offset);
+
+    // Every texture of the file becomes an image, kept alive by the surfaces using it.
+    struct Image **images = (Image **) malloc(sizeof(struct Image *) * (header->texture_count + 1));
+    if (images == nullptr) {
+        release_scene_file(scene_file);
+        return PyErr_NoMemory();
+    }
+    // Without enough memory, the images and the surfaces already loaded are removed,
+    // so the file is loaded whole or not at all
+    bool failed = false;
+    uint32_t image_count = 0;
+    for (uint32_t i = 0; i < header->texture_count; ++i) {
+        struct Image *image = (Image *) malloc(sizeof(struct Image));
+        if (image == nullptr) {
+            failed = true;
+            break;
+        }
+        image->prev = image->next = nullptr;
+        image->list = nullptr;
+        image->parent = nullptr;
+        image->scene_file = scene_file;
+        scene_file->refcount++;
+        image->refcount = 1;
+        image->texture.pixels = (uint32_t *)(scene_file->data + textures[i].pixels_offset);
+        image->texture.width = textures[i].width;
+        image->texture.height = textures[i].height;
+        image->texture.pitch = textures[i].width;
+        image->texture.x = image->texture.y = 0;
+
+        // The mask was computed by the compiler, the pixels are not read
+        opacity_size(textures[i].width, textures[i].height, &(image->opacity_pitch));
+        image->opacity = (uint8_t *)(scene_file->data + textures[i].opacity_offset);
+        image->prepared = true;
+        const uint32_t *opaque = textures[i].opaque;
+        image->opaque = image->texture;
+        image->opaque.pixels += opaque[1] * image->texture.pitch + opaque[0];
+        image->opaque.x = opaque[0];
+        image->opaque.y = opaque[1];
+        image->opaque.width = opaque[2];
+        image->opaque.height = opaque[3];
+        image->crop[0] = (float)opaque[0] / (float)textures[i].width;
+        image->crop[1] = (float)opaque[1] / (float)textures[i].height;
+        image->crop[2] = (float)(opaque[0] + opaque[2]) / (float)textures[i].width;
+        image->crop[3] = (float)(opaque[1] + opaque[3]) / (float)textures[i].height;
+        images[i] = image;
+        image_count++;
+    }
+
+    struct Surface *previous_surfaces = self->surfaces;
+    for (uint32_t i = 0; i < header->surface_count && !failed; ++i) {
+        struct Surface *surface = (Surface *) malloc(sizeof(struct Surface));
+        if (surface == nullptr) {
+            failed = true;
+            break;
+        }
+        load_scene_record(surface, records + i, images);
+        surface->del = false;
+        surface->billboard = false;
+        surface->grouped = false;
+        surface->room = (int)records[i].room;
+        surface->faces = nullptr;
+
+        surface->next = self->surfaces; // Push the surface on top of the stack.
+        self->surfaces = surface;
+    }
+
+    // Then the boxes, after all the quads.
+    const struct SceneBox *boxes = (const struct SceneBox *)(scene_file->data + header->boxes_offset);
+    for (uint32_t i = 0; i < header->box_count && !failed; ++i) {
+        struct Surface *box = (Surface *) malloc(sizeof(struct Surface));
+        struct Surface *box_faces = (Surface *) malloc(sizeof(struct Surface) * 6);
+        if (box == nullptr || box_faces == nullptr) {
+            free(box);
+            free(box_faces);
+            failed = true;
+            break;
+        }
+        box->image = nullptr;
+        box->del = false;
+        box->billboard = false;
+        box->grouped = false;
+        box->room = (int)boxes[i].room;
+        box->min = boxes[i].min;
+        box->max = boxes[i].max;
+        box->axis = -1;
+        box->faces = box_faces;
+        for (int face = 0; face < 6; ++face) {
+            if (boxes[i].faces[face].texture == SCENE_NO_TEXTURE)
+                box->faces[face].image = nullptr;
+            else
+                load_scene_record(box->faces + face, boxes[i].faces + face, images);
+            box->faces[face].faces = nullptr;
+        }
+
+        box->next = self->surfaces;
+        self->surfaces = box;
+    }
+    while (failed && self->surfaces != previous_surfaces) {
+        struct Surface *surface = self->surfaces;
+        self->surfaces = surface->next;
+        free_surface(surface);
+    }
+    if (!failed)
+        self->static_version++;
+
+    for (uint32_t i = 0; i < image_count; ++i)
+        release_image(images[i]);  // Only the surfaces keep the images alive.
+    free(images);
+    release_scene_file(scene_file);  // Only the images keep the file mapped.
+
+    if (failed)
+        return PyErr_NoMemory();
+    Py_RETURN_NONE;
+}
+
+/*
+ * The record of a surface or of a face of a box in a scene file. textures are the images of the file.
+ */
+static struct SceneSurface scene_record(const struct Surface *surface, struct Image *const *textures, int room) {
+    uint32_t index = 0;
+    while (textures[index] != surface->image)
+        index++;
+    const struct Texture *texture = &(surface->image->texture);
+    Py_ssize_t start = surface->texture.pixels - texture->pixels;  // Position of the rect in the image
+    return {
+        index,
+        {(uint32_t)(start % texture->pitch), (uint32_t)(start / texture->pitch),
+         (uint32_t)surface->texture.width, (uint32_t)surface->texture.height},
+        surface->pos.A, surface->pos.B, surface->bc, surface->pos.C,
+        surface->min, surface->max, (uint32_t)room,
+    };
+}
+
+static PyObject *method_save_scene(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    const char *path;
+
+    static char *kwlist[] = {"path", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s", kwlist, &path))
+        return NULL;
+
+    // Only the persistent surfaces are saved, in the order they were added (the list is a stack).
+    // Billboards depend on the camera and groups move, they are not part of the static scene.
+    // The surfaces of the scene of the caster were added before its own ones.
+    struct Surface *scene_surfaces = self->scene != nullptr ? self->scene->surfaces : nullptr;
+    uint32_t surface_count = 0;
+    for (struct Surface *surface = self->surfaces; surface != nullptr; surface = surface->next)
+        if (is_static(surface))
+            surface_count++;
+    for (struct Surface *surface = scene_surfaces; surface != nullptr; surface = surface->next)
+        surface_count++;
+
+    struct Surface **surfaces = (Surface **) malloc(sizeof(struct Surface *) * (surface_count + 1));
+    struct Image **textures = (Image **) malloc(sizeof(struct Image *) * (6 * surface_count + 1));
+
+    uint32_t index = surface_count;
+    for (struct Surface *surface = self->surfaces; surface != nullptr; surface = surface->next)
+        if (is_static(surface))
+            surfaces[--index] = surface;
+    for (struct Surface *surface = scene_surfaces; surface != nullptr; surface = surface->next)
+        surfaces[--index] = surface;
+
+    // Every image becomes a texture of the file, shared by the surfaces and the faces using it.
+    uint32_t texture_count = 0;
+    uint32_t box_count = 0;
+    struct Surface *textured[6];
+    for (uint32_t i = 0; i < surface_count; ++i) {
+        if (surfaces[i]->faces != nullptr)
+            box_count++;
+        int count = get_textured(surfaces[i], textured);
+        for (int j = 0; j < count; ++j) {
+            uint32_t k;
+            for (k = 0; k < texture_count; ++k)
+                if (textures[k] == textured[j]->image)
+                    break;
+            if (k == texture_count)
+                textures[texture_count++] = textured[j]->image;
+        }
+    }
+    uint32_t quad_count = surface_count - box_count;
+
+    struct SceneHeader header;
+    memcpy(header.magic, SCENE_MAGIC, 4);
+    header.version = SCENE_VERSION;
+    header.texture_count = texture_count;
+    header.surface_count = quad_count;
+    header.textures_offset = sizeof(struct SceneHeader);
+    header.surfaces_offset = header.textures_offset + sizeof(struct SceneTexture) * texture_count;
+    header.boxes_offset = header.surfaces_offset + sizeof(struct SceneSurface) * quad_count;
+    header.box_count = box_count;
+    header.reserved = 0;
+
+    FILE *file = fopen(path, "wb");
+    if (file == NULL) {
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+        free(surfaces);
+        free(textures);
+        return NULL;
+    }
+
+    static const unsigned char padding[SCENE_ALIGNMENT] = {0};
+    bool ok = fwrite(&header, sizeof(header), 1, file) == 1;
+
+    uint64_t offset = scene_align(header.boxes_offset + sizeof(struct SceneBox) * box_count);
+    for (uint32_t i = 0; ok && i < texture_count; ++i) {
+        if (!textures[i]->prepared && !prepare_image(textures[i])) {
+            fclose(file);
+            free(surfaces);
+            free(textures);
+            return NULL;
+        }
+        struct Texture *texture = &(textures[i]->texture);
+        struct Texture *opaque = &(textures[i]->opaque);
+        struct SceneTexture record;
+        memset(&record, 0, sizeof(record));
+        record.width = (uint32_t)texture->width;
+        record.height = (uint32_t)texture->height;
+        record.pixels_offset = offset;
+        record.opaque[0] = (uint32_t)opaque->x;
+        record.opaque[1] = (uint32_t)opaque->y;
+        record.opaque[2] = (uint32_t)opaque->width;
+        record.opaque[3] = (uint32_t)opaque->height;
+        record.opacity_offset = scene_align(offset + (uint64_t)record.width * record.height * 4);
+        ok = fwrite(&record, sizeof(record), 1, file) == 1;
+        Py_ssize_t pitch;
+        offset = scene_align(record.opacity_offset + opacity_size(texture->width, texture->height, &pitch));
+    }
+
+    for (uint32_t i = 0; ok && i < surface_count; ++i) {
+        if (surfaces[i]->faces != nullptr)
+            continue;
+        struct SceneSurface record = scene_record(surfaces[i], textures, surfaces[i]->room);
+        ok = fwrite(&record, sizeof(record), 1, file) == 1;
+    }
+
+    for (uint32_t i = 0; ok && i < surface_count; ++i) {
+        struct Surface *box = surfaces[i];
+        if (box->faces == nullptr)
+            continue;
+        struct SceneBox record;
+        memset(&record, 0, sizeof(record));
+        record.min = box->min;
+        record.max = box->max;
+        record.room = (uint32_t)box->room;
+        for (int face = 0; face < 6; ++face) {
+            if (box->faces[face].image == nullptr)
+                record.faces[face].texture = SCENE_NO_TEXTURE;
+            else
+                record.faces[face] = scene_record(box->faces + face, textures, box->room);
+        }
+        ok = fwrite(&record, sizeof(record), 1, file) == 1;
+    }
+
+    offset = header.boxes_offset + sizeof(struct SceneBox) * box_count;
+    for (uint32_t i = 0; ok && i < texture_count; ++i) {
+        ok = fwrite(padding, 1, scene_align(offset) - offset, file) == scene_align(offset) - offset;
+        offset = scene_align(offset);
+        struct Texture *texture = &(textures[i]->texture);
+        for (Py_ssize_t y = 0; ok && y < texture->height; ++y) {
+            const uint32_t *row = texture->pixels + y * texture->pitch;
+            ok = fwrite(row, 4, texture->width, file) == (size_t)texture->width;
+        }
+        offset += (uint64_t)texture->width * texture->height * 4;
+
+        ok = ok && fwrite(padding, 1, scene_align(offset) - offset, file) == scene_align(offset) - offset;
+        offset = scene_align(offset);
+        Py_ssize_t pitch;
+        size_t mask_length = (size_t)opacity_size(texture->width, texture->height, &pitch);
+        ok = ok && fwrite(textures[i]->opacity, 1, mask_length, file) == mask_length;
+        offset += mask_length;
+    }
+
+    if (fclose(file) != 0)
+        ok = false;
+
+    free(surfaces);
+    free(textures);
+
+    if (!ok) {
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+        return NULL;
+    }
+
+    Py_RETURN_NONE;
+}
+
+/*
+ * Get the static layer of a named pose, ready to be used with the given camera.
+ * If the camera, the size of the screen or the persistent surfaces changed since the layer was baked,
+ * every pixel is traced again the next time it is needed.
+ */
+static struct Pose *get_pose(RayCasterObject *caster, PyObject *name, Py_ssize_t width, Py_ssize_t height,
+                             const float camera[7], int progressive) {
+    if (name != NULL && !PyUnicode_Check(name)) {
+        PyErr_SetString(PyExc_TypeError, "pose must be a string");
+        return NULL;
+    }
+
+    struct Pose *pose;
+    for (pose = caster->poses; pose != nullptr; pose = pose->next)
+        if (name == NULL ? pose->name == nullptr : pose->name != nullptr && PyUnicode_Compare(pose->name, name) == 0)
+            break;
+
+    if (pose == nullptr) {
+        pose = (Pose *) malloc(sizeof(struct Pose));
+        if (pose == nullptr)
+            return (Pose *) PyErr_NoMemory();
+        Py_XINCREF(name);
+        pose->name = name;
+        pose->width = pose->height = 0;
+        pose->samples = nullptr;
+        pose->next = caster->poses;
+        caster->poses = pose;
+    }
+
+    if (pose->width != width || pose->height != height) {
+        free(pose->samples);
+        pose->samples = (StaticSample *) malloc(sizeof(struct StaticSample) * width * height);
+        if (pose->samples == nullptr) {
+            pose->width = pose->height = 0;
+            PyErr_NoMemory();
+            return NULL;
+        }
+        pose->width = width;
+        pose->height = height;
+    } else if (pose->static_version == caster->static_version && !memcmp(pose->camera, camera, sizeof(pose->camera))) {
+        if (pose->progressive != progressive) {
+            pose->progressive = progressive;
+            pose->level = 0;  // Already baked pixels are kept, the others are refined again from the coarsest grid
+        }
+        return pose;  // Nothing changed, the layer can be used as it is
+    }
+
+    memcpy(pose->camera, camera, sizeof(pose->camera));
+    pose->static_version = caster->static_version;
+    pose->progressive = progressive;
+    pose->level = 0;
+    for (Py_ssize_t i = 0; i < width * height; ++i)
+        pose->samples[i].baked = false;
+    return pose;
+}
+
+
+/*
+ * Directions of the rays of the pixels of a screen.
+ * The position of each column and row on the projection plane only depends on the size of the screen and on the fov,
+ * so it is kept between frames. Only the rotation of the camera is applied at each frame, once per column and row.
+ */
+struct RayTable {
+    struct RayTable *next;
+    Py_ssize_t width;
+    Py_ssize_t height;
+    float fov;
+    float plane_width;  // Size of the projection plane at a distance of 1
+    float plane_height;
+    float *columns;  // Horizontal position of each column on the projection plane, from 0.5 to -0.5
+    float *rows;  // Vertical position of each row on the projection plane, from 0.5 to -0.5
+    float *ray_x;  // x of the ray of each column, for the last camera aimed
+    float *ray_z;  // z of the ray of each column
+    float *ray_y;  // y of the ray of each row
+    struct Surface **hints;  // Surface hit by the ray of each pixel at the last cast, nullptr if unknown
+    unsigned long surface_version;  // surface_version of the caster when the hints were recorded
+    float forward[3];  // Ray of the center of the screen, for the last camera aimed
+    Py_ssize_t tiles_x;  // Number of tiles per row
+    Py_ssize_t tiles_y;
+    struct Tile *tiles;  // The surfaces binned by bin_surfaces, for the last cast
+    struct Surface **tile_surfaces;  // The lists of all the tiles, one after the other
+    Py_ssize_t tile_capacity;  // Size of tile_surfaces
+    uint32_t *frame;  // The pixels cast for a larger destination, before they are scaled to it, allocated when first needed
+    // The farthest persistent surface seen in each tile at the last cast, then in each 2 x 2 cells of the level below.
+    // INFINITY where it is unknown. The dynamic surfaces behind it are not binned while the camera doesn't move.
+    float *depth_levels[DEPTH_LEVELS];
+    int depth_level_count;
+    bool depth_valid;  // If the pyramid was built by a full cast, from depth_camera
+    float depth_camera[7];  // x, y, z, angle_x, angle_y, fov, view_distance
+    unsigned long depth_static_version;  // static_version of the caster when the pyramid was built
+};
+
+inline void free_ray_tables(RayCasterObject *caster) {
+    struct RayTable *next;
+    for (struct RayTable *table = caster->ray_tables; table != nullptr; table = next) {
+        next = table->next;
+        free(table->columns);
+        free(table->hints);
+        free(table->tiles);
+        free(table->tile_surfaces);
+        free(table->frame);
+        free(table->depth_levels[0]);
+        free(table);
+    }
+    caster->ray_tables = nullptr;
+}
+
+/*
+ * Get the ray directions of a screen of the given size, computed once per size and fov.
+ */
+static struct RayTable *get_ray_table(RayCasterObject *caster, Py_ssize_t width, Py_ssize_t height, float fov) {
+    for (struct RayTable *table = caster->ray_tables; table != nullptr; table = table->next)
+        if (table->width == width && table->height == height && table->fov == fov)
+            return table;
+
+    struct RayTable *table = (RayTable *) malloc(sizeof(struct RayTable));
+    if (table == nullptr) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    // One block for the five arrays
+    table->columns = (float *) malloc(sizeof(float) * (width * 3 + height * 2));
+    table->hints = (Surface **) calloc(width * height, sizeof(struct Surface *));
+    table->tiles_x = (width + TILE_SIZE - 1) / TILE_SIZE;
+    table->tiles_y = (height + TILE_SIZE - 1) / TILE_SIZE;
+    table->tiles = (Tile *) malloc(sizeof(struct Tile) * table->tiles_x * table->tiles_y);
+    table->tile_surfaces = nullptr;
+    table->tile_capacity = 0;
+    table->frame = nullptr;
+    // One block for the levels of the pyramid, each one half the size of the level below, down to a single cell
+    Py_ssize_t level_sizes[DEPTH_LEVELS];
+    Py_ssize_t depth_count = 0;
+    table->depth_level_count = 0;
+    for (Py_ssize_t level_x = table->tiles_x, level_y = table->tiles_y; table->depth_level_count < DEPTH_LEVELS;
+         level_x = (level_x + 1) / 2, level_y = (level_y + 1) / 2) {
+        level_sizes[table->depth_level_count++] = level_x * level_y;
+        depth_count += level_x * level_y;
+        if (level_x == 1 && level_y == 1)
+            break;
+    }
+    table->depth_levels[0] = (float *) malloc(sizeof(float) * depth_count);
+    table->depth_valid = false;
+    if (table->columns == nullptr || table->hints == nullptr || table->tiles == nullptr || table->depth_levels[0] == nullptr) {
+        free(table->columns);
+        free(table->hints);
+        free(table->tiles);
+        free(table->depth_levels[0]);
+        free(table);
+        PyErr_NoMemory();
+        return NULL;
+    }
+    for (int level = 1; level < table->depth_level_count; ++level)
+        table->depth_levels[level] = table->depth_levels[level - 1] + level_sizes[level - 1];
+    table->rows = table->columns + width;
+    table->ray_x = table->rows + height;
+    table->ray_z = table->ray_x + width;
+    table->ray_y = table->ray_z + width;
+
+    table->width = width;
+    table->height = height;
+    table->fov = fov;
+    table->surface_version = caster->surface_version;
+    table->plane_width = 2 * tan(fov);
+    table->plane_height = table->plane_width * (float)height / (float)width;
+
+    // The positions are the center of the pixels, accumulated the same way for every screen of the same size.
+    float d_progress_x = 1.f / (float)width;
+    float progress_x = 0.5f;
+    for (Py_ssize_t i = 0; i < width; ++i)
+        table->columns[i] = (progress_x -= d_progress_x);
+    float d_progress_y = 1.f / (float)height;
+    float progress_y = 0.5f;
+    for (Py_ssize_t i = 0; i < height; ++i)
+        table->rows[i] = (progress_y -= d_progress_y);
+
+    table->next = caster->ray_tables;
+    caster->ray_tables = table;
+    return table;
+}
+
+/*
+ * Rotate the rays of the table to the orientation of the camera.
+ */
+static void aim_ray_table(struct RayTable *table, float angle_x, float angle_y, float view_distance) {
+    float forward_x = cosf(angle_y) * view_distance;
+    float forward_y = sinf(angle_x) * table->plane_height * view_distance;
+    float forward_z = sinf(angle_y) * view_distance;
+
+    float right_x = -forward_z * table->plane_width;
+    float right_y = table->plane_height * view_distance;
+    float right_z = forward_x * table->plane_width;
+
+    table->forward[0] = forward_x;
+    table->forward[1] = forward_y;
+    table->forward[2] = forward_z;
+    for (Py_ssize_t i = 0; i < table->width; ++i) {
+        table->ray_x[i] = forward_x + table->columns[i] * right_x;
+        table->ray_z[i] = forward_z + table->columns[i] * right_z;
+    }
+    for (Py_ssize_t i = 0; i < table->height; ++i)
+        table->ray_y[i] = forward_y + table->rows[i] * right_y;
+}
+
+/*
+ * Find the tiles of the screen where a bounding box (of a surface or a portal) may be seen, from its corners.
+ * The rectangle of tiles is [tile_rect[0], tile_rect[2]) x [tile_rect[1], tile_rect[3]), empty if the box is behind.
+ * The table must be aimed at the camera.
+ */
+static void project_box(const struct RayTable *table, vec3 origin, vec3 min, vec3 max, Py_ssize_t tile_rect[4]) {
+    const float *forward = table->forward;
+    float forward_length2 = forward[0] * forward[0] + forward[2] * forward[2];
+    float right_y = table->plane_height * sqrtf(forward_length2);
+    float min_x = INFINITY, min_y = INFINITY, max_x = -INFINITY, max_y = -INFINITY;
+    int behind = 0;
+    for (int i = 0; i < 8; ++i) {
+        // The intersections are accepted up to EPSILON outside of the bounding box
+        vec3 corner = {
+            (i & 1 ? max.x + EPSILON : min.x - EPSILON) - origin.x,
+            (i & 2 ? max.y + EPSILON : min.y - EPSILON) - origin.y,
+            (i & 4 ? max.z + EPSILON : min.z - EPSILON) - origin.z,
+        };
+        // Every ray goes forward, so a point behind the camera is never hit.
+        float depth = corner.x * forward[0] + corner.z * forward[2];
+        if (depth <= EPSILON) {
+            behind++;
+            continue;
+        }
+        // Solve corner = t * (forward + column * right + row * up), t = depth / |forward|^2
+        float column = (corner.z * forward[0] - corner.x * forward[2]) / (depth * table->plane_width);
+        float row = (corner.y * forward_length2 / depth - forward[1]) / right_y;
+        float x = (0.5f - column) * (float)table->width - 1.f;
+        float y = (0.5f - row) * (float)table->height - 1.f;
+        min_x = MIN(min_x, x);
+        max_x = MAX(max_x, x);
+        min_y = MIN(min_y, y);
+        max_y = MAX(max_y, y);
+    }
+
+    if (behind == 8) {
+        tile_rect[0] = tile_rect[1] = tile_rect[2] = tile_rect[3] = 0;
+        return;
+    }
+    if (behind > 0) {  // Crossing the plane of the camera, the projection is unbounded
+        tile_rect[0] = tile_rect[1] = 0;
+        tile_rect[2] = table->tiles_x;
+        tile_rect[3] = table->tiles_y;
+        return;
+    }
+    // A margin of two pixels for the rounding of the positions of the pixels
+    float pixels[4] = {min_x - 2.f, min_y - 2.f, max_x + 2.f, max_y + 2.f};
+    float limits[4] = {(float)table->width - 1.f, (float)table->height - 1.f,
+                       (float)table->width - 1.f, (float)table->height - 1.f};
+    for (int i = 0; i < 4; ++i)
+        tile_rect[i] = (Py_ssize_t)MAX(0.f, MIN(pixels[i], limits[i])) / TILE_SIZE + (i >= 2);
+    if (pixels[2] < 0.f || pixels[3] < 0.f || pixels[0] > limits[0] || pixels[1] > limits[1])
+        tile_rect[2] = tile_rect[0];  // Outside of the screen
+}
+
+/*
+ * Find the rooms whose surfaces are left out of the cast: the ones the camera is not in,
+ * and not seen through any open portal on the screen. The table must be aimed at the camera.
+ * When a room appears or disappears, the hints and the static layers of the poses are traced again.
+ */
+static void traverse_rooms(RayCasterObject *caster, const struct RayTable *table, vec3 origin) {
+    // The bounding box of the surfaces of each room, the ones of the scene were computed by make_scene
+    vec3 room_min[MAX_ROOMS];
+    vec3 room_max[MAX_ROOMS];
+    uint32_t used = 0;
+    if (caster->scene != nullptr) {
+        used = caster->scene->used_rooms;
+        memcpy(room_min, caster->scene->room_min, sizeof(room_min));
+        memcpy(room_max, caster->scene->room_max, sizeof(room_max));
+    }
+    for (struct Surface *surface = caster->surfaces; surface != nullptr; surface = surface->next) {
+        int room = surface->room;
+        if (room == 0)
+            continue;
+        if (!(used & (1u << room))) {
+            used |= 1u << room;
+            room_min[room] = surface->min;
+            room_max[room] = surface->max;
+            continue;
+        }
+        room_min[room] = {MIN(room_min[room].x, surface->min.x), MIN(room_min[room].y, surface->min.y),
+                          MIN(room_min[room].z, surface->min.z)};
+        room_max[room] = {MAX(room_max[room].x, surface->max.x), MAX(room_max[room].y, surface->max.y),
+                          MAX(room_max[room].z, surface->max.z)};
+    }
+
+    uint32_t seen = 1;  // The room 0 is always traversed
+    for (int room = 1; room < MAX_ROOMS; ++room)
+        if (used & (1u << room)
+            && origin.x >= room_min[room].x - EPSILON && origin.x <= room_max[room].x + EPSILON
+            && origin.y >= room_min[room].y - EPSILON && origin.y <= room_max[room].y + EPSILON
+            && origin.z >= room_min[room].z - EPSILON && origin.z <= room_max[room].z + EPSILON)
+            seen |= 1u << room;
+    for (Py_ssize_t i = 0; i < caster->portal_count; ++i) {
+        const struct Portal *portal = caster->portals + i;
+        if (!portal->open || seen & (1u << portal->room))
+            continue;
+        Py_ssize_t tile_rect[4];
+        project_box(table, origin, portal->min, portal->max, tile_rect);
+        if (tile_rect[0] < tile_rect[2] && tile_rect[1] < tile_rect[3])
+            seen |= 1u << portal->room;
+    }
+
+    if (~seen != caster->hidden_rooms) {
+        caster->hidden_rooms = ~seen;
+        caster->static_version++;
+        caster->surface_version++;
+    }
+}
+
+/*
+ * Find the surfaces of the scene that may be seen by the cast, walking down its tree: the nodes out of the screen
+ * or only holding rooms left out by traverse_rooms are skipped with all their surfaces.
+ * The surfaces found are aimed at the camera and sorted by distance in caster->scene_seen,
+ * the ties in the order of the scene. The table must be aimed at the camera.
+ */
+static void find_scene_surfaces(RayCasterObject *caster, const struct RayTable *table, vec3 origin) {
+    caster->scene_seen_count = 0;
+    const SceneObject *scene = caster->scene;
+    if (scene == nullptr || scene->node_count == 0)
+        return;
+
+    Py_ssize_t stack[64];  // The tree is balanced, far less deep than that
+    int depth = 0;
+    stack[depth++] = 0;
+    while (depth > 0) {
+        const struct SceneNode *node = scene->nodes + stack[--depth];
+        if (!(node->rooms & ~caster->hidden_rooms))
+            continue;
+        Py_ssize_t tile_rect[4];
+        project_box(table, origin, node->min, node->max, tile_rect);
+        if (tile_rect[0] >= tile_rect[2] || tile_rect[1] >= tile_rect[3])
+            continue;
+        if (node->count == 0) {
+            stack[depth++] = node->start;
+            stack[depth++] = node - scene->nodes + 1;
+            continue;
+        }
+        for (Py_ssize_t i = node->start; i < node->start + node->count; ++i) {
+            struct Surface *surface = scene->list[scene->leaves[i]];
+            if (caster->hidden_rooms & (1u << surface->room))
+                continue;
+            aim_surface(surface, origin);
+            caster->scene_seen[caster->scene_seen_count++] = scene->leaves[i];
+        }
+    }
 
-    float light_x;
-    float light_y;
-    float light_z;
+    struct Surface **list = scene->list;
+    std::sort(caster->scene_seen, caster->scene_seen + caster->scene_seen_count, [list](Py_ssize_t a, Py_ssize_t b) {
+        return list[a]->distance < list[b]->distance || (list[a]->distance == list[b]->distance && a < b);
+    });
+}
 
-    float light_intensity = 1.0;
+/*
+ * If the depth pyramid of the table was built from the same camera and the same persistent surfaces.
+ */
+inline bool depth_pyramid_matches(const RayCasterObject *caster, const struct RayTable *table, const float camera[7]) {
+    return table->depth_valid && table->depth_static_version == caster->static_version
+           && !memcmp(table->depth_camera, camera, sizeof(table->depth_camera));
+}
 
-    float red = 1.0;
-    float green = 1.0;
-    float blue = 1.0;
+/*
+ * The farthest persistent surface seen in a rectangle of tiles, read at the finest level of the pyramid
+ * where the rectangle spans at most 2 x 2 cells. The rectangle must not be empty.
+ */
+static float occluder_depth(const struct RayTable *table, const Py_ssize_t tile_rect[4]) {
+    int level = 0;
+    while (level + 1 < table->depth_level_count
+           && (((tile_rect[2] - 1) >> level) - (tile_rect[0] >> level) > 1
+               || ((tile_rect[3] - 1) >> level) - (tile_rect[1] >> level) > 1))
+        level++;
+    Py_ssize_t level_width = ((table->tiles_x - 1) >> level) + 1;
+    const float *cells = table->depth_levels[level];
+    float depth = 0.f;
+    for (Py_ssize_t y = tile_rect[1] >> level; y <= (tile_rect[3] - 1) >> level; ++y)
+        for (Py_ssize_t x = tile_rect[0] >> level; x <= (tile_rect[2] - 1) >> level; ++x)
+            depth = MAX(depth, cells[y * level_width + x]);
+    return depth;
+}
 
-    float direction_x = FP_NAN;
-    float direction_y = FP_NAN;
-    float direction_z = FP_NAN;
+/*
+ * Start a new pyramid: the tiles fully cast take the depth of their pixels with record_depth,
+ * the others are unknown.
+ */
+static void reset_depth_pyramid(struct RayTable *table, const Py_ssize_t clip[4]) {
+    table->depth_valid = false;
+    for (Py_ssize_t tile_y = 0; tile_y < table->tiles_y; ++tile_y)
+        for (Py_ssize_t tile_x = 0; tile_x < table->tiles_x; ++tile_x) {
+            bool inside = tile_x * TILE_SIZE >= clip[0] && tile_y * TILE_SIZE >= clip[1]
+                          && MIN((tile_x + 1) * TILE_SIZE, table->width) <= clip[2]
+                          && MIN((tile_y + 1) * TILE_SIZE, table->height) <= clip[3];
+            table->depth_levels[0][tile_y * table->tiles_x + tile_x] = inside ? 0.f : INFINITY;
+        }
+}
 
-    static char *kwlist[] = {"x", "y", "z", "intensity", "red", "green", "blue", "direction_x", "direction_y", "direction_z", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "fff|fffffff", kwlist, &light_x, &light_y, &light_z, &light_intensity,
-                                     &red, &green, &blue, &direction_x, &direction_y, &direction_z))
-        return NULL;
+/*
+ * Keep the depth of the persistent surfaces seen by a pixel, INFINITY if a dynamic surface hides them.
+ */
+inline void record_depth(struct RayTable *table, Py_ssize_t x, Py_ssize_t y, float depth) {
+    float *cell = table->depth_levels[0] + (y / TILE_SIZE) * table->tiles_x + x / TILE_SIZE;
+    *cell = MAX(*cell, depth);
+}
 
-    if (red > 1.0f)
-        red = 1.0f;
-    if (green > 1.0f)
-        green = 1.0f;
-    if (blue > 1.0f)
-        blue = 1.0f;
+/*
+ * Fill the upper levels of the pyramid from the tiles, once the whole screen is cast.
+ */
+static void build_depth_pyramid(RayCasterObject *caster, struct RayTable *table, const float camera[7]) {
+    for (int level = 1; level < table->depth_level_count; ++level) {
+        const float *below = table->depth_levels[level - 1];
+        Py_ssize_t below_width = ((table->tiles_x - 1) >> (level - 1)) + 1;
+        Py_ssize_t below_height = ((table->tiles_y - 1) >> (level - 1)) + 1;
+        float *cells = table->depth_levels[level];
+        Py_ssize_t level_width = ((table->tiles_x - 1) >> level) + 1;
+        Py_ssize_t level_height = ((table->tiles_y - 1) >> level) + 1;
+        for (Py_ssize_t y = 0; y < level_height; ++y)
+            for (Py_ssize_t x = 0; x < level_width; ++x) {
+                float depth = 0.f;
+                for (Py_ssize_t below_y = 2 * y; below_y < MIN(2 * y + 2, below_height); ++below_y)
+                    for (Py_ssize_t below_x = 2 * x; below_x < MIN(2 * x + 2, below_width); ++below_x)
+                        depth = MAX(depth, below[below_y * below_width + below_x]);
+                cells[y * level_width + x] = depth;
+            }
+    }
+    memcpy(table->depth_camera, camera, sizeof(table->depth_camera));
+    table->depth_static_version = caster->static_version;
+    table->depth_valid = true;
+}
 
-    struct Light *light = (Light *) malloc(sizeof(struct Light));
-    light->pos.x = light_x;
-    light->pos.y = light_y;
-    light->pos.z = light_z;
-    light->intensity = light_intensity;
-    light->r = red;
-    light->g = green;
-    light->b = blue;
-    light->direction.x = direction_x;
-    light->direction.y = direction_y;
-    light->direction.z = direction_z;
-    light->next = self->lights;
+/*
+ * Sort the surfaces of the caster and the ones of the scene found by find_scene_surfaces into the tiles of the screen
+ * where they may be seen, so each ray only traces the surfaces of its tile. The table must be aimed at the camera.
+ * The surfaces of the rooms left out by traverse_rooms are not binned at all.
+ * With occlusion, the dynamic surfaces behind the persistent ones of the depth pyramid are left out of the tiles.
+ */
+static bool bin_surfaces(RayCasterObject *caster, struct RayTable *table, vec3 origin, bool occlusion) {
+    Py_ssize_t own_count = 0;
+    for (struct Surface *surface = caster->surfaces; surface != nullptr; surface = surface->next)
+        own_count++;
+    Py_ssize_t surface_count = own_count + caster->scene_seen_count;
+
+    Py_ssize_t tile_count = table->tiles_x * table->tiles_y;
+    struct Surface **surfaces = (Surface **) malloc(sizeof(struct Surface *) * surface_count);
+    Py_ssize_t *rects = (Py_ssize_t *) malloc(sizeof(Py_ssize_t) * 4 * surface_count);
+    float *nears = (float *) malloc(sizeof(float) * surface_count);  // 0 for the surfaces never culled
+    if ((surfaces == nullptr || rects == nullptr || nears == nullptr) && surface_count > 0) {
+        free(surfaces);
+        free(rects);
+        free(nears);
+        PyErr_NoMemory();
+        return false;
+    }
+    Py_ssize_t index = 0;
+    for (struct Surface *surface = caster->surfaces; surface != nullptr; surface = surface->next)
+        surfaces[index++] = surface;
+    for (Py_ssize_t i = 0; i < caster->scene_seen_count; ++i)
+        surfaces[index++] = caster->scene->list[caster->scene_seen[i]];
+    const float *tile_depths = table->depth_levels[0];
+
+    // Count the surfaces of each tile first
+    for (Py_ssize_t i = 0; i < tile_count; ++i)
+        table->tiles[i].own_count = table->tiles[i].count = 0;
+    Py_ssize_t total = 0;
+    for (index = 0; index < surface_count; ++index) {
+        struct Surface *surface = surfaces[index];
+        Py_ssize_t *rect = rects + 4 * index;
+        if (caster->hidden_rooms & (1u << surface->room))
+            rect[0] = rect[1] = rect[2] = rect[3] = 0;  // Not seen through any portal
+        else
+            project_box(table, origin, surface->min, surface->max, rect);
+        float near = 0.f;
+        if (occlusion && !is_static(surface) && rect[0] < rect[2] && rect[1] < rect[3]) {
+            near = box_distance(origin, surface) * (1.f - EPSILON);
+            if (near > occluder_depth(table, rect))
+                rect[2] = rect[0];  // Hidden in all its tiles
+        }
+        nears[index] = near;
+        for (Py_ssize_t tile_y = rect[1]; tile_y < rect[3]; ++tile_y)
+            for (Py_ssize_t tile_x = rect[0]; tile_x < rect[2]; ++tile_x) {
+                if (near > 0.f && near > tile_depths[tile_y * table->tiles_x + tile_x])
+                    continue;
+                struct Tile *tile = table->tiles + tile_y * table->tiles_x + tile_x;
+                tile->count++;
+                if (index < own_count)
+                    tile->own_count++;
+                total++;
+            }
+    }
 
-    self->use_lighting = true;
-    self->lights = light;
+    if (total > table->tile_capacity) {
+        struct Surface **tile_surfaces = (Surface **) realloc(table->tile_surfaces, sizeof(struct Surface *) * total);
+        if (tile_surfaces == nullptr) {
+            free(surfaces);
+            free(rects);
+            free(nears);
+            PyErr_NoMemory();
+            return false;
+        }
+        table->tile_surfaces = tile_surfaces;
+        table->tile_capacity = total;
+    }
 
-    Py_RETURN_NONE;
+    // Then fill them, in the order of the lists
+    Py_ssize_t offset = 0;
+    for (Py_ssize_t i = 0; i < tile_count; ++i) {
+        table->tiles[i].surfaces = table->tile_surfaces + offset;
+        offset += table->tiles[i].count;
+        table->tiles[i].count = 0;
+    }
+    for (index = 0; index < surface_count; ++index) {
+        Py_ssize_t *rect = rects + 4 * index;
+        float near = nears[index];
+        for (Py_ssize_t tile_y = rect[1]; tile_y < rect[3]; ++tile_y)
+            for (Py_ssize_t tile_x = rect[0]; tile_x < rect[2]; ++tile_x) {
+                if (near > 0.f && near > tile_depths[tile_y * table->tiles_x + tile_x])
+                    continue;
+                struct Tile *tile = table->tiles + tile_y * table->tiles_x + tile_x;
+                tile->surfaces[tile->count++] = surfaces[index];
+            }
+    }
+
+    free(surfaces);
+    free(rects);
+    free(nears);
+    return true;
 }
 
-static PyObject *method_clear_surfaces(RayCasterObject *self) {
-    struct Surface *next;
-    for (struct Surface *surface = self->surfaces; surface != nullptr; surface = next) {
-        next = surface->next;
-        free_surface(surface);
+inline const struct Tile *get_tile(const struct RayTable *table, Py_ssize_t x, Py_ssize_t y) {
+    return table->tiles + (y / TILE_SIZE) * table->tiles_x + x / TILE_SIZE;
+}
+
+/*
+ * A corner of the blocks cast by cast_blocks, shared by up to four blocks.
+ */
+struct BlockCorner {
+    struct Hit hit;
+    float lighting[3];
+    struct Cost cost;
+};
+
+/*
+ * Cast the screen by blocks of block x block pixels, for a fraction of the rays.
+ * The corners of the blocks are traced first. Where the four corners of a block hit the same surface,
+ * the other pixels of the block are only intersected with that surface and their lighting is interpolated
+ * between the corners. Only the blocks whose corners disagree (edges, sprites) are fully traced.
+ */
+static bool cast_blocks(RayCasterObject *self, struct RayTable *table, vec3 origin, uint32_t *buf, Py_ssize_t pitch,
+                        const Py_ssize_t clip[4], const unsigned char *coverage, uint16_t *costs,
+                        struct GSample *samples, float view_distance, int block) {
+    Py_ssize_t width = table->width;
+    Py_ssize_t height = table->height;
+    bool use_lighting = self->use_lighting && samples == nullptr;  // The deferred mode applies the lights afterwards
+    if (clip[0] >= clip[2] || clip[1] >= clip[3])
+        return true;  // Nothing to cast
+    Py_ssize_t blocks_x = (width + block - 1) / block;
+    Py_ssize_t blocks_y = (height + block - 1) / block;
+
+    struct BlockCorner *corners = (BlockCorner *) malloc(sizeof(struct BlockCorner) * (blocks_x + 1) * (blocks_y + 1));
+    if (corners == nullptr) {
+        PyErr_NoMemory();
+        return false;
     }
-    self->surfaces = nullptr;
-    Py_RETURN_NONE;
+
+    // Only the blocks inside the scissor rect are cast
+    Py_ssize_t first_x = clip[0] / block, last_x = (clip[2] - 1) / block + 1;
+    Py_ssize_t first_y = clip[1] / block, last_y = (clip[3] - 1) / block + 1;
+
+    struct pos2 ray;
+    ray.A = origin;
+    for (Py_ssize_t corner_y = first_y; corner_y <= last_y; ++corner_y) {
+        Py_ssize_t y = MIN(corner_y * block, height - 1);  // The last corners are on the last pixels
+        for (Py_ssize_t corner_x = first_x; corner_x <= last_x; ++corner_x) {
+            Py_ssize_t x = MIN(corner_x * block, width - 1);
+            struct BlockCorner *corner = corners + corner_y * (blocks_x + 1) + corner_x;
+            ray.B = {table->ray_x[x], table->ray_y[y], table->ray_z[x]};
+            corner->cost = {0, 0};
+            corner->hit = trace_hit(ray, get_tile(table, x, y), view_distance, table->hints + y * width + x,
+                                    &(corner->cost));
+            corner->lighting[0] = corner->lighting[1] = corner->lighting[2] = 1.0f;
+            if (use_lighting && corner->hit.pixel)
+                get_lighting(corner->hit.inter, self->lights, corner->lighting, &(corner->cost));
+        }
+    }
+
+    for (Py_ssize_t block_y = first_y; block_y < last_y; ++block_y) {
+        Py_ssize_t top = block_y * block;
+        Py_ssize_t bottom = MIN(top + block, height - 1);
+        for (Py_ssize_t block_x = first_x; block_x < last_x; ++block_x) {
+            Py_ssize_t left = block_x * block;
+            Py_ssize_t right = MIN(left + block, width - 1);
+            struct BlockCorner *top_left = corners + block_y * (blocks_x + 1) + block_x;
+            struct BlockCorner *block_corners[4] = {top_left, top_left + 1, top_left + blocks_x + 1, top_left + blocks_x + 2};
+
+            struct Surface *surface = top_left->hit.surface;
+            bool coherent = true;
+            for (int i = 1; i < 4; ++i)
+                coherent = coherent && block_corners[i]->hit.surface == surface;
+
+            for (Py_ssize_t y = MAX(top, clip[1]); y < MIN(top + block, clip[3]); ++y) {
+                for (Py_ssize_t x = MAX(left, clip[0]); x < MIN(left + block, clip[2]); ++x) {
+                    if (coverage != nullptr && coverage[y * width + x] == 255)
+                        continue;
+
+                    ray.B = {table->ray_x[x], table->ray_y[y], table->ray_z[x]};
+                    struct Surface **hint = table->hints + y * width + x;
+                    struct Cost pixel_cost = {0, 0};
+                    struct Hit hit;
+                    float lighting[3] = {1.0f, 1.0f, 1.0f};
+
+                    bool on_column = x % block == 0 || x == width - 1;
+                    bool on_row = y % block == 0 || y == height - 1;
+                    if (on_column && on_row) {  // Already traced
+                        struct BlockCorner *corner = block_corners[(y == top ? 0 : 2) + (x == left ? 0 : 1)];
+                        hit = corner->hit;
+                        memcpy(lighting, corner->lighting, sizeof(lighting));
+                        pixel_cost = corner->cost;
+                    } else if (coherent && surface == nullptr) {
+                        continue;  // Nothing to see in the whole block
+                    } else {
+                        hit.pixel = 0;
+                        hit.distance = view_distance;
+                        hit.surface = nullptr;
+                        hit.ahead = false;
+                        if (coherent)
+                            trace_surface(ray, surface, view_distance, &hit, &pixel_cost);
+                        if (hit.surface != nullptr) {
+                            *hint = next_hint(surface);
+                            if (use_lighting) {
+                                float fx = right > left ? (float)(x - left) / (float)(right - left) : 0.f;
+                                float fy = bottom > top ? (float)(y - top) / (float)(bottom - top) : 0.f;
+                                for (int i = 0; i < 3; ++i) {
+                                    float upper = block_corners[0]->lighting[i] + fx * (block_corners[1]->lighting[i] - block_corners[0]->lighting[i]);
+                                    float lower = block_corners[2]->lighting[i] + fx * (block_corners[3]->lighting[i] - block_corners[2]->lighting[i]);
+                                    lighting[i] = upper + fy * (lower - upper);
+                                }
+                            }
+                        } else {  // A hole in the surface, or the corners disagree
+                            hit = trace_hit(ray, get_tile(table, x, y), view_distance, hint, &pixel_cost);
+                            if (use_lighting && hit.pixel)
+                                get_lighting(hit.inter, self->lights, lighting, &pixel_cost);
+                        }
+                    }
+
+                    if (costs != nullptr) {
+                        uint16_t *pixel_costs = costs + 2 * (y * width + x);
+                        pixel_costs[0] = (uint16_t)MIN(pixel_cost.surfaces, UINT16_MAX);
+                        pixel_costs[1] = (uint16_t)MIN(pixel_cost.lights, UINT16_MAX);
+                    }
+                    if (samples != nullptr) {
+                        store_sample(samples + y * width + x, &hit);
+                        continue;
+                    }
+                    uint32_t pixel = apply_lighting(hit.pixel, lighting);
+                    if (pixel != 0)   // If the pixel is empty, don't write it.
+                        put_pixel(buf + y * pitch + x, pixel);
+                }
+            }
+        }
+    }
+
+    free(corners);
+    return true;
 }
 
-static PyObject *method_clear_lights(RayCasterObject *self) {
-    struct Light *next;
-    for (struct Light *light = self->lights; light != nullptr; light = next) {
-        next = light->next;
-        free(light);
+/*
+ * Get the frame of the table, cleared, to cast the pixels into before they are scaled to the destination.
+ */
+static uint32_t *get_frame(struct RayTable *table) {
+    if (table->frame == nullptr) {
+        table->frame = (uint32_t *) malloc(sizeof(uint32_t) * table->width * table->height);
+        if (table->frame == nullptr) {
+            PyErr_NoMemory();
+            return NULL;
+        }
     }
-    self->lights = nullptr;
-    self->use_lighting = false;
-    Py_RETURN_NONE;
+    memset(table->frame, 0, sizeof(uint32_t) * table->width * table->height);
+    return table->frame;
+}
+
+/*
+ * Scale the frame of the table to the destination by repeating its pixels (nearest neighbour).
+ * The empty pixels of the frame leave the destination untouched, like the ones not written by a direct cast.
+ * Each row of the frame is stretched once, then merged into all the rows of the destination it covers.
+ */
+static bool upscale_frame(const struct RayTable *table, const struct Texture *dst_pixels) {
+    Py_ssize_t dst_width = dst_pixels->width;
+    Py_ssize_t dst_height = dst_pixels->height;
+    uint32_t *row = (uint32_t *) malloc(sizeof(uint32_t) * dst_width);  // The stretched row
+    if (row == nullptr) {
+        PyErr_NoMemory();
+        return false;
+    }
+
+    Py_ssize_t src_y = -1;
+    for (Py_ssize_t dst_y = 0; dst_y < dst_height; ++dst_y) {
+        if (src_y != dst_y * table->height / dst_height) {
+            src_y = dst_y * table->height / dst_height;
+            const uint32_t *src = table->frame + src_y * table->width;
+            Py_ssize_t step = 0;  // The source column moves by one each time it reaches dst_width
+            for (Py_ssize_t dst_x = 0; dst_x < dst_width; ++dst_x) {
+                row[dst_x] = *src;
+                step += table->width;
+                for (; step >= dst_width; step -= dst_width)
+                    src += 1;
+            }
+        }
+        kernels->merge_row(dst_pixels->pixels + dst_y * dst_pixels->pitch, row, dst_width);
+    }
+
+    free(row);
+    return true;
 }
 
 static PyObject *method_raycasting(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
@@ -585,11 +3816,24 @@ static PyObject *method_raycasting(RayCasterObject *self, PyObject *args, PyObje
 
     float fov = 120.f;
     float view_distance = 1000.f;
-    bool rad = false;
-
-    static char *kwlist[] = {"dst_surface", "x", "y", "z", "angle_x", "angle_y", "fov", "view_distance", "rad", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|fffffffip", kwlist,
-                                     &screen, &x, &y, &z, &angle_x, &angle_y, &fov, &view_distance, &rad))
+    int rad = false;  // "p" stores an int
+
+    PyObject *scissor = NULL;
+    PyObject *mask = NULL;
+    PyObject *pose_name = NULL;
+    int progressive = 1;
+    Py_ssize_t budget = 0;
+    PyObject *cost = NULL;
+    int block = 1;
+    PyObject *gbuffer = NULL;
+    PyObject *size = NULL;
+
+    static char *kwlist[] = {"dst_surface", "x", "y", "z", "angle_x", "angle_y", "fov", "view_distance", "rad",
+                             "scissor", "mask", "pose", "progressive", "cost", "block", "gbuffer", "size", "budget", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|fffffffpOOOiOiOOn", kwlist,
+                                     &screen, &x, &y, &z, &angle_x, &angle_y, &fov, &view_distance, &rad,
+                                     &scissor, &mask, &pose_name, &progressive, &cost, &block, &gbuffer, &size,
+                                     &budget))
         return NULL;
 
     if(fov <= 0.f) {
@@ -600,12 +3844,27 @@ static PyObject *method_raycasting(RayCasterObject *self, PyObject *args, PyObje
         PyErr_SetString(PyExc_ValueError, "view_distance must be greater than 0");
         return NULL;
     }
+    if (progressive != 1 && progressive != 2 && progressive != 4 && progressive != 8) {
+        PyErr_SetString(PyExc_ValueError, "progressive must be 1, 2, 4 or 8");
+        return NULL;
+    }
+    if (budget < 0) {
+        PyErr_SetString(PyExc_ValueError, "budget can't be negative");
+        return NULL;
+    }
+    if (block != 1 && block != 2 && block != 4 && block != 8) {
+        PyErr_SetString(PyExc_ValueError, "block must be 1, 2, 4 or 8");
+        return NULL;
+    }
+    if (block > 1 && ((pose_name != NULL && pose_name != Py_None) || progressive > 1)) {
+        PyErr_SetString(PyExc_ValueError, "block can't be used with a pose or a progressive cast");
+        return NULL;
+    }
 
     Py_buffer dst_buffer;
-    if (_get_3DBuffer_from_Surface(screen, &dst_buffer)) {
-        PyErr_SetString(PyExc_ValueError, "dst_surface is not a valid surface");
+    struct Texture dst_pixels;
+    if (_get_pixels(screen, "dst_surface", true, &dst_buffer, &dst_pixels))
         return NULL;
-    }
 
     if (!rad) { // If the given angles are in degrees, convert them to radians.
         angle_x = angle_x * (float)M_PI / 180.f;
@@ -626,59 +3885,340 @@ static PyObject *method_raycasting(RayCasterObject *self, PyObject *args, PyObje
     ray.A = {x, y, z};
 
 
-    Py_ssize_t width = dst_buffer.shape[0];  // width of the screen
-    Py_ssize_t height = dst_buffer.shape[1];  // height of the screen
+    Py_ssize_t width = dst_pixels.width;  // width of the screen
+    Py_ssize_t height = dst_pixels.height;  // height of the screen
+
+    // The scene can be cast at a smaller size, then scaled to the destination by repeating the pixels.
+    // The scissor, the mask, the costs and the G-buffer are then given for the cast size.
+    bool scaled = false;
+    if (size != NULL && size != Py_None) {
+        Py_ssize_t size_width, size_height;
+        if (!PyTuple_Check(size)) {
+            PyBuffer_Release(&dst_buffer);
+            PyErr_SetString(PyExc_TypeError, "size must be a (width, height) tuple");
+            return NULL;
+        }
+        if (!PyArg_ParseTuple(size, "nn", &size_width, &size_height)) {
+            PyBuffer_Release(&dst_buffer);
+            return NULL;
+        }
+        if (size_width <= 0 || size_height <= 0 || size_width > width || size_height > height) {
+            PyBuffer_Release(&dst_buffer);
+            PyErr_SetString(PyExc_ValueError, "size must be positive and can't be larger than dst_surface");
+            return NULL;
+        }
+        scaled = size_width != width || size_height != height;
+        width = size_width;
+        height = size_height;
+    }
 
-    long *buf = (long *)dst_buffer.buf;  // buffer to write the result in
+    // Only the pixels inside the scissor rect are cast, the others are left untouched.
+    Py_ssize_t min_x = 0, min_y = 0, max_x = width, max_y = height;
+    if (scissor != NULL && scissor != Py_None) {
+        Py_ssize_t scissor_x, scissor_y, scissor_width, scissor_height;
+        if (!PyArg_ParseTuple(scissor, "nnnn", &scissor_x, &scissor_y, &scissor_width, &scissor_height)) {
+            PyBuffer_Release(&dst_buffer);
+            return NULL;
+        }
+        min_x = MAX(min_x, scissor_x);
+        min_y = MAX(min_y, scissor_y);
+        max_x = MIN(max_x, scissor_x + scissor_width);
+        max_y = MIN(max_y, scissor_y + scissor_height);
+    }
 
-    // TODO: iteration over the images to remove images that are not visible.
-    depth_sort(ray.A, self);
+    // The pixels fully covered by the mask (one byte per pixel, 255 = covered) are not cast either.
+    Py_buffer mask_buffer;
+    const unsigned char *coverage = nullptr;
+    if (mask != NULL && mask != Py_None) {
+        if (PyObject_GetBuffer(mask, &mask_buffer, PyBUF_SIMPLE)) {
+            PyBuffer_Release(&dst_buffer);
+            return NULL;
+        }
+        if (mask_buffer.len != width * height) {
+            PyBuffer_Release(&mask_buffer);
+            PyBuffer_Release(&dst_buffer);
+            PyErr_SetString(PyExc_ValueError, "mask must have one byte per pixel cast");
+            return NULL;
+        }
+        coverage = (const unsigned char *)mask_buffer.buf;
+    }
 
+    // The cost of every pixel can be written in a buffer of unsigned shorts, two per pixel: the number of
+    // surfaces tested against the ray, and the number of lights evaluated. The pixels not cast cost nothing.
+    Py_buffer cost_buffer;
+    uint16_t *costs = nullptr;
+    if (cost != NULL && cost != Py_None) {
+        if (PyObject_GetBuffer(cost, &cost_buffer, PyBUF_WRITABLE | PyBUF_FORMAT)) {
+            if (coverage != nullptr)
+                PyBuffer_Release(&mask_buffer);
+            PyBuffer_Release(&dst_buffer);
+            return NULL;
+        }
+        if (cost_buffer.itemsize != 2 || cost_buffer.format[strlen(cost_buffer.format) - 1] != 'H'
+            || cost_buffer.len != 4 * width * height) {
+            PyBuffer_Release(&cost_buffer);
+            if (coverage != nullptr)
+                PyBuffer_Release(&mask_buffer);
+            PyBuffer_Release(&dst_buffer);
+            PyErr_SetString(PyExc_ValueError, "cost must hold two unsigned shorts per pixel cast");
+            return NULL;
+        }
+        costs = (uint16_t *)cost_buffer.buf;
+        memset(costs, 0, cost_buffer.len);
+    }
 
-    // compute a bunch of variables before the loop to avoid computing them at each iteration.
+    // In the deferred mode, the pixels are first traced into the G-buffer, then the lights are applied to it.
+    // The G-buffer can be lit again by relight, without tracing anything.
+    Py_buffer gbuffer_buffer;
+    struct GSample *samples = nullptr;
+    if (gbuffer != NULL && gbuffer != Py_None) {
+        if (PyObject_GetBuffer(gbuffer, &gbuffer_buffer, PyBUF_WRITABLE)) {
+            if (costs != nullptr)
+                PyBuffer_Release(&cost_buffer);
+            if (coverage != nullptr)
+                PyBuffer_Release(&mask_buffer);
+            PyBuffer_Release(&dst_buffer);
+            return NULL;
+        }
+        if (gbuffer_buffer.len != (Py_ssize_t)sizeof(struct GSample) * width * height) {
+            PyBuffer_Release(&gbuffer_buffer);
+            if (costs != nullptr)
+                PyBuffer_Release(&cost_buffer);
+            if (coverage != nullptr)
+                PyBuffer_Release(&mask_buffer);
+            PyBuffer_Release(&dst_buffer);
+            PyErr_SetString(PyExc_ValueError, "gbuffer must hold 16 bytes per pixel cast");
+            return NULL;
+        }
+        samples = (struct GSample *)gbuffer_buffer.buf;
+        memset(samples, 0, gbuffer_buffer.len);
+    }
 
-    float projection_plane_width = 2 * tan(fov);
-    float projection_plane_height = projection_plane_width * (float)height / (float)width;
+    struct RayTable *table = get_ray_table(self, width, height, fov);
+    if (table == NULL) {
+        if (samples != nullptr)
+            PyBuffer_Release(&gbuffer_buffer);
+        if (costs != nullptr)
+            PyBuffer_Release(&cost_buffer);
+        if (coverage != nullptr)
+            PyBuffer_Release(&mask_buffer);
+        PyBuffer_Release(&dst_buffer);
+        return NULL;
+    }
+    aim_ray_table(table, angle_x, angle_y, view_distance);
 
-    float forward_x = cosf(angle_y) * view_distance;
-    float forward_y = sinf(angle_x) * projection_plane_height * view_distance;
-    float forward_z = sinf(angle_y) * view_distance;
+    // TODO: iteration over the images to remove images that are not visible.
+    orient_billboards(self, angle_y);
+    traverse_rooms(self, table, ray.A);  // Before the pose, it may need to be traced again
+    if (table->surface_version != self->surface_version) {  // Some hints may point to removed surfaces
+        memset(table->hints, 0, sizeof(struct Surface *) * width * height);
+        table->surface_version = self->surface_version;
+    }
 
-    float right_x = -forward_z * projection_plane_width;
-    float right_y = projection_plane_height * view_distance;
-    float right_z = forward_x * projection_plane_width;
+    // With a pose, the persistent surfaces are only traced once, then just the other surfaces are traced over them.
+    // A progressive cast uses a pose too: while the camera doesn't move, each block of progressive x progressive
+    // pixels gets one more pixel traced per frame, the others copy the closest traced pixel of a coarser grid.
+    // As soon as the camera moves, only one pixel per block is traced again.
+    // The budget is a number of rays the cast can spend on top of that: each frame refines one more pixel per block
+    // for every ray of each block it pays for, so an idle machine gets a sharp frame sooner.
+    struct Pose *pose = nullptr;
+    const float camera[7] = {x, y, z, angle_x, angle_y, fov, view_distance};
+    if (pose_name == Py_None)
+        pose_name = NULL;
+    if (pose_name != NULL || progressive > 1) {
+        pose = get_pose(self, pose_name, width, height, camera, progressive);
+        if (pose == NULL) {
+            if (samples != nullptr)
+                PyBuffer_Release(&gbuffer_buffer);
+            if (costs != nullptr)
+                PyBuffer_Release(&cost_buffer);
+            if (coverage != nullptr)
+                PyBuffer_Release(&mask_buffer);
+            PyBuffer_Release(&dst_buffer);
+            return NULL;
+        }
+    }
 
-    float d_progress_y = 1.f / (float)height;
-    float d_progress_x = 1.f / (float)width;
+    int ranks[64];  // refine_rank of each pixel of a block
+    int step = progressive;  // Size of the finest grid fully traced
+    if (pose != nullptr) {
+        for (int i = 0; i < progressive * progressive; ++i)
+            ranks[i] = refine_rank(i % progressive, i / progressive, progressive);
+        Py_ssize_t blocks = ((width + progressive - 1) / progressive) * ((height + progressive - 1) / progressive);
+        pose->level = (int)MIN(pose->level + budget / blocks, progressive * progressive - 1);
+        while (step > 1 && (progressive * 2 / step) * (progressive * 2 / step) <= pose->level + 1)
+            step /= 2;
+    }
 
-    float progress_y = 0.5f;
+    uint32_t *buf = dst_pixels.pixels;  // buffer to write the result in
+    Py_ssize_t pitch = dst_pixels.pitch;  // Number of pixels between the start of two rows of buf
+    if (scaled) {  // Cast into the frame of the table, scaled to the destination afterwards
+        buf = get_frame(table);
+        pitch = width;
+    }
+    if (buf == NULL) {
+        if (samples != nullptr)
+            PyBuffer_Release(&gbuffer_buffer);
+        if (costs != nullptr)
+            PyBuffer_Release(&cost_buffer);
+        if (coverage != nullptr)
+            PyBuffer_Release(&mask_buffer);
+        PyBuffer_Release(&dst_buffer);
+        return NULL;
+    }
+    uint32_t *frame = buf;
 
-    for (Py_ssize_t dst_y = 0; dst_y < height; ++dst_y) {
+    depth_sort(ray.A, self);
+    find_scene_surfaces(self, table, ray.A);  // The scene is shared, its surfaces seen are sorted aside
 
-        progress_y -= d_progress_y;
+    // While the camera doesn't move, the persistent surfaces seen at the last cast hide the dynamic ones behind them
+    bool failed = !bin_surfaces(self, table, ray.A, depth_pyramid_matches(self, table, camera));
+    const Py_ssize_t clip[4] = {min_x, min_y, max_x, max_y};
+    if (!failed && block > 1) {
+        failed = !cast_blocks(self, table, ray.A, buf, pitch, clip, coverage, costs, samples, view_distance, block);
+    } else if (!failed) {
+        reset_depth_pyramid(table, clip);
+        for (Py_ssize_t dst_y = 0; dst_y < height; ++dst_y) {
 
-        ray.B.y = forward_y + progress_y * right_y;
+            if (dst_y < min_y || dst_y >= max_y)
+                continue;
 
-        float progress_x = 0.5f;
-        for (Py_ssize_t dst_x = 0; dst_x < width; ++dst_x) {
+            buf = frame + dst_y * pitch;
+            ray.B.y = table->ray_y[dst_y];
 
-            progress_x -= d_progress_x;
+            for (Py_ssize_t dst_x = 0; dst_x < width; ++dst_x) {
 
-            ray.B.x = forward_x + progress_x * right_x;
-            ray.B.z = forward_z + progress_x * right_z;
+                if (dst_x < min_x || dst_x >= max_x || (coverage != nullptr && coverage[dst_y * width + dst_x] == 255)) {
+                    record_depth(table, dst_x, dst_y, INFINITY);
+                    buf += 1;
+                    continue;
+                }
 
-            // Now that the ray is defined, compute the pixel color.
-            unsigned long pixel = get_pixel_sum(ray, self->surfaces, self->lights, view_distance, self->use_lighting);
-            if (pixel != 0)   // If the pixel is empty, don't write it.
-                *((unsigned long *) ((unsigned char *) (buf) - 3)) = pixel;
-            buf += 1;
+                ray.B.x = table->ray_x[dst_x];
+                ray.B.z = table->ray_z[dst_x];
+
+                // Now that the ray is defined, compute the pixel color.
+                struct Hit hit;
+                struct Cost pixel_cost = {0, 0};
+                struct Surface **hint = table->hints + dst_y * width + dst_x;
+                const struct Tile *tile = get_tile(table, dst_x, dst_y);
+                if (pose == nullptr) {
+                    hit = trace_hit(ray, tile, view_distance, hint, &pixel_cost);
+                    record_depth(table, dst_x, dst_y,
+                                 hit.surface == nullptr || is_static(hit.surface) ? hit.distance : INFINITY);
+                } else {
+                    struct StaticSample *sample = pose->samples + dst_y * width + dst_x;
+                    if (!sample->baked && ranks[(dst_y % progressive) * progressive + dst_x % progressive] > pose->level) {
+                        // Not refined yet, copy the pixel of the coarser grid if it was cast.
+                        Py_ssize_t src_x = dst_x - dst_x % step;
+                        Py_ssize_t src_y = dst_y - dst_y % step;
+                        if (src_x >= min_x && src_y >= min_y && (coverage == nullptr || coverage[src_y * width + src_x] != 255)) {
+                            if (samples != nullptr)
+                                samples[dst_y * width + dst_x] = samples[src_y * width + src_x];
+                            else if (pose->samples[src_y * width + src_x].pixel != 0)  // The source may be empty
+                                put_pixel(buf, pose->samples[src_y * width + src_x].pixel);
+                            record_depth(table, dst_x, dst_y, INFINITY);
+                            buf += 1;
+                            continue;
+                        }
+                    }
+                    if (!sample->baked) {
+                        sample->hit.pixel = 0;
+                        sample->hit.distance = view_distance;
+                        sample->hit.surface = nullptr;
+                        sample->hit.ahead = false;
+                        trace_pixel(ray, tile->surfaces, tile->own_count, view_distance, STATIC_SURFACES, &(sample->hit),
+                                    &pixel_cost);
+                        trace_pixel(ray, tile->surfaces + tile->own_count, tile->count - tile->own_count, view_distance,
+                                    ALL_SURFACES, &(sample->hit), &pixel_cost);
+                        sample->baked = true;
+                    }
+                    hit = sample->hit;
+                    record_depth(table, dst_x, dst_y, hit.distance);
+                    if (*hint != nullptr && !is_static(*hint))  // Only the moving surfaces are traced over the static layer
+                        trace_hint(ray, *hint, view_distance, &hit, &pixel_cost);
+                    trace_pixel(ray, tile->surfaces, tile->own_count, view_distance, DYNAMIC_SURFACES, &hit, &pixel_cost);
+                    *hint = next_hint(hit.surface);
+                }
+                uint32_t pixel = 0;
+                if (samples != nullptr)
+                    store_sample(samples + dst_y * width + dst_x, &hit);  // Lit after the whole screen is traced
+                else
+                    pixel = shade_pixel(&hit, self->lights, self->use_lighting, &pixel_cost);
+                if (costs != nullptr) {
+                    uint16_t *pixel_costs = costs + 2 * (dst_y * width + dst_x);
+                    pixel_costs[0] = (uint16_t)MIN(pixel_cost.surfaces, UINT16_MAX);
+                    pixel_costs[1] = (uint16_t)MIN(pixel_cost.lights, UINT16_MAX);
+                }
+                if (pose != nullptr)
+                    pose->samples[dst_y * width + dst_x].pixel = pixel;
+                if (pixel != 0)   // If the pixel is empty, don't write it.
+                    put_pixel(buf, pixel);
+                buf += 1;
+            }
         }
     }
+    if (!failed && block == 1)
+        build_depth_pyramid(self, table, camera);
+    if (!failed && samples != nullptr)
+        failed = !shade_gbuffer(samples, frame, pitch, width, height, self->lights, self->use_lighting, costs);
+    if (!failed && scaled)
+        failed = !upscale_frame(table, &dst_pixels);
 
     PyBuffer_Release(&dst_buffer);
+    if (coverage != nullptr)
+        PyBuffer_Release(&mask_buffer);
+    if (costs != nullptr)
+        PyBuffer_Release(&cost_buffer);
+    if (samples != nullptr)
+        PyBuffer_Release(&gbuffer_buffer);
+
+    free_temp_surfaces(self);
+    if (failed)
+        return NULL;
+    if (pose != nullptr && pose->level < progressive * progressive - 1)
+        pose->level++;  // The next frame refines one more pixel per block
+
+    Py_RETURN_NONE;
+}
+
+
+/*
+ *  apply the lights of the caster to a G-buffer filled by raycasting, without tracing anything.
+ */
+static PyObject *method_relight(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    PyObject *screen;
+    PyObject *gbuffer;
+
+    static char *kwlist[] = {"dst_surface", "gbuffer", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OO", kwlist, &screen, &gbuffer))
+        return NULL;
+
+    Py_buffer dst_buffer;
+    struct Texture dst_pixels;
+    if (_get_pixels(screen, "dst_surface", true, &dst_buffer, &dst_pixels))
+        return NULL;
+    Py_ssize_t width = dst_pixels.width;
+    Py_ssize_t height = dst_pixels.height;
 
-    free_temp_surfaces(&(self->surfaces));
+    Py_buffer gbuffer_buffer;
+    if (PyObject_GetBuffer(gbuffer, &gbuffer_buffer, PyBUF_SIMPLE)) {
+        PyBuffer_Release(&dst_buffer);
+        return NULL;
+    }
+    if (gbuffer_buffer.len != (Py_ssize_t)sizeof(struct GSample) * width * height) {
+        PyBuffer_Release(&gbuffer_buffer);
+        PyBuffer_Release(&dst_buffer);
+        PyErr_SetString(PyExc_ValueError, "gbuffer must hold 16 bytes per pixel of dst_surface");
+        return NULL;
+    }
 
+    bool failed = !shade_gbuffer((const struct GSample *)gbuffer_buffer.buf, dst_pixels.pixels, dst_pixels.pitch,
+                                 width, height, self->lights, self->use_lighting, nullptr);
+    PyBuffer_Release(&gbuffer_buffer);
+    PyBuffer_Release(&dst_buffer);
+    if (failed)
+        return NULL;
     Py_RETURN_NONE;
 }
 
@@ -717,27 +4257,195 @@ static PyObject *method_single_cast(RayCasterObject *self, PyObject *args, PyObj
     ray.A = {origin_x, origin_y, origin_z};
     ray.B = {cosf(angle_y) * max_distance, sinf(angle_x) * max_distance, sinf(angle_y) * max_distance};
 
-    return Py_BuildValue("f", get_closest_intersection(ray, max_distance, self->surfaces));
+    orient_billboards(self, angle_y);
+    aim_surfaces(self->surfaces, ray.A);
+
+    float distance = get_closest_intersection(ray, max_distance, self->surfaces);
+    if (self->scene != nullptr) {
+        aim_surfaces(self->scene->surfaces, ray.A);
+        distance = get_closest_scene_intersection(ray, distance, self->scene);
+    }
+    return Py_BuildValue("f", distance);
+}
+
+
+/*
+ *  cast the rays of some pixels of a screen and return the distance of the closest intersection of each.
+ *  The rays are the same as the ones of raycasting with the same camera and a screen of the same size.
+ */
+static PyObject *method_cast_pixels(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    PyObject *pixels;
+    Py_ssize_t width;
+    Py_ssize_t height;
+
+    float x = 0.f;
+    float y = 0.f;
+    float z = 0.f;
+
+    float angle_x = 0.f;
+    float angle_y = 0.f;
+
+    float fov = 120.f;
+    float view_distance = 1000.f;
+    int rad = false;  // "p" stores an int
+
+    static char *kwlist[] = {"pixels", "width", "height", "x", "y", "z", "angle_x", "angle_y", "fov", "view_distance",
+                             "rad", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "Onn|fffffffp", kwlist, &pixels, &width, &height,
+                                     &x, &y, &z, &angle_x, &angle_y, &fov, &view_distance, &rad))
+        return NULL;
+
+    if (width <= 0 || height <= 0) {
+        PyErr_SetString(PyExc_ValueError, "width and height must be greater than 0");
+        return NULL;
+    }
+    if(fov <= 0.f) {
+        PyErr_SetString(PyExc_ValueError, "fov must be greater than 0");
+        return NULL;
+    }
+    if (view_distance <= 0.f) {
+        PyErr_SetString(PyExc_ValueError, "view_distance must be greater than 0");
+        return NULL;
+    }
+
+    if (!rad) { // If the given angles are in degrees, convert them to radians.
+        angle_x = angle_x * (float)M_PI / 180.f;
+        angle_y = angle_y * (float)M_PI / 180.f;
+        fov = fov * (float)M_PI / 180.f;
+    }
+
+    PyObject *sequence = PySequence_Fast(pixels, "pixels must be a sequence of (x, y) pairs");
+    if (sequence == NULL)
+        return NULL;
+
+    struct RayTable *table = get_ray_table(self, width, height, fov);
+    if (table == NULL) {
+        Py_DECREF(sequence);
+        return NULL;
+    }
+    aim_ray_table(table, angle_x, angle_y, view_distance);
+
+    Py_ssize_t count = PySequence_Fast_GET_SIZE(sequence);
+    PyObject *distances = PyList_New(count);
+    if (distances == NULL) {
+        Py_DECREF(sequence);
+        return NULL;
+    }
+
+    orient_billboards(self, angle_y);
+
+    struct pos2 ray;
+    ray.A = {x, y, z};
+    aim_surfaces(self->surfaces, ray.A);
+    if (self->scene != nullptr)
+        aim_surfaces(self->scene->surfaces, ray.A);
+    for (Py_ssize_t i = 0; i < count; ++i) {
+        Py_ssize_t pixel_x, pixel_y;
+        if (!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(sequence, i), "nn", &pixel_x, &pixel_y)) {
+            Py_DECREF(distances);
+            Py_DECREF(sequence);
+            return NULL;
+        }
+        if (pixel_x < 0 || pixel_x >= width || pixel_y < 0 || pixel_y >= height) {
+            Py_DECREF(distances);
+            Py_DECREF(sequence);
+            PyErr_SetString(PyExc_ValueError, "pixel outside of the screen");
+            return NULL;
+        }
+
+        ray.B = {table->ray_x[pixel_x], table->ray_y[pixel_y], table->ray_z[pixel_x]};
+        float distance = get_closest_intersection(ray, view_distance, self->surfaces);
+        if (self->scene != nullptr)
+            distance = get_closest_scene_intersection(ray, distance, self->scene);
+        PyList_SET_ITEM(distances, i, PyFloat_FromDouble(distance));
+    }
+
+    Py_DECREF(sequence);
+    return distances;
 }
 
 
+int RayCaster_init(RayCasterObject *self, PyObject *args, PyObject *kwargs) {
+    PyObject *scene = NULL;
+
+    static char *kwlist[] = {"scene", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|O!", kwlist, &SceneType, &scene))
+        return -1;
+
+    // Room for all the surfaces of the scene found by find_scene_surfaces
+    Py_ssize_t *scene_seen = nullptr;
+    if (scene != NULL) {
+        scene_seen = (Py_ssize_t *) malloc(sizeof(Py_ssize_t) * (((SceneObject *)scene)->surface_count + 1));
+        if (scene_seen == nullptr) {
+            PyErr_NoMemory();
+            return -1;
+        }
+    }
+    free(self->scene_seen);
+    self->scene_seen = scene_seen;
+    self->scene_seen_count = 0;
+    Py_XINCREF(scene);
+    Py_XSETREF(self->scene, (SceneObject *)scene);
+    self->static_version++;
+    self->surface_version++;
+    return 0;
+}
+
 void RayCaster_dealloc(RayCasterObject *self) {
     struct Surface *next;
     for (struct Surface *surface = self->surfaces; surface != nullptr; surface = next) {
         next = surface->next;
         free_surface(surface);
     }
+    for (Py_ssize_t i = 0; i < self->animation_count; ++i) {
+        for (Py_ssize_t j = 0; j < self->animations[i].frame_count; ++j)
+            release_image(self->animations[i].frames[j].image);
+        free(self->animations[i].frames);
+    }
+    free(self->animations);
+    free_hidden_groups(self);
+    for (Py_ssize_t i = 0; i < self->group_count; ++i) {
+        free(self->groups[i].surfaces);
+        free(self->groups[i].local);
+    }
+    free(self->groups);
+    free(self->portals);
+    sweep_images(&(self->images));
+    struct Light *next_light;
+    for (struct Light *light = self->lights; light != nullptr; light = next_light) {
+        next_light = light->next;
+        free(light);
+    }
+    free(self->light_handles);
+    free_poses(self);
+    free_ray_tables(self);
+    free(self->scene_seen);
+    Py_XDECREF(self->scene);
     Py_TYPE(self)->tp_free((PyObject *)self);
 }
 
 
 static PyMethodDef CasterMethods[] = {
         {"add_surface", (PyCFunction) method_add_surface, METH_VARARGS | METH_KEYWORDS, "Adds a surface to the caster."},
+        {"add_box", (PyCFunction) method_add_box, METH_VARARGS | METH_KEYWORDS, "Adds a box textured on each face to the caster."},
+        {"add_billboard", (PyCFunction) method_add_billboard, METH_VARARGS | METH_KEYWORDS, "Adds a surface always facing the camera to the caster."},
+        {"register_animation", (PyCFunction) method_register_animation, METH_VARARGS | METH_KEYWORDS, "Registers the frames of an animation and returns its id."},
+        {"create_group", (PyCFunction) method_create_group, METH_VARARGS | METH_KEYWORDS, "Adds surfaces moved together and returns the handle of the group."},
+        {"set_group_transform", (PyCFunction) method_set_group_transform, METH_VARARGS | METH_KEYWORDS, "Moves, turns, shows or hides a group of surfaces."},
+        {"create_portal", (PyCFunction) method_create_portal, METH_VARARGS | METH_KEYWORDS, "Adds an opening through which the surfaces of a room are seen and returns its handle."},
+        {"set_portal", (PyCFunction) method_set_portal, METH_VARARGS | METH_KEYWORDS, "Opens or closes a portal."},
         {"clear_surfaces", (PyCFunction) method_clear_surfaces, METH_NOARGS, "Clears all surfaces from the caster."},
         {"add_light", (PyCFunction) method_add_light, METH_VARARGS | METH_KEYWORDS, "Adds a light to the scene."},
+        {"create_light", (PyCFunction) method_create_light, METH_VARARGS | METH_KEYWORDS, "Adds a persistent light to the scene and returns its handle."},
+        {"set_light", (PyCFunction) method_set_light, METH_VARARGS | METH_KEYWORDS, "Changes or enables/disables a light created with create_light."},
         {"clear_lights", (PyCFunction) method_clear_lights, METH_NOARGS, "Clears all lights from the caster."},
+        {"load_scene", (PyCFunction) method_load_scene, METH_VARARGS | METH_KEYWORDS, "Maps a compiled scene file and adds its surfaces to the caster."},
+        {"save_scene", (PyCFunction) method_save_scene, METH_VARARGS | METH_KEYWORDS, "Compiles the persistent surfaces of the caster into a scene file."},
+        {"make_scene", (PyCFunction) method_make_scene, METH_NOARGS, "Moves the persistent surfaces of the caster into a Scene shared by other casters."},
         {"raycasting", (PyCFunction) method_raycasting, METH_VARARGS | METH_KEYWORDS, "Display the scene using raycasting."},
+        {"relight", (PyCFunction) method_relight, METH_VARARGS | METH_KEYWORDS, "Apply the lights to a G-buffer filled by raycasting and display it."},
         {"single_cast", (PyCFunction) method_single_cast, METH_VARARGS | METH_KEYWORDS, "Compute a single raycast and return the position in space of the closest intersection."},
+        {"cast_pixels", (PyCFunction) method_cast_pixels, METH_VARARGS | METH_KEYWORDS, "Compute the raycasts of some pixels of the screen and return the distance of the closest intersection of each."},
         {NULL, NULL, 0, NULL}
 };
 
@@ -750,6 +4458,7 @@ static PyTypeObject RayCasterType = {
         .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
         .tp_doc = PyDoc_STR("RayCaster Object"),
         .tp_methods = CasterMethods,
+        .tp_init = (initproc) RayCaster_init,
         .tp_new = PyType_GenericNew,
 };
 
@@ -765,6 +4474,8 @@ static struct PyModuleDef castermodule = {
 PyMODINIT_FUNC PyInit_nostalgiaeraycasting(void) {
     if (PyType_Ready(&RayCasterType) < 0)
         return NULL;
+    if (PyType_Ready(&SceneType) < 0)
+        return NULL;
 
     PyObject *m = PyModule_Create(&castermodule);
 
@@ -778,5 +4489,18 @@ PyMODINIT_FUNC PyInit_nostalgiaeraycasting(void) {
         return NULL;
     }
 
+    Py_INCREF(&SceneType);
+    if (PyModule_AddObject(m, "Scene", (PyObject *)&SceneType) < 0) {
+        Py_DECREF(&SceneType);
+        Py_DECREF(m);
+        return NULL;
+    }
+
+    select_kernels();
+    if (PyModule_AddStringConstant(m, "SIMD", kernels->name) < 0) {  // The instruction set of the pixel kernels
+        Py_DECREF(m);
+        return NULL;
+    }
+
     return m;
 }
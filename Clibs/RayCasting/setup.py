@@ -1,14 +1,23 @@
 from setuptools import setup, Extension
-from os import environ
+from setuptools.command.build_ext import build_ext
 
-compiler = environ['cc'].split('\\')[-1]
-print(compiler)
 
-args = []
-if compiler == 'gcc.exe':
-    args = ['-ofast']
-else:
-    args = ["/O2", "/GS-", "/fp:fast", "/std:c++latest", "/Zc:strictStrings-"]
+# The SSE4.1 and AVX2 kernels are compiled for their own instruction set whatever the flags, see select_kernels
+# /fp:precise: NaN marks the arguments not given, /fp:fast would let std::isnan be optimized away
+COMPILE_ARGS = {
+    "msvc": ["/O2", "/GS-", "/fp:precise", "/std:c++latest", "/Zc:strictStrings-"],
+}
+DEFAULT_COMPILE_ARGS = ["-O3", "-fno-math-errno", "-std=c++17"]  # gcc, mingw32 and clang
+
+
+class BuildExt(build_ext):
+    """Pass the flags of the compiler actually used."""
+
+    def build_extensions(self):
+        args = COMPILE_ARGS.get(self.compiler.compiler_type, DEFAULT_COMPILE_ARGS)
+        for extension in self.extensions:
+            extension.extra_compile_args = args
+        super().build_extensions()
 
 
 def main():
@@ -21,9 +30,9 @@ def main():
               Extension(
                   "nostalgiaeraycasting",
                   ["casting.cpp"],
-                  extra_compile_args=args
               )
-          ]
+          ],
+          cmdclass={"build_ext": BuildExt},
           )
 
 
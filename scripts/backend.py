@@ -0,0 +1,19 @@
+"""Pick the implementation of the C-libs.
+
+The compiled extensions are used when they are installed,
+otherwise the game falls back on the NumPy references (a lot slower, but playable).
+"""
+
+try:
+    from nostalgiaeraycasting import RayCaster, Scene
+    NATIVE_RAYCASTING: bool = True
+except ImportError:
+    from scripts.reference_raycasting import RayCaster, Scene
+    NATIVE_RAYCASTING: bool = False
+
+try:
+    from nostalgiaefilters import vignette, fish, distortion
+    NATIVE_FILTERS: bool = True
+except ImportError:
+    from scripts.reference_filters import vignette, fish, distortion
+    NATIVE_FILTERS: bool = False
@@ -0,0 +1,258 @@
+"""Check the C-libs against their NumPy references.
+
+Renders the same views with both implementations of the caster and the filters,
+reports how far apart the images are and how much faster the extensions are:
+
+    python -m scripts.compare_backends
+
+Each instruction set of the pixel kernels the CPU supports is checked in its own process,
+since the extensions choose theirs when they are imported (see NOSTALGIAE_SIMD).
+Exits with an error status if an image differs by more than TOLERANCE on too many pixels,
+or a distance by more than DISTANCE_TOLERANCE.
+"""
+
+from gc import collect
+from os import environ
+from subprocess import run
+from sys import exit as sys_exit, executable
+from time import perf_counter
+from typing import Callable
+
+import numpy as np
+from pygame import display as pg_display, HIDDEN, Surface
+from pygame.surfarray import array3d, pixels3d
+from pygame.transform import scale
+
+import nostalgiaeraycasting
+import nostalgiaefilters
+
+from scripts import reference_raycasting, reference_filters
+from scripts.surface_loader import load_static_surfaces, CORRIDOR
+from scripts.utils import coverage_mask, gbuffer, load_image
+
+
+TOLERANCE: int = 8  # The largest difference on a colour channel still counted as the same pixel
+MAX_WRONG_PIXELS: float = 0.005  # The share of pixels allowed over the tolerance (rounding at the edges of the faces)
+DISTANCE_TOLERANCE: float = 1e-4  # The largest difference between two distances of single_cast or cast_pixels
+SIMD_LEVELS: tuple[str, ...] = ("scalar", "sse4", "avx2")  # The instruction sets of the kernels, slowest first
+
+SIZE: tuple[int, int] = (256, 144)  # The size cast by the game with the medium graphics
+FOV: float = 50.  # The field of view and the view distance of scripts.display.DISPLAY
+VIEW_DISTANCE: float = 6.5
+
+# (name, camera, keyword arguments) of the views rendered with both casters.
+# Only the first frame of each view is compared: the progressive casts refine it at the next ones.
+# "dst": "buffer" casts into a (buffer, width, height, pitch) tuple instead of a Surface.
+VIEWS: tuple[tuple[str, tuple, dict], ...] = (
+    ("free look", (1.0, 1.3, 0.0, 0., 90.), {}),
+    ("free look, behind", (0.5, 1.3, 1.5, -20., -120.), {}),
+    ("free look, up", (-1.0, 1.3, -1.0, 45., 200.), {}),
+    ("door", (0.5, 1.3, 0.5, 0., -35.), {}),
+    ("bed", (0, 0.5, 3.2, 10, -90), {"pose": "bed"}),
+    ("wardrobe", (-0.4, 1.3, -3.4, 0, 90), {"pose": "wardrobe", "mask": "wardrobe"}),
+    ("block", (1.0, 1.3, 0.0, 0., 90.), {"block": 4}),
+    ("progressive", (0.5, 1.3, 1.5, -20., -120.), {"progressive": 2}),
+    ("progressive, budget", (1.0, 1.3, 0.0, 0., 90.), {"progressive": 4, "budget": SIZE[0] * SIZE[1] // 8}),
+    ("size", (1.0, 1.3, 0.0, 0., 90.), {"size": (SIZE[0] // 2, SIZE[1] // 2)}),
+    ("gbuffer", (0.5, 1.3, 1.5, -20., -120.), {"gbuffer": True}),
+    ("buffer", (-1.0, 1.3, -1.0, 45., 200.), {"dst": "buffer"}),
+)
+
+# (name, camera) of the rays of single_cast, with a max_distance of VIEW_DISTANCE
+RAYS: tuple[tuple[str, tuple], ...] = (
+    ("single_cast", (1.0, 1.3, 0.0, 0., 90.)),
+    ("single_cast, door", (0.5, 1.3, 0.5, 0., -35.)),
+    ("single_cast, down", (-1.0, 1.3, -1.0, -60., 200.)),
+)
+# The pixels of each view given to cast_pixels: a grid over the screen
+PIXELS: list[tuple[int, int]] = [(x, y) for y in range(0, SIZE[1], 9) for x in range(0, SIZE[0], 7)]
+
+
+def _make_caster(module) -> object:
+    """Build a caster of the room, lit like the game with the flashlight on and the door open.
+    @param module: The module providing RayCaster.
+    :return: The caster.
+    """
+    caster = module.RayCaster()
+    load_static_surfaces(caster)
+    caster.create_portal(2.499, 2.0, -0.6, 2.499, 0.0, -1.4, CORRIDOR)
+    caster.create_light(1.0, 1.3, 0.0, 3., 0.07, 0.07, 0.20)
+    caster.create_light(1.0, 1.3, 0.0, VIEW_DISTANCE, 0.5, 0.6, 0.7, 1.0, 1.3, 12.0)
+    caster.create_light(-1.0, 1.0, -2.0, 4., 0.8, 0.2, 0.2)
+    return caster
+
+
+def _render(caster, camera: tuple, options: dict) -> Surface:
+    """Cast a view, the way GAME_LOGIC.display does.
+    @param caster: The caster to use.
+    @param camera: The position and the angles of the camera.
+    @param options: The keyword arguments of raycasting. "mask" and "gbuffer" are built here, "dst" is not one.
+    :return: The image.
+    """
+    options = dict(options)
+    size = options.get("size", SIZE)
+    if options.get("mask") == "wardrobe":
+        options["mask"] = coverage_mask(scale(load_image("data", "images", "visuals", "wardrobe.png"), size))
+    if options.get("gbuffer"):
+        options["gbuffer"] = gbuffer(size)
+    screen = Surface(SIZE)
+    if options.pop("dst", None) == "buffer":
+        # Rows padded with 16 pixels, in the byte order of a Surface: blue, green, red, alpha
+        width, height = SIZE
+        pixels = np.zeros((height, width + 16, 4), np.uint8)
+        caster.raycasting((pixels, width, height, pixels.strides[0]), *camera, FOV, VIEW_DISTANCE, **options)
+        pixels3d(screen)[:] = pixels[:, :width, 2::-1].transpose(1, 0, 2)
+        return screen
+    caster.raycasting(screen, *camera, FOV, VIEW_DISTANCE, **options)
+    if "gbuffer" in options:
+        screen.fill((0, 0, 0))
+        caster.relight(screen, options["gbuffer"])
+    return screen
+
+
+def _difference(expected: Surface, image: Surface) -> tuple[int, float]:
+    """Compare two images.
+    @param expected: The image of the reference.
+    @param image: The image of the extension.
+    :return: The largest difference on a colour channel, and the share of pixels over the tolerance.
+    """
+    diff = np.abs(array3d(expected).astype(np.int16) - array3d(image).astype(np.int16)).max(axis=2)
+    return int(diff.max()), float((diff > TOLERANCE).mean())
+
+
+def _timed(function: Callable, repeat: int) -> tuple[object, float]:
+    """Call a function several times.
+    @param function: The function to call, without arguments.
+    @param repeat: The number of calls.
+    :return: The result of the last call, and the best time of a call in seconds.
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function()
+        best = min(best, perf_counter() - start)
+    return result, best
+
+
+def _report(name: str, expected: Surface, image: Surface, reference_time: float, native_time: float) -> bool:
+    """Print the comparison of two images and the speedup of the extension.
+    :return: Whether the images match.
+    """
+    max_diff, wrong = _difference(expected, image)
+    passed = wrong <= MAX_WRONG_PIXELS
+    print(f"{name:30} max diff {max_diff:3}  over tolerance {wrong * 100:6.2f}%  "
+          f"x{reference_time / native_time:8.1f}  {'ok' if passed else 'FAILED'}")
+    return passed
+
+
+def _report_distances(name: str, expected: list[float], distances: list[float], reference_time: float,
+                      native_time: float) -> bool:
+    """Print the comparison of the distances of single_cast or cast_pixels and the speedup of the extension.
+    :return: Whether the distances match.
+    """
+    max_diff = max(abs(a - b) for a, b in zip(expected, distances))
+    passed = len(expected) == len(distances) and max_diff <= DISTANCE_TOLERANCE
+    print(f"{name:30} max diff {max_diff:9.2e}  over {len(expected):4} rays    "
+          f"x{reference_time / native_time:8.1f}  {'ok' if passed else 'FAILED'}")
+    return passed
+
+
+def compare_raycasting() -> bool:
+    """Render every view with both casters, then cast single rays and pixels with both.
+    :return: Whether all the images and distances match.
+    """
+    reference = _make_caster(reference_raycasting)
+    native = _make_caster(nostalgiaeraycasting)
+    passed = True
+    for name, camera, options in VIEWS:
+        expected, reference_time = _timed(lambda: _render(reference, camera, options), 1)
+        image, _ = _timed(lambda: _render(native, camera, options), 1)  # The first frame, like the reference
+        _, native_time = _timed(lambda: _render(native, camera, options), 5)
+        passed &= _report(name, expected, image, reference_time, native_time)
+
+    for name, camera in RAYS:
+        expected, reference_time = _timed(lambda: [reference.single_cast(*camera, VIEW_DISTANCE)], 1)
+        distances, native_time = _timed(lambda: [native.single_cast(*camera, VIEW_DISTANCE)], 5)
+        passed &= _report_distances(name, expected, distances, reference_time, native_time)
+    for name, camera, _ in VIEWS[:4]:
+        def cast(caster) -> list[float]:
+            return caster.cast_pixels(PIXELS, *SIZE, *camera, FOV, VIEW_DISTANCE)
+        expected, reference_time = _timed(lambda: cast(reference), 1)
+        distances, native_time = _timed(lambda: cast(native), 5)
+        passed &= _report_distances(f"cast_pixels, {name}", expected, distances, reference_time, native_time)
+    return passed
+
+
+def check_make_scene() -> bool:
+    """Cast a view, move the surfaces of the caster into a scene, free the scene and cast again with both casters.
+    The caster must not draw the surfaces it gave away anymore.
+    :return: Whether the images match.
+    """
+    images = []
+    times = []
+    for module in (reference_raycasting, nostalgiaeraycasting):
+        caster = _make_caster(module)
+        _render(caster, VIEWS[0][1], {})
+        scene = caster.make_scene()
+        del scene
+        collect()
+        image, elapsed = _timed(lambda: _render(caster, VIEWS[0][1], {}), 1)
+        images.append(image)
+        times.append(elapsed)
+    return _report("make_scene, freed", images[0], images[1], times[0], times[1])
+
+
+def compare_filters() -> bool:
+    """Apply every filter with both implementations, on a view of the room.
+    :return: Whether all the images match.
+    """
+    source = _render(_make_caster(nostalgiaeraycasting), VIEWS[0][1], {})
+    width, height = SIZE
+    filters: tuple[tuple[str, Callable], ...] = (
+        ("vignette", lambda module, src, dst: module.vignette(dst, inner_radius=width / 4, strength=2.)),
+        ("fish", lambda module, src, dst: module.fish(src, dst, 0.1)),
+        ("distortion", lambda module, src, dst: module.distortion(src, dst, True, True, width * 0.03, 0.06, 0.03)),
+        ("color_filter", lambda module, src, dst: module.color_filter(dst, green=False, cyan=False)),
+        ("mode_seven", lambda module, src, dst: module.mode_seven(src, dst, width / 2, height / 2, 1.1, 0.2, -0.1, 0.9)),
+        ("display_in_3D_space", lambda module, src, dst: module.display_in_3D_space(src, dst, 2., -1., 1., 1.)),
+    )
+
+    passed = True
+    for name, apply in filters:
+        images = []
+        times = []
+        # The waves of distortion move with every call, so it is applied only once by each implementation
+        native_repeat = 1 if name == "distortion" else 5
+        for module, repeat in ((reference_filters, 1), (nostalgiaefilters, native_repeat)):
+            def run() -> Surface:
+                dst = source.copy()
+                apply(module, source, dst)
+                return dst
+            image, elapsed = _timed(run, repeat)
+            images.append(image)
+            times.append(elapsed)
+        passed &= _report(name, images[0], images[1], times[0], times[1])
+    return passed
+
+
+def compare_simd_levels() -> bool:
+    """Run the comparisons again in a process for each instruction set the CPU supports.
+    :return: Whether all the comparisons passed.
+    """
+    supported = max(SIMD_LEVELS.index(nostalgiaeraycasting.SIMD), SIMD_LEVELS.index(nostalgiaefilters.SIMD))
+    passed = True
+    for level in SIMD_LEVELS[:supported + 1]:
+        print(f"NOSTALGIAE_SIMD={level}")
+        process = run([executable, "-m", "scripts.compare_backends"], env={**environ, "NOSTALGIAE_SIMD": level})
+        passed &= process.returncode == 0
+    return passed
+
+
+if __name__ == "__main__":
+    if "NOSTALGIAE_SIMD" not in environ:
+        sys_exit(0 if compare_simd_levels() else 1)
+    pg_display.set_mode((1, 1), HIDDEN)  # convert_alpha needs a display
+    print(f"raycasting kernels: {nostalgiaeraycasting.SIMD}, filters kernels: {nostalgiaefilters.SIMD}")
+    results = [compare_raycasting(), check_make_scene(), compare_filters()]
+    sys_exit(0 if all(results) else 1)
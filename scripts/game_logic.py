@@ -1,4 +1,5 @@
 from random import randint, choice as random_choice
+from array import array
 
 
 from pygame import Surface
@@ -12,11 +13,10 @@ from scripts.input_handler import INPUT
 from scripts.game_over import GAME_OVER_SCREEN
 from scripts.surface_loader import load_static_surfaces
 from scripts.visuals import hand_visual, VISUALS, wardrobe_visual, watcher_hand_visual, madness_visual
-from scripts.utils import GameState, join_path
+from scripts.utils import GameState, join_path, coverage_mask, cost_buffer, cost_heatmap
 
 
-from nostalgiaeraycasting import RayCaster
-from nostalgiaefilters import distortion
+from scripts.backend import RayCaster, Scene, distortion
 
 why_are_you_leaving_sound: Sound = Sound(join_path("data", "sounds", "whisper", "why_are_you_leaving.ogg"))
 
@@ -25,8 +25,27 @@ class GAME_LOGIC:
     HOUR_DURATION: float
 
     PLAYER: Player
+    SCENE: Scene | None = None  # The static surfaces of the room, loaded once for all the nights
     RAY_CASTER: RayCaster
-    SURFACE: Surface
+    SIZE: tuple[int, int]  # Size the scene is cast at, RayCaster.raycasting scales it to the screen
+    FRAME: Surface  # The madness effect, and the scene when the watcher's hands are drawn over it, at the cast size
+    MADNESS_VISUAL: Surface
+    MADNESS_EFFECT: Surface
+    PROGRESSIVE: int  # Size of the blocks of pixels refined while the camera doesn't move
+    BUDGET: int  # Rays the progressive casts spend each frame on refining more pixels, adapted to the spare time
+    # Size of the blocks of pixels interpolated between their corners when looking around, opt-in like SHOW_COST:
+    # it trades the sharpness of the edges for speed, and the progressive casts of the lowest quality already do
+    BLOCK: int = 1
+
+    SHOW_COST: bool = False  # Show what each pixel costs to cast instead of the frame
+    COST: array | None
+
+    PLAYER_LIGHT: int
+    FLASHLIGHT: int
+
+    WARDROBE_OVERLAY: Surface
+    WARDROBE_FRAME_OVERLAY: Surface  # At the cast size
+    WARDROBE_MASK: bytes
 
     hour: int
     remaining_time: float
@@ -63,10 +82,37 @@ class GAME_LOGIC:
         cls.hour = 0
 
         cls.PLAYER = Player()
-        cls.RAY_CASTER = RayCaster()
-        cls.SURFACE = Surface((128*graphics, 72*graphics))  # 16:9
-
-        load_static_surfaces(cls.RAY_CASTER)
+        if cls.SCENE is None:
+            builder = RayCaster()
+            load_static_surfaces(builder)
+            cls.SCENE = builder.make_scene()
+        cls.RAY_CASTER = RayCaster(cls.SCENE)
+        # With the lowest quality, only one pixel out of 2x2 is cast when moving, all of them when idle
+        cls.PROGRESSIVE = 2 if graphics == 1 else 1
+        cls.BUDGET = 0
+        cls.SIZE = (128*graphics, 72*graphics)  # 16:9
+        cls.FRAME = Surface(cls.SIZE)
+        cls.MADNESS_VISUAL = scale(madness_visual, cls.SIZE)
+        cls.MADNESS_EFFECT = Surface(cls.SIZE)
+        cls.WARDROBE_FRAME_OVERLAY = scale(wardrobe_visual, cls.SIZE)
+        cls.WARDROBE_OVERLAY = scale(cls.WARDROBE_FRAME_OVERLAY, DISPLAY.screen_size)
+        # The pixels hidden by the wardrobe are not cast
+        cls.WARDROBE_MASK = coverage_mask(cls.WARDROBE_FRAME_OVERLAY)
+        cls.COST = cost_buffer(cls.SIZE) if cls.SHOW_COST else None
+
+        # The lights following the player are only moved each frame
+        # {"z", "y", "z", "intensity", "red", "green", "blue", "direction_x", "direction_y", "direction_z", "enabled", NULL};
+        cls.PLAYER_LIGHT = cls.RAY_CASTER.create_light(
+            0., 0., 0.,
+            3.,
+            0.07, 0.07, 0.20,
+        )
+        cls.FLASHLIGHT = cls.RAY_CASTER.create_light(
+            0., 0., 0.,
+            DISPLAY.VIEW_DISTANCE,
+            0.5, 0.6, 0.7,
+            enabled=False,
+        )
 
         cls.time_stopped = False
 
@@ -273,18 +319,40 @@ class GAME_LOGIC:
                         list(cls.monster_list.values())[randint(0, 8)].aggressiveness += 1
                 cls.remaining_time = cls.HOUR_DURATION
 
+    @classmethod
+    def update_budget(cls) -> None:
+        """
+        Adapt the rays the progressive casts spend on refining to the time the last frame left before the next one.
+        """
+        if cls.PROGRESSIVE == 1:
+            return
+        busy = DISPLAY.CLOCK.get_rawtime()  # Milliseconds spent on the last frame, without waiting for the next one
+        rank = cls.SIZE[0] * cls.SIZE[1] // (cls.PROGRESSIVE * cls.PROGRESSIVE)  # Rays of one more pixel per block
+        if busy < 750 / DISPLAY.FPS:
+            cls.BUDGET = min(cls.BUDGET + rank, cls.SIZE[0] * cls.SIZE[1])
+        elif busy > 1000 / DISPLAY.FPS:
+            cls.BUDGET //= 2
+
     @classmethod
     def display(cls) -> None:
 
         for monster in cls.monster_list.values():
             monster.draw()
 
-        cls.SURFACE.fill((0, 0, 0))
+        # The scene is cast straight into the screen, except when the watcher's hands are drawn over it:
+        # they are drawn at the cast size and scaled with it, like the rest of the frame
+        screen = cls.FRAME if cls.watcher_caught else DISPLAY.screen
+        cls.FRAME.fill((0, 0, 0))
         if VISUALS.madness:
-            madness_visual.set_alpha(int(VISUALS.madness * 100))
-            effect = Surface((cls.SURFACE.get_size()))
-            effect.blit(scale(madness_visual, cls.SURFACE.get_size()), (0, 0))
-            distortion(effect, cls.SURFACE, True, True, cls.SURFACE.get_width() * 0.03, 0.01 + VISUALS.madness * 0.05, 0.03)
+            cls.MADNESS_VISUAL.set_alpha(int(VISUALS.madness * 100))
+            cls.MADNESS_EFFECT.fill((0, 0, 0))
+            cls.MADNESS_EFFECT.blit(cls.MADNESS_VISUAL, (0, 0))
+            distortion(cls.MADNESS_EFFECT, cls.FRAME, True, True, cls.SIZE[0] * 0.03, 0.01 + VISUALS.madness * 0.05, 0.03)
+        if screen is DISPLAY.screen:
+            if VISUALS.madness:
+                scale(cls.FRAME, DISPLAY.screen_size, screen)
+            else:
+                screen.fill((0, 0, 0))
 
         if cls.win:
             if VISUALS.min_distortion > 0:
@@ -297,81 +365,86 @@ class GAME_LOGIC:
                 1.0, 1.0, 1.0,
             )
 
-        # {"z", "y", "z", "intensity", "red", "green", "blue", "direction_x", "direction_y", "direction_z", NULL};
-        cls.RAY_CASTER.add_light(
-            cls.PLAYER.x, cls.PLAYER.height, cls.PLAYER.z,
-            3.,
-            0.07, 0.07, 0.20,
-        )
+        cls.update_budget()
+        cls.RAY_CASTER.set_light(cls.PLAYER_LIGHT, pos=(cls.PLAYER.x, cls.PLAYER.height, cls.PLAYER.z))
+        cls.RAY_CASTER.set_light(cls.FLASHLIGHT, enabled=cls.PLAYER.use_flashlight)
 
         if cls.PLAYER.in_bed:
             if cls.PLAYER.use_flashlight:
-                cls.RAY_CASTER.add_light(
-                    0, 0.5, 3.0,
-                    DISPLAY.VIEW_DISTANCE,
-                    0.5, 0.6, 0.7,
-                    direction_x=0,
-                    direction_y=1,
-                    direction_z=-3,
+                cls.RAY_CASTER.set_light(
+                    cls.FLASHLIGHT,
+                    pos=(0, 0.5, 3.0),
+                    direction=(0, 1, -3),
                 )
 
             cls.RAY_CASTER.raycasting(
-                cls.SURFACE,
+                screen,
                 0, 0.5, 3.2,
                 10,
                 -90,
                 DISPLAY.FOV,
                 DISPLAY.VIEW_DISTANCE,
+                pose="bed",
+                progressive=cls.PROGRESSIVE,
+                budget=cls.BUDGET,
+                cost=cls.COST,
+                size=cls.SIZE,
             )
         elif cls.PLAYER.in_wardrobe or cls.watcher_caught:
             if cls.PLAYER.use_flashlight:
-                cls.RAY_CASTER.add_light(
-                    -0.4, cls.PLAYER.height, -3.3,
-                    DISPLAY.VIEW_DISTANCE,
-                    0.5, 0.6, 0.7,
-                    direction_x=-0.4,
-                    direction_y=cls.PLAYER.height,
-                    direction_z=5.0,
+                cls.RAY_CASTER.set_light(
+                    cls.FLASHLIGHT,
+                    pos=(-0.4, cls.PLAYER.height, -3.3),
+                    direction=(-0.4, cls.PLAYER.height, 5.0),
                 )
 
             cls.RAY_CASTER.raycasting(
-                cls.SURFACE,
+                screen,
                 -0.4, cls.PLAYER.height, -3.4 - max(0., cls.watcher_hands * 0.19),
                 0,
                 90,
                 DISPLAY.FOV,
                 DISPLAY.VIEW_DISTANCE,
+                mask=cls.WARDROBE_MASK,
+                pose="wardrobe",
+                progressive=cls.PROGRESSIVE,
+                budget=cls.BUDGET,
+                cost=cls.COST,
+                size=cls.SIZE,
             )
 
-            cls.SURFACE.blit(scale(wardrobe_visual, cls.SURFACE.get_size()), (0, 0))
-            if cls.watcher_caught:
+            if not cls.watcher_caught:
+                screen.blit(cls.WARDROBE_OVERLAY, (0, 0))
+            else:
                 cls.PLAYER.in_wardrobe = True
+                screen.blit(cls.WARDROBE_FRAME_OVERLAY, (0, 0))
 
-                h = cls.SURFACE.get_height()
+                w, h = cls.SIZE
                 nw = watcher_hand_visual.get_width() * h / watcher_hand_visual.get_height()
                 surf = scale(watcher_hand_visual, (nw, h))
 
-                w = cls.SURFACE.get_width()
-                cls.SURFACE.blit(surf, (cls.watcher_hands * 0.7 * w - nw, 0))
-                cls.SURFACE.blit(flip(surf, True, False), (w - cls.watcher_hands * 0.7 * w, 0))
+                screen.blit(surf, (cls.watcher_hands * 0.7 * w - nw, 0))
+                screen.blit(flip(surf, True, False), (w - cls.watcher_hands * 0.7 * w, 0))
+                scale(screen, DISPLAY.screen_size, DISPLAY.screen)
                 if cls.watcher_hands >= 1.0:
                     cls.game_over()
                     return
                 cls.watcher_hands += DISPLAY.delta_time * 2.3
         else:
             if cls.PLAYER.use_flashlight:
-                cls.RAY_CASTER.add_light(
-                    cls.PLAYER.x, cls.PLAYER.y + cls.PLAYER.height, cls.PLAYER.z,
-                    DISPLAY.VIEW_DISTANCE, 0.5, 0.6, 0.7,
-                    direction_x=cls.PLAYER.x + cls.PLAYER.look_direction[0] * DISPLAY.VIEW_DISTANCE * 1.8,
-                    direction_y=cls.PLAYER.y + cls.PLAYER.height + cls.PLAYER.look_direction[
-                        1] * DISPLAY.VIEW_DISTANCE * 1.8,
-                    direction_z=cls.PLAYER.z + cls.PLAYER.look_direction[2] * DISPLAY.VIEW_DISTANCE * 1.8,
+                cls.RAY_CASTER.set_light(
+                    cls.FLASHLIGHT,
+                    pos=(cls.PLAYER.x, cls.PLAYER.y + cls.PLAYER.height, cls.PLAYER.z),
+                    direction=(
+                        cls.PLAYER.x + cls.PLAYER.look_direction[0] * DISPLAY.VIEW_DISTANCE * 1.8,
+                        cls.PLAYER.y + cls.PLAYER.height + cls.PLAYER.look_direction[1] * DISPLAY.VIEW_DISTANCE * 1.8,
+                        cls.PLAYER.z + cls.PLAYER.look_direction[2] * DISPLAY.VIEW_DISTANCE * 1.8,
+                    ),
                 )
 
             # {"dst_surface", "z", "y", "z", "angle_x", "angle_y", "fov", "view_distance", "rad", NULL};
             cls.RAY_CASTER.raycasting(
-                cls.SURFACE,
+                screen,
                 cls.PLAYER.x,
                 cls.PLAYER.y + cls.PLAYER.height,
                 cls.PLAYER.z,
@@ -379,10 +452,16 @@ class GAME_LOGIC:
                 cls.PLAYER.angle_y,
                 DISPLAY.FOV,
                 DISPLAY.VIEW_DISTANCE,
+                progressive=cls.PROGRESSIVE,
+                budget=cls.BUDGET,
+                cost=cls.COST,
+                size=cls.SIZE,
+                block=cls.BLOCK if cls.PROGRESSIVE == 1 else 1,  # The two can't be combined
             )
         cls.RAY_CASTER.clear_lights()
 
-        DISPLAY.display_scaled(cls.SURFACE)
+        if cls.COST is not None:
+            screen.blit(scale(cost_heatmap(cls.COST, cls.SIZE), DISPLAY.screen_size), (0, 0))
 
         # DISPLAY VISUALS
 
@@ -7,8 +7,9 @@ from pygame import Surface
 from pygame.mixer import Channel, Sound
 
 from scripts.game_logic import GAME_LOGIC
+from scripts.surface_loader import CORRIDOR
 from scripts.text import TEXT
-from scripts.utils import distance, join_path, set_stereo_volume, load_image, add_surface_toward_player_2d
+from scripts.utils import distance, join_path, set_stereo_volume, load_image
 from scripts.visuals import VISUALS
 from scripts.display import DISPLAY
 
@@ -77,6 +78,21 @@ class BedsideLamp(Interaction):
         self.image_off: Surface = load_image("data", "images", "props", "bedsidelight_off.png")
         self.image_on: Surface = load_image("data", "images", "props", "bedsidelight_on.png")
 
+        # {"z", "y", "z", "intensity", "red", "green", "blue", "direction_x", "direction_y", "direction_z", "enabled", NULL};
+        self.light_handles: tuple[int, int] = (
+            GAME_LOGIC.RAY_CASTER.create_light(
+                *self.pos, 3.,
+                0.9, 0.8, 0.4,
+                self.pos[0] + 0.01, self.pos[1] + 2.5, self.pos[2] + 0.01,
+                enabled=False,
+            ),
+            GAME_LOGIC.RAY_CASTER.create_light(
+                *self.pos, 1.,
+                0.9, 0.8, 0.4,
+                enabled=False,
+            ),
+        )
+
     def can_interact(self, player) -> bool:
         if player.is_looking_at(self.pos, 0.4) and distance(player.pos, self.pos) < 2:
             TEXT.replace("Turn off the light" if self.light else "Turn on the light", duration=0.0, fade_out=0.3, color=(100, 100, 100))
@@ -89,26 +105,14 @@ class BedsideLamp(Interaction):
         self.click_sound.play()
 
     def update(self, player):
-        if self.light:
-            # {"z", "y", "z", "intensity", "red", "green", "blue", "direction_x", "direction_y", "direction_z", NULL};
-            GAME_LOGIC.RAY_CASTER.add_light(
-                *self.pos, 3.,
-                0.9, 0.8, 0.4,
-                self.pos[0] + 0.01, self.pos[1] + 2.5, self.pos[2] + 0.01,
-            )
-
-            GAME_LOGIC.RAY_CASTER.add_light(
-                *self.pos, 1.,
-                0.9, 0.8, 0.4,
-            )
+        for handle in self.light_handles:
+            GAME_LOGIC.RAY_CASTER.set_light(handle, enabled=self.light)
 
-        add_surface_toward_player_2d(
-            GAME_LOGIC.RAY_CASTER,
-            player,
+        GAME_LOGIC.RAY_CASTER.add_billboard(
             self.image_on if self.light else self.image_off,
-            self.pos,
-            0.5,
-            0.5,
+            *self.pos,
+            0.5, 0.5,
+            rm=True,
         )
 
 
@@ -171,13 +175,11 @@ class FlashLight(Interaction):
         GAME_LOGIC.interaction_list.remove(self)
 
     def update(self, player):
-        add_surface_toward_player_2d(
-            GAME_LOGIC.RAY_CASTER,
-            player,
+        GAME_LOGIC.RAY_CASTER.add_billboard(
             self.image,
-            self.pos,
-            0.5,
-            0.5,
+            *self.pos,
+            0.5, 0.5,
+            rm=True,
         )
 
 
@@ -189,6 +191,11 @@ class Wardrobe(Interaction):
         self.x: float = 0.
 
         self.door_image: Surface = load_image("data", "images", "props", "wardrobe_left_door.png")
+        self.door: int = GAME_LOGIC.RAY_CASTER.create_group([(
+            self.door_image,
+            self.door_pos[0], 2.0, self.door_pos[2],
+            self.door_pos[0] - 0.8, 0.0, self.door_pos[2],
+        )])
         self.sound: Sound = Sound(join_path("data", "sounds", "sfx", "wardrobe.ogg"))
 
     def can_interact(self, player) -> bool:
@@ -215,11 +222,7 @@ class Wardrobe(Interaction):
         else:
             self.x = max(0., self.x - 1.2 * DISPLAY.delta_time)
 
-        GAME_LOGIC.RAY_CASTER.add_surface(
-            self.door_image,
-            self.door_pos[0] - self.x, 2.0, self.door_pos[2],
-            self.door_pos[0] - self.x - 0.8, 0.0, self.door_pos[2],
-            rm=True)
+        GAME_LOGIC.RAY_CASTER.set_group_transform(self.door, (-self.x, 0., 0.))
 
 
 class BabyPhone(Interaction):
@@ -236,6 +239,14 @@ class BabyPhone(Interaction):
         self.stopped_time: bool = False
         self.timer: float = 0.
 
+        # {"z", "y", "z", "intensity", "red", "green", "blue", "direction_x", "direction_y", "direction_z", "enabled", NULL};
+        self.alert_light: int = GAME_LOGIC.RAY_CASTER.create_light(
+            *self.pos,
+            0.6,
+            0.9, 0.2, 0.3,
+            enabled=False,
+        )
+
     def can_interact(self, player) -> bool:
         if self.channel.get_busy():
             return False
@@ -382,16 +393,15 @@ class BabyPhone(Interaction):
 
     def update(self, player):
         self.timer += DISPLAY.delta_time
+        GAME_LOGIC.RAY_CASTER.set_light(self.alert_light, enabled=False)
 
         if self.channel.get_busy():
             set_stereo_volume(GAME_LOGIC.PLAYER, self.pos, self.channel)
-            return add_surface_toward_player_2d(
-                GAME_LOGIC.RAY_CASTER,
-                player,
+            return GAME_LOGIC.RAY_CASTER.add_billboard(
                 self.image_on,
-                self.pos,
-                0.5,
-                0.5,
+                *self.pos,
+                0.5, 0.5,
+                rm=True,
             )
 
         if self.stopped_time:
@@ -402,27 +412,18 @@ class BabyPhone(Interaction):
             if self.bip_sound.get_num_channels() == 0:
                 self.bip_sound.set_volume(max(0., 1. - distance(player.pos, self.pos) / 7.))
                 self.bip_sound.play()
-            # {"z", "y", "z", "intensity", "red", "green", "blue", "direction_x", "direction_y", "direction_z", NULL};
-            GAME_LOGIC.RAY_CASTER.add_light(
-                *self.pos,
-                0.6,
-                0.9, 0.2, 0.3,
-            )
-            return add_surface_toward_player_2d(
-                GAME_LOGIC.RAY_CASTER,
-                player,
+            GAME_LOGIC.RAY_CASTER.set_light(self.alert_light, enabled=True)
+            return GAME_LOGIC.RAY_CASTER.add_billboard(
                 self.image_alert,
-                self.pos,
-                0.5,
-                0.5,
+                *self.pos,
+                0.5, 0.5,
+                rm=True,
             )
-        add_surface_toward_player_2d(
-            GAME_LOGIC.RAY_CASTER,
-            player,
+        GAME_LOGIC.RAY_CASTER.add_billboard(
             self.image,
-            self.pos,
-            0.5,
-            0.5,
+            *self.pos,
+            0.5, 0.5,
+            rm=True,
         )
 
 
@@ -455,13 +456,11 @@ class TeddyBear(Interaction):
         player.has_teddy_bear = True
 
     def update(self, player):
-        add_surface_toward_player_2d(
-            GAME_LOGIC.RAY_CASTER,
-            player,
+        GAME_LOGIC.RAY_CASTER.add_billboard(
             self.image,
-            self.pos,
-            0.5,
-            0.5,
+            *self.pos,
+            0.5, 0.5,
+            rm=True,
         )
         if not GAME_LOGIC.PLAYER.use_flashlight and not GAME_LOGIC.PLAYER.bedside_light:
             # {"z", "y", "z", "intensity", "red", "green", "blue", "direction_x", "direction_y", "direction_z", NULL};
@@ -497,6 +496,15 @@ class Door(Interaction):
         self.image: Surface = load_image("data", "images", "props", "door.png")
         self.pos = pos
         self.angle: float = 0
+        # The door turns around its hinge
+        self.door: int = GAME_LOGIC.RAY_CASTER.create_group([(self.image, 0., 2.0, 0., 0., 0.0, -0.8)])
+        # The corridor is only seen through the doorway
+        self.portal: int = GAME_LOGIC.RAY_CASTER.create_portal(
+            pos[0], 2.0, pos[2],
+            pos[0], 0.0, pos[2] - 0.8,
+            CORRIDOR,
+            open=False,
+        )
 
         self.open_sound: Sound = Sound(join_path("data", "sounds", "sfx", "door_open.ogg"))
         self.close_sound: Sound = Sound(join_path("data", "sounds", "sfx", "door_close.ogg"))
@@ -525,12 +533,9 @@ class Door(Interaction):
             if self.angle == 0:
                 self.close_sound.play()
 
-        GAME_LOGIC.RAY_CASTER.add_surface(
-            self.image,
-            self.pos[0], 2.0, self.pos[2],
-            self.pos[0] - sin(radians(self.angle)) * 0.8, 0.0, self.pos[2] - cos(radians(self.angle)) * 0.8,
-            rm=True
-        )
+        GAME_LOGIC.RAY_CASTER.set_group_transform(self.door, (self.pos[0], 0., self.pos[2]), self.angle)
+        # The corridor stays visible until the door is shut
+        GAME_LOGIC.RAY_CASTER.set_portal(self.portal, GAME_LOGIC.door_open or self.angle > 0)
 
 
 class Window(Interaction):
@@ -12,7 +12,8 @@ from scripts.text import TEXT
 from scripts.input_handler import INPUT
 from scripts.game_logic import GAME_LOGIC
 from scripts.game_over import GAME_OVER_SCREEN
-from scripts.utils import load_image, add_surface_toward_player_2d, join_path, set_stereo_volume, distance_2d
+from scripts.utils import load_image, join_path, set_stereo_volume, distance_2d, \
+    pack_atlas, add_atlas_surface, AtlasFrame
 from scripts.interactions import TeddyBear
 
 
@@ -115,13 +116,11 @@ class Hangman(Monster):
     def draw(self):
         """Draw the monster each frame."""
         if self.state > 0:
-            add_surface_toward_player_2d(
-                GAME_LOGIC.RAY_CASTER,
-                GAME_LOGIC.PLAYER,
+            GAME_LOGIC.RAY_CASTER.add_billboard(
                 self.image,
-                (self.x + sin(self.timer) / 10, 0.3 + self.y, self.z),
-                self.width,
-                self.height,
+                self.x + sin(self.timer) / 10, 0.3 + self.y, self.z,
+                self.width, self.height,
+                rm=True,
             )
 
 
@@ -136,19 +135,38 @@ class Mimic(Monster):
         self.top_image2: Surface = load_image("data", "images", "props", "chest_top2.png")
         self.top_image3: Surface = load_image("data", "images", "props", "chest_top3.png")
 
-        self.stand_animation: list[Surface] = [
-            load_image("data", "images", "monsters", f"Steven_stand_{(i+1):0>2}.png") for i in range(13)
-        ]
+        # Both animations share the same atlas, the caster only gets the id of each animation
+        frames: list[AtlasFrame] = pack_atlas(
+            [load_image("data", "images", "monsters", f"Steven_stand_{(i+1):0>2}.png") for i in range(13)]
+            + [load_image("data", "images", "monsters", f"Steven_run_0{(i+1)}.png") for i in range(6)]
+        )
+        self.stand_animation: int = GAME_LOGIC.RAY_CASTER.register_animation(frames[:13])
+        self.walk_animation: int = GAME_LOGIC.RAY_CASTER.register_animation(frames[13:])
 
-        self.walk_animation: list[Surface] = [
-            load_image("data", "images", "monsters", f"Steven_run_0{(i+1)}.png") for i in range(6)
-        ]
+        # The chest is only moved when it shakes
+        # {"image", "A_x", "A_y", "A_z", "B_x", "B_y", "B_z","C_x", "C_y", "C_z", "rm", NULL};
+        self.chest: int = GAME_LOGIC.RAY_CASTER.create_group([
+            (self.front_image, -1.9, 0.41, -0.95, -1.9, 0.0, 0.35),
+            (self.left_image, -2.5, 0.6, -0.95, -1.9, 0.0, -0.95),
+            (self.right_image, -2.5, 0.6, 0.35, -1.9, 0.0, 0.35),
+            (self.top_image2, -2.31, 0.6, -0.95, -2.09, 0.6, 0.35, -2.09, 0.6, -0.95),
+            (self.top_image3, -2.1, 0.6, -0.95, -1.89, 0.4, 0.35, -1.89, 0.4, -0.95),
+            (self.top_image1, -2.3, 0.6, -0.95, -2.5, 0.4, 0.35, -2.5, 0.4, -0.95),
+        ])
 
         self.x: float = 0
         self.z: float = 0
 
         self.angle_y: float = 0
 
+        # {"z", "y", "z", "intensity", "red", "green", "blue", "direction_x", "direction_y", "direction_z", "enabled", NULL};
+        self.light: int = GAME_LOGIC.RAY_CASTER.create_light(
+            -2.2, 0.2, -0.3,
+            2.0,
+            1.0, 0.3, 0.0,
+            enabled=False,
+        )
+
         self.teddy_bear: TeddyBear | None = None
 
         self.stand_sound = Sound(join_path("data", "sounds", "sfx", "mimic_stand.ogg"))
@@ -248,106 +266,56 @@ class Mimic(Monster):
 
         match self.state:
             case 0 | 1:
+                GAME_LOGIC.RAY_CASTER.set_light(self.light, enabled=False)
                 self.draw_chest()
 
             case 2 | 3:  # phase last 10 seconds
                 self.draw_chest()
                 temp = max(0., 1.0 - self.timer / 10) if self.state == 2 else 1.0
-                # {"z", "y", "z", "intensity", "red", "green", "blue", "direction_x", "direction_y", "direction_z", NULL};
-                GAME_LOGIC.RAY_CASTER.add_light(
-                    -2.2, 0.2, -0.3,
-                    2.0 * temp,
-                    1.0, 0.3, 0.0,
-                )
+                GAME_LOGIC.RAY_CASTER.set_light(self.light, pos=(-2.2, 0.2, -0.3), intensity=2.0 * temp, enabled=True)
                 self.z = 0.02 * (int(self.timer * 100) % 2 - 0.5) * temp
                 self.x = 0.016 * (int(self.timer * 100) % 2 - 0.5) * temp
 
             case 4:  # phase last 2 seconds
-                GAME_LOGIC.RAY_CASTER.add_light(
-                    -2.2, 0.2, -0.3,
-                    2.0,
-                    1.0, 0.3, 0.0,
-                )
+                GAME_LOGIC.RAY_CASTER.set_light(self.light, pos=(-2.2, 0.2, -0.3), intensity=2.0, enabled=True)
 
                 if self.timer > 1.:
                     self.draw_chest()
                     frame = min(5, int((2. - self.timer) * 8))
                     GAME_LOGIC.RAY_CASTER.add_surface(
-                        self.stand_animation[frame],
+                        self.stand_animation,
                         -2.2 + self.x, 0.90, -1.8 + self.z,
                         -2.2 + self.x, 0.0, 1.2 + self.z,
                         rm=True,
+                        frame=frame,
                     )
                     if frame == 5 and self.stand_sound.get_num_channels() == 0:
                         set_stereo_volume(GAME_LOGIC.PLAYER, (self.x, 0.5, self.z), self.channel)
                         self.channel.play(self.stand_sound)
                 else:
+                    self.draw_chest(visible=False)
                     GAME_LOGIC.RAY_CASTER.add_surface(
-                        self.stand_animation[6 + min(6, int(7 * (1. - self.timer)))],
+                        self.stand_animation,
                         -2.2 + self.x, 0.90, -1.8 + self.z,
                         -2.2 + self.x, 0.0, 1.2 + self.z,
                         rm=True,
+                        frame=6 + min(6, int(7 * (1. - self.timer))),
                     )
 
             case _:
-                GAME_LOGIC.RAY_CASTER.add_light(
-                    self.x, 0.2, self.z,
-                    2.0,
-                    1.0, 0.3, 0.0,
-                )
-                add_surface_toward_player_2d(
-                    GAME_LOGIC.RAY_CASTER,
-                    GAME_LOGIC.PLAYER,
-                    self.walk_animation[int(self.timer * 8) % 6],
-                    (self.x, 0, self.z),
-                    1.6,
-                    1.1,
+                self.draw_chest(visible=False)
+                GAME_LOGIC.RAY_CASTER.set_light(self.light, pos=(self.x, 0.2, self.z), intensity=2.0, enabled=True)
+                GAME_LOGIC.RAY_CASTER.add_billboard(
+                    self.walk_animation,
+                    self.x, 0, self.z,
+                    1.6, 1.1,
+                    rm=True,
+                    time=self.timer,
+                    fps=8,
                 )
 
-    def draw_chest(self):
-
-        # {"image", "A_x", "A_y", "A_z", "B_x", "B_y", "B_z","C_x", "C_y", "C_z", "rm", NULL};
-        GAME_LOGIC.RAY_CASTER.add_surface(
-            self.front_image,
-            -1.9 + self.x, 0.41, -0.95 + self.z,
-            -1.9 + self.x, 0.0, 0.35 + self.z,
-            rm=True,
-        )
-        GAME_LOGIC.RAY_CASTER.add_surface(
-            self.left_image,
-            -2.5 + self.x, 0.6, -0.95 + self.z,
-            -1.9 + self.x, 0.0, -0.95 + self.z,
-            rm=True,
-        )
-        GAME_LOGIC.RAY_CASTER.add_surface(
-            self.right_image,
-            -2.5 + self.x, 0.6, 0.35 + self.z,
-            -1.9 + self.x, 0.0, 0.35 + self.z,
-            rm=True,
-        )
-        GAME_LOGIC.RAY_CASTER.add_surface(
-            self.top_image2,
-            -2.31 + self.x, 0.6, -0.95 + self.z,
-            -2.09 + self.x, 0.6, 0.35 + self.z,
-            -2.09 + self.x, 0.6, -0.95 + self.z,
-            rm=True,
-        )
-
-        GAME_LOGIC.RAY_CASTER.add_surface(
-            self.top_image3,
-            -2.1 + self.x, 0.6, -0.95 + self.z,
-            -1.89 + self.x, 0.4, 0.35 + self.z,
-            -1.89 + self.x, 0.4, -0.95 + self.z,
-            rm=True,
-        )
-
-        GAME_LOGIC.RAY_CASTER.add_surface(
-            self.top_image1,
-            -2.3 + self.x, 0.6, -0.95 + self.z,
-            -2.5 + self.x, 0.4, 0.35 + self.z,
-            -2.5 + self.x, 0.4, -0.95 + self.z,
-            rm=True,
-        )
+    def draw_chest(self, visible: bool = True):
+        GAME_LOGIC.RAY_CASTER.set_group_transform(self.chest, (self.x, 0., self.z), visible=visible)
 
 
 class Crawler(Monster):
@@ -356,11 +324,11 @@ class Crawler(Monster):
         self.hand_image: Surface = load_image("data", "images", "monsters", "crawler_hand.png")
         self.hand_grab_image: Surface = load_image("data", "images", "monsters", "Crawler_grab.png")
 
-        self.monster_images: tuple[Surface, ...] = (
+        self.monster_animation: int = GAME_LOGIC.RAY_CASTER.register_animation(pack_atlas([
             load_image("data", "images", "monsters", "The_crawling_thing_3.png"),
             load_image("data", "images", "monsters", "The_crawling_thing_1.png"),
             load_image("data", "images", "monsters", "The_crawling_thing_2.png"),
-        )
+        ]))
 
         self.timer = 20.
 
@@ -495,13 +463,12 @@ class Crawler(Monster):
                         rm=True,
                     )
             case 2:
-                add_surface_toward_player_2d(
-                    GAME_LOGIC.RAY_CASTER,
-                    GAME_LOGIC.PLAYER,
-                    self.monster_images[int((1. - min(1., self.timer)) / 0.3) % 3],
-                    (self.x, 0, self.z),
-                    0.7,
-                    0.7,
+                GAME_LOGIC.RAY_CASTER.add_billboard(
+                    self.monster_animation,
+                    self.x, 0, self.z,
+                    0.7, 0.7,
+                    rm=True,
+                    frame=int((1. - min(1., self.timer)) / 0.3),
                 )
 
 
@@ -515,8 +482,12 @@ class Guest(Monster):
         self.state = 0
         self.running: bool = False
 
-        self.eye_image: Surface = load_image("data", "images", "monsters", "The_guest_eye.png")
-        self.running_images: list[Surface] = [load_image("data", "images", "monsters", f"The_guest_0{i+1}.png") for i in range(8)]
+        frames: list[AtlasFrame] = pack_atlas(
+            [load_image("data", "images", "monsters", "The_guest_eye.png")]
+            + [load_image("data", "images", "monsters", f"The_guest_0{i+1}.png") for i in range(8)]
+        )
+        self.eye_image: AtlasFrame = frames[0]
+        self.running_animation: int = GAME_LOGIC.RAY_CASTER.register_animation(frames[1:])
 
         self.scream_sound: Sound = Sound(join_path("data", "sounds", "sfx", "guest_scream.ogg"))
 
@@ -682,7 +653,8 @@ class Guest(Monster):
 
         match self.state:
             case 1:
-                GAME_LOGIC.RAY_CASTER.add_surface(
+                add_atlas_surface(
+                    GAME_LOGIC.RAY_CASTER,
                     self.eye_image,
                     8.0 - self.x, 1.8, -0.2,
                     8.0 - self.x, 0.0, -1.4,
@@ -691,13 +663,15 @@ class Guest(Monster):
             case 2:
                 if self.running:
                     GAME_LOGIC.RAY_CASTER.add_surface(
-                        self.running_images[int(self.x * 4.5) % 8],
+                        self.running_animation,
                         2.5 + self.x, 1.8, -0.4,
                         2.5 + self.x, 0.0, -1.6,
                         rm=True,
+                        frame=int(self.x * 4.5),
                     )
                 else:
-                    GAME_LOGIC.RAY_CASTER.add_surface(
+                    add_atlas_surface(
+                        GAME_LOGIC.RAY_CASTER,
                         self.eye_image,
                         7.0, 1.8, -0.2,
                         7.0, 0.0, -1.4,
@@ -996,22 +970,20 @@ class Watcher(Monster):
         match self.state:
             case 1:
                 if GAME_LOGIC.PLAYER.use_flashlight:
-                    add_surface_toward_player_2d(
-                        GAME_LOGIC.RAY_CASTER,
-                        GAME_LOGIC.PLAYER,
+                    GAME_LOGIC.RAY_CASTER.add_billboard(
                         self.looking_image,
-                        (-1.2, 0.0, -3.37),
-                        0.8, 1.9
+                        -1.2, 0.0, -3.37,
+                        0.8, 1.9,
+                        rm=True,
                     )
 
             case 2:
                 if GAME_LOGIC.PLAYER.use_flashlight or GAME_LOGIC.wardrobe_open:
-                    add_surface_toward_player_2d(
-                        GAME_LOGIC.RAY_CASTER,
-                        GAME_LOGIC.PLAYER,
+                    GAME_LOGIC.RAY_CASTER.add_billboard(
                         self.looking_image,
-                        (-0.4, 0.0, -3.37),
-                        0.8, 1.9
+                        -0.4, 0.0, -3.37,
+                        0.8, 1.9,
+                        rm=True,
                     )
 
             case 3:
@@ -1023,12 +995,11 @@ class Watcher(Monster):
                         rm=True,
                     )
                 else:
-                    add_surface_toward_player_2d(
-                        GAME_LOGIC.RAY_CASTER,
-                        GAME_LOGIC.PLAYER,
+                    GAME_LOGIC.RAY_CASTER.add_billboard(
                         self.looking_image,
-                        (-0.4, 0.0, -3.37),
-                        0.8, 1.9
+                        -0.4, 0.0, -3.37,
+                        0.8, 1.9,
+                        rm=True,
                     )
 
 
@@ -1122,21 +1093,19 @@ class Eye(Monster):
         if GAME_LOGIC.PLAYER.use_flashlight:
             temp = self.image.copy()
             temp.blit(self.eyes_image[min(2, int(self.fear / 0.3))], (randint(-5, 5) * self.fear, randint(-2, 2) * self.fear))
-            add_surface_toward_player_2d(
-                GAME_LOGIC.RAY_CASTER,
-                GAME_LOGIC.PLAYER,
+            GAME_LOGIC.RAY_CASTER.add_billboard(
                 temp,
-                (2.9 + self.x, 0.0, 1.6),
-                0.8, 2.0
+                2.9 + self.x, 0.0, 1.6,
+                0.8, 2.0,
+                rm=True,
             )
             return
 
-        add_surface_toward_player_2d(
-            GAME_LOGIC.RAY_CASTER,
-            GAME_LOGIC.PLAYER,
+        GAME_LOGIC.RAY_CASTER.add_billboard(
             self.dark_image,
-            (2.9 + self.x, 0.0, 1.6),
-            0.8, 2.0
+            2.9 + self.x, 0.0, 1.6,
+            0.8, 2.0,
+            rm=True,
         )
 
 
@@ -1217,9 +1186,9 @@ class Hallucination(Monster):
         if not self.is_here:
             return
 
-        add_surface_toward_player_2d(
-            GAME_LOGIC.RAY_CASTER,
-            GAME_LOGIC.PLAYER,
+        GAME_LOGIC.RAY_CASTER.add_billboard(
             self.image,
-            (self.x, 0.0, self.z),
-            1.5, 2.0)
+            self.x, 0.0, self.z,
+            1.5, 2.0,
+            rm=True,
+        )
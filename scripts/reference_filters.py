@@ -0,0 +1,260 @@
+"""NumPy reference of nostalgiaefilters.
+
+The same filter functions as the C extension, computed for all the pixels at once with NumPy arrays.
+scripts.backend falls back on them when the C-libs are not installed,
+and scripts.compare_backends checks the output of the extension against them.
+"""
+
+import numpy as np
+from pygame.surfarray import pixels2d, pixels3d
+
+
+D_C_QUOT = np.float32(1.8)
+
+distortion_time: int = 0  # Number of calls to distortion, it moves the waves
+
+
+def buffer_pixels(image: tuple, name: str, writable: bool) -> np.ndarray:
+    """Map the pixels of a (buffer, width, height[, pitch]) tuple, checked like the C-libs do.
+    @param image: The tuple. The buffer holds 4 bytes per pixel (blue, green, red, alpha), aligned on 4 bytes,
+    pitch is the number of bytes between the start of two rows, 4 * width by default.
+    @param name: The name of the argument, for the errors.
+    @param writable: Whether the pixels are written.
+    :return: A width x height x 4 view of the buffer, the channels in the order blue, green, red, alpha.
+    """
+    if not 3 <= len(image) <= 4:
+        raise TypeError(f"{name} must be a Surface or a (buffer, width, height[, pitch]) tuple")
+    buffer, width, height = image[0], int(image[1]), int(image[2])
+    pitch = int(image[3]) if len(image) == 4 else 4 * width
+    if width <= 0 or height <= 0:
+        raise ValueError(f"the width and height of {name} must be greater than 0")
+    if pitch < 4 * width or pitch % 4:
+        raise ValueError(f"the pitch of {name} must be a multiple of 4, at least 4 * width")
+    view = memoryview(buffer)
+    if writable and view.readonly:
+        raise BufferError("Object is not writable.")
+    if not view.c_contiguous:
+        raise BufferError("Object is not C-contiguous.")
+    if view.nbytes < (height - 1) * pitch + 4 * width:
+        raise ValueError(f"the buffer of {name} is too small for its width, height and pitch")
+    pixels = np.ndarray((width, height, 4), np.uint8, view.cast("B"), strides=(4, pitch, 1))
+    if pixels.ctypes.data % 4:
+        raise ValueError(f"the buffer of {name} must be aligned on 4 bytes")
+    return pixels
+
+
+def _get_pixels(image, name: str, writable: bool, channels: bool) -> np.ndarray | None:
+    """The pixels of a pygame Surface or of a (buffer, width, height[, pitch]) tuple.
+    @param channels: Whether to get the red, green and blue channels (like pixels3d) or whole pixels (like pixels2d).
+    :return: A view of the pixels, None if image is not a Surface.
+    """
+    if isinstance(image, tuple):
+        pixels = buffer_pixels(image, name, writable)
+        return pixels[:, :, 2::-1] if channels else pixels.view(np.uint32)[:, :, 0]
+    try:
+        return pixels3d(image) if channels else pixels2d(image)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def fish(src_img, dst_img, distortion_coefficient) -> None:
+    """FishEye effect. Takes a two pygame Surfaces and a float as arguments."""
+    src = _get_pixels(src_img, "src_img", False, False)
+    if src is None:
+        print("src_img isn't a valid Surface")
+        return
+    dst = _get_pixels(dst_img, "dst_img", True, False)
+    if dst is None:
+        print("dst_img isn't a valid Surface")
+        return
+    width, height = src.shape
+    if dst.shape != src.shape:
+        raise ValueError("src_img and dst_img must have the same size")
+
+    # The normalized coordinates are accumulated from -1 like the extension does.
+    xn = np.full(width, np.float32(2.) / np.float32(width), np.float32)
+    yn = np.full(height, np.float32(2.) / np.float32(height), np.float32)
+    xn[0] = yn[0] = -1.
+    xn = np.add.accumulate(xn)[:, None]
+    yn = np.add.accumulate(yn)[None, :]
+
+    div = np.float32(1.) - np.float32(distortion_coefficient) * (xn * xn + yn * yn)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xnd = np.where(div != 0., xn / div, xn)
+        ynd = np.where(div != 0., yn / div, yn)
+        xu = np.trunc((xnd + np.float32(1.)) / np.float32(2.) * np.float32(width))
+        yu = np.trunc((ynd + np.float32(1.)) / np.float32(2.) * np.float32(height))
+    inside = (xu >= 0) & (xu < width) & (yu >= 0) & (yu < height)
+    dst[inside] = src[xu[inside].astype(np.int64), yu[inside].astype(np.int64)]
+
+
+def distortion(src_image, dst_image, horizontal_distortion=False, vertical_distortion=False, amplitude=1.,
+               frequency=1., speed=1.) -> None:
+    """Earthbound distortion effect"""
+    global distortion_time
+
+    src = _get_pixels(src_image, "src_img", False, False)
+    if src is None:
+        print("src_img isn't a valid Surface")
+        return
+    dst = _get_pixels(dst_image, "dst_img", True, False)
+    if dst is None:
+        print("dst_img isn't a valid Surface")
+        return
+    width, height = src.shape
+    if dst.shape != src.shape:
+        raise ValueError("src_img and dst_img must have the same size")
+
+    amplitude, frequency, speed = np.float32(amplitude), np.float32(frequency), np.float32(speed)
+    phase = speed * np.float32(distortion_time)
+
+    def shift(length: int, distorted: bool) -> np.ndarray:
+        position = np.arange(length)
+        if not distorted:
+            return position
+        wave = amplitude * np.sin(frequency * position.astype(np.float32) + phase)
+        return np.trunc(position.astype(np.float32) + wave).astype(np.int64) % length
+
+    dst[:, :] = src[shift(width, horizontal_distortion)[:, None], shift(height, vertical_distortion)[None, :]]
+    distortion_time += 1
+
+
+def color_filter(image, red=True, green=True, blue=True, magenta=True, yellow=True, cyan=True) -> None:
+    """Color selection. Takes a pygame Surface and color boolean arguments."""
+    pixels = _get_pixels(image, "image", True, True)
+    if pixels is None:
+        print("image isn't a valid Surface")
+        return
+    r, g, b = (pixels[:, :, channel].astype(np.float32) for channel in range(3))
+
+    # The pixels of the selected colours are kept, the others are turned to sepia.
+    kept = np.zeros(r.shape, bool)
+    if red:
+        kept |= (r > g * D_C_QUOT) & (r > b * D_C_QUOT)
+    if green:
+        kept |= (g > r * D_C_QUOT) & (g > b * D_C_QUOT)
+    if blue:
+        kept |= (b > r * D_C_QUOT) & (b > g * D_C_QUOT)
+    if magenta:
+        kept |= (((r > D_C_QUOT * g) & (b > g)) | ((b > D_C_QUOT * g) & (r > g))) & (r <= D_C_QUOT * b) & (b <= D_C_QUOT * r)
+    if yellow:
+        kept |= (((r > D_C_QUOT * b) & (g > b)) | ((g > D_C_QUOT * b) & (r > b))) & (r <= D_C_QUOT * g) & (g <= D_C_QUOT * r)
+    if cyan:
+        kept |= (((b > D_C_QUOT * r) & (g > r)) | ((g > D_C_QUOT * r) & (b > r))) & (g <= D_C_QUOT * b) & (b <= D_C_QUOT * g)
+    if red and green and blue:  # brown
+        kept |= (r <= D_C_QUOT * g) & (r <= D_C_QUOT * b) & (g <= D_C_QUOT * r) & (g <= D_C_QUOT * b) \
+                & (b <= D_C_QUOT * r) & (b <= D_C_QUOT * g)
+
+    sepia = np.stack((
+        r * np.float32(0.393) + g * np.float32(0.739) + b * np.float32(0.189),
+        r * np.float32(0.349) + g * np.float32(0.656) + b * np.float32(0.168),
+        r * np.float32(0.272) + g * np.float32(0.504) + b * np.float32(0.131),
+    ), axis=2)
+    changed = ~kept
+    pixels[changed] = np.minimum(sepia[changed].astype(np.int32), 255)
+
+
+def vignette(src_img, pos=None, inner_radius=50., strength=1.) -> None:
+    """Vignette effect."""
+    pixels = _get_pixels(src_img, "src_img", True, True)
+    if pixels is None:
+        print("src_img isn't a valid Surface")
+        return
+    width, height = pixels.shape[:2]
+    # By default, the center of the vignette is the center of the image
+    if pos is None:
+        center_x, center_y = np.float32(width) / np.float32(2.), np.float32(height) / np.float32(2.)
+    else:
+        center_x, center_y = np.float32(pos[0]), np.float32(pos[1])
+    inner_radius, strength = np.float32(inner_radius), np.float32(strength)
+
+    dx = (np.arange(width, dtype=np.float32) - center_x).astype(np.float64)[:, None]
+    dy = (np.arange(height, dtype=np.float32) - center_y).astype(np.float64)[None, :]
+    dist = np.sqrt(dx * dx + dy * dy).astype(np.float32)
+    alpha = np.float32(1.) - strength * ((dist - inner_radius) / (np.float32(width) - inner_radius))
+    alpha = np.maximum(alpha, np.float32(0.))
+    outside = dist > inner_radius
+    pixels[outside] = (pixels[outside] * alpha[outside][:, None]).astype(np.uint8)
+
+
+def blur(*args, **kwargs) -> None:
+    """Blur effect."""
+    # TODO, like the extension
+
+
+def display_in_3D_space(src_img, dst_img, A_x, A_z, B_x, B_z, fov=60., step=0.1, view_dist=1000., rad=False) -> None:
+    """Display a pygame Surface in 3D space."""
+    src = _get_pixels(src_img, "src_img", False, False)
+    if src is None:
+        print("src_img isn't a valid Surface")
+        return
+    dst = _get_pixels(dst_img, "dst_img", True, False)
+    if dst is None:
+        print("dst_img isn't a valid Surface")
+        return
+
+    fov, step, view_dist = np.float32(fov), np.float32(step), np.float32(view_dist)
+    if not rad:  # If the angles are in degrees, convert them to radians
+        fov = np.float32(fov * np.float32(np.pi) / np.float32(180.))
+        step = np.float32(step * np.float32(np.pi) / np.float32(180.))
+    A_x, A_z, B_x, B_z = (np.float32(value) for value in (A_x, A_z, B_x, B_z))
+
+    image_width, image_height = src.shape
+    dst_width, dst_height = dst.shape
+    line_length = np.hypot(float(A_x - B_x), float(A_z - B_z))
+    src_x_ratio = image_width / line_length
+    x_ratio = float(np.float32(dst_width) / (2 * fov))
+    pixel_step = np.float32(step * dst_width / (2 * fov))
+
+    def ccw(a_x, a_y, b_x, b_y, c_x, c_y) -> bool:
+        return (c_y - a_y) * (b_x - a_x) > (b_y - a_y) * (c_x - a_x)
+
+    angle_y = -fov
+    while angle_y < fov:  # One vertical line of the image per step
+        view_x = view_dist * np.cos(angle_y)
+        view_z = view_dist * np.sin(angle_y)
+        zero = np.float32(0.)
+        if ccw(zero, zero, A_x, A_z, B_x, B_z) != ccw(view_x, view_z, A_x, A_z, B_x, B_z) \
+                and ccw(zero, zero, view_x, view_z, A_x, A_z) != ccw(zero, zero, view_x, view_z, B_x, B_z):
+            x_diff_1, x_diff_2 = -view_x, A_x - B_x
+            y_diff_1, y_diff_2 = -view_z, A_z - B_z
+            div = x_diff_1 * y_diff_2 - x_diff_2 * y_diff_1
+            if abs(div) >= np.float32(0.00001):
+                d_y = A_x * B_z - A_z * B_x
+                intersect_x = (-d_y * x_diff_1) / div
+                intersect_z = (-d_y * y_diff_1) / div
+                dist = np.float32(np.hypot(float(intersect_x), float(intersect_z)) * np.cos(angle_y))
+                if dist <= view_dist:
+                    src_x = int(np.hypot(float(intersect_x - A_x), float(intersect_z - A_z)) * src_x_ratio)
+                    x = float(angle_y + fov) * x_ratio
+                    height = int(dst_height / dist)
+                    top = int((dst_height - height) / 2)
+                    if height > 0 and 0 <= src_x < image_width:
+                        rows = np.arange(max(0, -top), min(height, dst_height - top))
+                        y_dec = np.float32(image_height) / np.float32(height)
+                        source_rows = (rows.astype(np.float32) * y_dec).astype(np.int64)
+                        for dst_x in range(max(0, int(x)), min(dst_width, int(x + float(pixel_step)))):
+                            dst[dst_x, top + rows] = src[src_x, source_rows]
+        angle_y = np.float32(angle_y + step)
+
+
+def mode_seven(src_img, dst_img, x0, y0, a, b, c, d) -> None:
+    """Mode 7 effect."""
+    src = _get_pixels(src_img, "src_img", False, False)
+    if src is None:
+        print("src_img isn't a valid Surface")
+        return
+    dst = _get_pixels(dst_img, "dst_img", True, False)
+    if dst is None:
+        print("dst_img isn't a valid Surface")
+        return
+    x0, y0, a, b, c, d = (np.float32(value) for value in (x0, y0, a, b, c, d))
+
+    width, height = src.shape
+    x = np.arange(width, dtype=np.float32)[:, None]
+    y = np.arange(height, dtype=np.float32)[None, :]
+    x_ = np.trunc(a * x - a * x0 + b * y - b * y0 + x0)
+    y_ = np.trunc(c * x - c * x0 + d * y - d * y0 + y0)
+    # The pixels are moved column by column, so the last one wins when several land on the same pixel.
+    inside = (x_ >= 0) & (x_ < dst.shape[0]) & (y_ >= 0) & (y_ < dst.shape[1])
+    dst[x_[inside].astype(np.int64), y_[inside].astype(np.int64)] = src[inside]
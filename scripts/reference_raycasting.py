@@ -0,0 +1,1134 @@
+"""NumPy reference of nostalgiaeraycasting.
+
+The same RayCaster and Scene API as the C extension, computed for all the pixels at once with NumPy arrays,
+in 32-bit floats like the extension. It is much slower, but it needs no build step:
+scripts.backend falls back on it when the C-libs are not installed,
+and scripts.compare_backends checks the output of the extension against it.
+
+A pose and a progressive cast (with its budget) trace the same pixels as the extension, and the pixels not refined yet
+copy the closest pixel traced the same way, so their frames can be compared one by one. The pixels traced are always
+traced in full, and block is accepted but traces every pixel, so the reference gives the exact image it approximates.
+The cost buffer receives what each pixel costs without any culling.
+"""
+
+from math import floor
+
+import numpy as np
+from pygame import Surface, SRCALPHA
+from pygame.surfarray import pixels3d, pixels_alpha
+
+from scripts.reference_filters import buffer_pixels
+
+
+EPSILON = np.float32(0.001)
+F_PI = np.float32(np.pi)
+MAX_ROOMS = 32  # Rooms of the surfaces, only seen through their portals (see RayCaster.create_portal)
+OPACITY_BLOCK_SHIFT = 3  # The opacity masks have one bit per block of 8x8 pixels
+
+SCENE_MAGIC = b"NSCN"
+SCENE_VERSION = 5
+SCENE_ALIGNMENT = 16
+SCENE_NO_TEXTURE = 0xffffffff  # The texture of the faces of a box that are not displayed
+
+# The records of a scene file, in the byte order of the machine (see the SceneHeader structs of casting.cpp).
+SCENE_HEADER = np.dtype([
+    ("magic", "S4"), ("version", "=u4"), ("texture_count", "=u4"), ("surface_count", "=u4"),
+    ("textures_offset", "=u8"), ("surfaces_offset", "=u8"), ("boxes_offset", "=u8"), ("box_count", "=u4"),
+    ("reserved", "=u4"),
+])
+SCENE_TEXTURE = np.dtype([
+    ("width", "=u4"), ("height", "=u4"), ("pixels_offset", "=u8"), ("opaque", "=u4", 4), ("opacity_offset", "=u8"),
+])
+SCENE_SURFACE = np.dtype([
+    ("texture", "=u4"), ("rect", "=u4", 4),
+    ("A", "=f4", 3), ("B", "=f4", 3), ("C", "=f4", 3), ("normal", "=f4", 3), ("min", "=f4", 3), ("max", "=f4", 3),
+    ("room", "=u4"),
+])
+SCENE_BOX = np.dtype([("min", "=f4", 3), ("max", "=f4", 3), ("room", "=u4"), ("faces", SCENE_SURFACE, 6)])
+
+# The corners A, B and C of each face of a box, one bit per axis set where the corner is on the upper side
+BOX_FACE_CORNERS = ((6, 0, 4), (3, 5, 1), (0, 5, 4), (6, 3, 2), (2, 1, 0), (7, 4, 5))
+
+# A pixel of the G-buffer: the pixel before the lights, in the byte order of the screen, and the point hit.
+GSAMPLE = np.dtype([("blue", "u1"), ("green", "u1"), ("red", "u1"), ("alpha", "u1"), ("inter", "=f4", 3)])
+
+_UNSET = object()  # An argument of set_light that was not given
+
+
+def _vec(x, y, z) -> tuple:
+    return np.float32(x), np.float32(y), np.float32(z)
+
+
+def _add(a: tuple, b: tuple) -> tuple:
+    return a[0] + b[0], a[1] + b[1], a[2] + b[2]
+
+
+def _sub(a: tuple, b: tuple) -> tuple:
+    return a[0] - b[0], a[1] - b[1], a[2] - b[2]
+
+
+def _scale(a: tuple, k) -> tuple:
+    return a[0] * k, a[1] * k, a[2] * k
+
+
+def _dot(a: tuple, b: tuple):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def _cross(a: tuple, b: tuple) -> tuple:
+    return a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]
+
+
+def _length(a: tuple):
+    return np.sqrt(_dot(a, a))
+
+
+def _box_corner(box_min: tuple, box_max: tuple, corner: int) -> tuple:
+    """A corner of a box, one bit of corner per axis set where it is on the upper side."""
+    return tuple(box_max[axis] if corner & (1 << axis) else box_min[axis] for axis in range(3))
+
+
+def _check_room(room: int, first: int) -> None:
+    """Make sure a room is one of the MAX_ROOMS rooms, from first."""
+    if not first <= room < MAX_ROOMS:
+        raise ValueError(f"room must be between {first} and {MAX_ROOMS - 1}")
+
+
+def _radians(angle):
+    return np.float32(angle) * F_PI / np.float32(180.)
+
+
+def _refine_rank(x: int, y: int, size: int) -> int:
+    """Order in which the pixels of a size x size block are refined by a progressive cast, like refine_rank of casting.cpp."""
+    rank = 0
+    weight = 1
+    half = size // 2
+    while half >= 1:
+        quarter_x, quarter_y = (x // half) % 2, (y // half) % 2
+        rank += weight * (quarter_x if quarter_x == quarter_y else 3 - quarter_x)
+        weight *= 4
+        half //= 2
+    return rank
+
+
+def _opacity_size(width: int, height: int) -> tuple[int, int]:
+    """The number of bytes of the opacity mask of an image, and its number of blocks in a row."""
+    pitch = ((width - 1) >> OPACITY_BLOCK_SHIFT) + 1
+    return ((pitch * (((height - 1) >> OPACITY_BLOCK_SHIFT) + 1)) >> 3) + 1, pitch
+
+
+class _Image:
+    """The pixels of a pygame Surface, of a pixel buffer or of a scene file texture,
+    copied once and shared by the surfaces using it.
+    Like the extension, the bounding box of the visible pixels is only computed once the image is prepared:
+    the image of a single volatile surface is displayed whole."""
+
+    def __init__(self, rgb: np.ndarray, alpha: np.ndarray, parent: Surface | tuple | None = None, prepare: bool = True):
+        self.parent = parent  # Kept alive, the images are found by their parent
+        self.rgb = rgb  # height x width x 3
+        self.alpha = alpha  # height x width
+        self.prepared = False
+        self.opacity = None  # The opacity mask of prepare_image, as saved in scene files
+        self.opaque = (0, 0, alpha.shape[1], alpha.shape[0])
+        self.crop = (np.float32(0.), np.float32(0.), np.float32(1.), np.float32(1.))
+        if prepare:
+            self.prepare()
+
+    def prepare(self) -> None:
+        """Compute the opacity mask and the bounding box of the visible pixels, like prepare_image."""
+        height, width = self.alpha.shape
+        size, pitch = _opacity_size(width, height)
+        block = 1 << OPACITY_BLOCK_SHIFT
+        padded = np.zeros((-(-height // block) * block, pitch * block), bool)
+        padded[:height, :width] = self.alpha != 0
+        blocks = padded.reshape(-1, block, pitch, block).any(axis=(1, 3))
+        self.opacity = np.packbits(blocks.ravel(), bitorder="little").tobytes().ljust(size, b"\0")
+        self.opaque, self.crop = _crop_texture(self, (0, 0, width, height))
+        self.prepared = True
+
+    @classmethod
+    def from_surface(cls, surface: Surface | tuple, prepare: bool = True) -> "_Image":
+        if isinstance(surface, tuple):  # A (buffer, width, height[, pitch]) tuple, its alpha channel is used as is
+            pixels = buffer_pixels(surface, "image", False)
+            return cls(pixels[:, :, 2::-1].transpose(1, 0, 2).copy(), pixels[:, :, 3].T.copy(), surface, prepare)
+        try:
+            rgb = pixels3d(surface).transpose(1, 0, 2).copy()
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError("image is not a valid surface") from None
+        if surface.get_flags() & SRCALPHA:
+            alpha = pixels_alpha(surface).T.copy()
+        else:
+            alpha = np.full(rgb.shape[:2], 255, np.uint8)
+        return cls(rgb, alpha, surface, prepare)
+
+
+def _crop_texture(image: _Image, rect: tuple) -> tuple:
+    """Shrink a rect of an image to the bounding box of its visible pixels.
+    @param image: The image holding the rect.
+    @param rect: The rect, (x, y, width, height) in pixels.
+    :return: The rect cropped, and the bounding box in fractions of the rect: left, top, right, bottom.
+        A rect without any visible pixel is left as it is.
+    """
+    x, y, width, height = rect
+    rows, columns = np.nonzero(image.alpha[y:y + height, x:x + width])
+    if not len(rows):
+        return rect, (np.float32(0.), np.float32(0.), np.float32(1.), np.float32(1.))
+    left, top, right, bottom = columns.min(), rows.min(), columns.max() + 1, rows.max() + 1
+    crop = (np.float32(left) / np.float32(width), np.float32(top) / np.float32(height),
+            np.float32(right) / np.float32(width), np.float32(bottom) / np.float32(height))
+    return (x + int(left), y + int(top), int(right - left), int(bottom - top)), crop
+
+
+class _Surface:
+    """A textured rectangle, defined by its corners A (top left), B (bottom right) and C (bottom left)."""
+
+    def __init__(self, image: _Image, texture: tuple, rm: bool):
+        self.image = image
+        self.texture = texture  # The rect of the image displayed, (x, y, width, height)
+        self.rm = rm
+        self.billboard = False
+        self.grouped = False
+        self.room = 0  # Always traversed
+        self.faces = None  # The faces of a box
+
+    def set_geometry(self, A: tuple, B: tuple, C: tuple) -> None:
+        self.A, self.B, self.C = A, B, C
+        self.normal = _cross(_sub(A, C), _sub(B, C))
+        self.min = tuple(map(min, A, B))
+        self.max = tuple(map(max, A, B))
+        self.set_constants()
+
+    def set_constants(self) -> None:
+        self.width_length = _length(_sub(self.C, self.B))
+        self.height_length = _length(_sub(self.C, self.A))
+
+    def set_cropped_geometry(self, A: tuple, B: tuple, C: tuple, crop: tuple) -> None:
+        """Set the geometry of the quad A, B, C shrunk to the visible part of the texture."""
+        # C is the bottom left corner, u goes from C to the bottom right corner B, and v from C to the top left corner A.
+        u = _sub(B, C)
+        v = _sub(A, C)
+        left = _add(C, _scale(u, crop[0]))
+        right = _add(C, _scale(u, crop[2]))
+        top = _scale(v, np.float32(1.) - crop[1])
+        bottom = _scale(v, np.float32(1.) - crop[3])
+        self.set_geometry(_add(left, top), _add(right, bottom), _add(left, bottom))
+
+    def orient(self, dx, dz) -> None:
+        """Turn a billboard so it spreads along the horizontal direction (dx, 0, dz)."""
+        anchor = (self.anchor[0] + self.shift * dx, self.anchor[1], self.anchor[2] + self.shift * dz)
+        A = (anchor[0] + self.half_width * dx, anchor[1] + self.height, anchor[2] + self.half_width * dz)
+        B = (anchor[0] - self.half_width * dx, anchor[1], anchor[2] - self.half_width * dz)
+        self.set_geometry(A, B, (A[0], B[1], A[2]))
+
+    def is_static(self) -> bool:
+        return not self.rm and not self.billboard and not self.grouped
+
+    def distance(self, camera: tuple):
+        """The distance from the camera to the plane of the surface."""
+        return abs(_dot(self.normal, self.A) - _dot(self.normal, camera)) / _length(self.normal)
+
+    def textured(self) -> list["_Surface"]:
+        """The surfaces holding the textures: the surface itself, or the faces of a box that have a texture."""
+        return [self]
+
+
+class _Box(_Surface):
+    """An axis-aligned box, traced with a single slab test. Each face is a _Surface, None if it is not displayed."""
+
+    def __init__(self, box_min: tuple, box_max: tuple, faces: list, rm: bool):
+        super().__init__(None, None, rm)
+        self.min, self.max = box_min, box_max
+        self.faces = faces
+
+    def distance(self, camera: tuple):
+        """The distance from the camera to the box, 0 inside of it (like box_distance of casting.cpp)."""
+        outside = tuple(max(np.float32(0.), self.min[axis] - EPSILON - camera[axis], camera[axis] - self.max[axis] - EPSILON)
+                        for axis in range(3))
+        return _length(outside)
+
+    def textured(self) -> list[_Surface]:
+        return [face for face in self.faces if face is not None]
+
+
+class _Light:
+    def __init__(self, pos: tuple, intensity, color: tuple, direction: tuple | None, enabled: bool):
+        self.pos = pos
+        self.intensity = np.float32(intensity)
+        self.color = tuple(min(np.float32(channel), np.float32(1.)) for channel in color)
+        self.direction = direction  # None for a point light
+        self.enabled = enabled
+        self.persistent = False
+
+
+class _Pose:
+    """What decides which pixels of a pose or a progressive cast are traced, like the struct Pose of casting.cpp."""
+
+    def __init__(self):
+        self.size: tuple[int, int] | None = None
+        self.camera: tuple | None = None
+        self.static_version = -1
+        self.progressive = 1
+        self.level = 0  # Rank of the last pixel of each block refined
+        self.baked: np.ndarray | None = None  # If each pixel was traced since the camera or the static surfaces changed
+
+
+class Scene:
+    """Static surfaces shared by casters, made with RayCaster.make_scene"""
+
+    def __init__(self):
+        raise TypeError("cannot create 'Scene' instances")
+
+
+class RayCaster:
+    """RayCaster Object"""
+
+    def __init__(self, scene: Scene | None = None):
+        if scene is not None and not isinstance(scene, Scene):
+            raise TypeError("argument 1 must be Scene")
+        self._scene = scene
+        self._surfaces: list[_Surface] = []  # The top of the stack first, like the list of the extension
+        self._images: dict[int, _Image] = {}  # The images of pygame Surfaces, by id of the Surface
+        self._animations: list[list[tuple]] = []  # (image, texture, crop) of each frame
+        self._groups: list[dict] = []
+        self._portals: list[dict] = []
+        self._lights: list[_Light] = []  # The last added first
+        self._light_handles: list[_Light] = []
+        self._poses: dict[str | None, _Pose] = {}  # By name, None for the progressive casts without a name
+        self._static_version = 0  # Changed each time the persistent surfaces change, like in the extension
+        self._hidden_rooms: set[int] | None = None  # The rooms left out of the last cast
+
+    # SURFACES
+
+    def _acquire_image(self, surface: Surface, prepare: bool) -> _Image:
+        """A new image is only prepared for a persistent surface (prepare), a shared one always is."""
+        image = self._images.get(id(surface))
+        if image is None:
+            image = self._images[id(surface)] = _Image.from_surface(surface, prepare)
+        elif not image.prepared:
+            image.prepare()
+        return image
+
+    def _acquire_frame(self, surface_image: Surface, rect, prepare: bool) -> tuple:
+        image = self._acquire_image(surface_image, prepare)
+        if rect is None:  # The whole image was already cropped
+            return image, image.opaque, image.crop
+        x, y, width, height = (int(value) for value in rect)
+        if x < 0 or y < 0 or width <= 0 or height <= 0 \
+                or x + width > image.alpha.shape[1] or y + height > image.alpha.shape[0]:
+            raise ValueError("rect must be inside the image")
+        if not image.prepared:
+            return image, (x, y, width, height), (np.float32(0.), np.float32(0.), np.float32(1.), np.float32(1.))
+        return (image,) + _crop_texture(image, (x, y, width, height))
+
+    def _select_frame(self, surface_image, rect, prepare: bool, index: int, time: float, fps: float) -> tuple:
+        if not isinstance(surface_image, int):
+            return self._acquire_frame(surface_image, rect, prepare)
+        if not 0 <= surface_image < len(self._animations):
+            raise ValueError("Unknown animation")
+        if rect is not None:
+            raise ValueError("rect can not be used with an animation")
+        frames = self._animations[surface_image]
+        if fps > 0.:
+            index = floor(np.float32(time) * np.float32(fps))
+        return frames[index % len(frames)]  # Animations loop
+
+    def _sweep_images(self) -> None:
+        """Forget the images not used by any surface or animation anymore."""
+        used = {id(textured.image) for surface in self._surfaces for textured in surface.textured()}
+        used.update(id(surface.image) for group in self._groups for surface in group["surfaces"])
+        used.update(id(frame[0]) for frames in self._animations for frame in frames)
+        self._images = {key: image for key, image in self._images.items() if id(image) in used}
+
+    def add_surface(self, *args, **kwargs) -> None:
+        """Adds a surface to the caster."""
+        if self._add_surface(*args, **kwargs).is_static():
+            self._static_version += 1  # The poses need to be traced again
+
+    def _add_surface(self, image, A_x, A_y, A_z, B_x, B_y, B_z, C_x=None, C_y=None, C_z=None, rm=False, rect=None,
+                     frame=0, time=0., fps=0., room=0) -> _Surface:
+        """Add a surface on top of the stack, without changing the poses."""
+        _check_room(room, 0)
+        image, texture, crop = self._select_frame(image, rect, not rm, frame, time, fps)
+        surface = _Surface(image, texture, bool(rm))
+        surface.room = room
+        A = _vec(A_x, A_y, A_z)
+        B = _vec(B_x, B_y, B_z)
+        C = (A[0], B[1], A[2]) if C_x is None or C_y is None or C_z is None else _vec(C_x, C_y, C_z)
+        surface.set_cropped_geometry(A, B, C, crop)
+        self._surfaces.insert(0, surface)
+        return surface
+
+    def add_box(self, min_x, min_y, min_z, max_x, max_y, max_z, faces, rm=False, room=0) -> None:
+        """Adds a box textured on each face to the caster."""
+        box_min, box_max = _vec(min_x, min_y, min_z), _vec(max_x, max_y, max_z)
+        if any(low > high for low, high in zip(box_min, box_max)):
+            raise ValueError("min can't be greater than max")
+        _check_room(room, 0)
+        try:
+            faces = list(faces)
+        except TypeError:
+            raise TypeError("faces must be a sequence") from None
+        if len(faces) != 6:
+            raise ValueError("faces must hold the texture of the 6 faces")
+
+        # A face is a pygame Surface or a (Surface, rect) tuple, such as an atlas frame, in the order -x, +x, -y, +y, -z, +z
+        box_faces = []
+        for item, corners in zip(faces, BOX_FACE_CORNERS):
+            if item is None:
+                box_faces.append(None)
+                continue
+            image, texture, crop = self._acquire_frame(*item, not rm) if isinstance(item, tuple) and len(item) == 2 \
+                else self._acquire_frame(item, None, not rm)
+            face = _Surface(image, texture, False)
+            face.set_cropped_geometry(*(_box_corner(box_min, box_max, corner) for corner in corners), crop)
+            box_faces.append(face)
+        box = _Box(box_min, box_max, box_faces, bool(rm))
+        box.room = room
+        self._surfaces.insert(0, box)
+        if box.is_static():
+            self._static_version += 1  # The poses need to be traced again
+
+    def add_billboard(self, image, x, y, z, width, height, rm=False, rect=None, frame=0, time=0., fps=0.,
+                      room=0) -> None:
+        """Adds a surface always facing the camera to the caster."""
+        width, height = np.float32(width), np.float32(height)
+        if width <= 0. or height <= 0.:
+            raise ValueError("width and height must be greater than 0")
+        _check_room(room, 0)
+        image, texture, crop = self._select_frame(image, rect, not rm, frame, time, fps)
+        surface = _Surface(image, texture, bool(rm))
+        surface.billboard = True
+        surface.room = room
+        surface.anchor = _vec(x, np.float32(y) + height * (np.float32(1.) - crop[3]), z)
+        surface.shift = width / np.float32(2.) * (np.float32(1.) - crop[0] - crop[2])
+        surface.half_width = width / np.float32(2.) * (crop[2] - crop[0])
+        surface.height = height * (crop[3] - crop[1])
+        surface.orient(np.float32(0.), np.float32(1.))  # Until the next cast
+        self._surfaces.insert(0, surface)
+
+    def register_animation(self, frames) -> int:
+        """Registers the frames of an animation and returns its id."""
+        if not len(frames):
+            raise ValueError("An animation needs at least one frame")
+        animation = []
+        for item in frames:  # A frame is a pygame Surface or a (Surface, rect) tuple, such as an atlas frame.
+            if isinstance(item, tuple) and len(item) == 2:
+                animation.append(self._acquire_frame(*item, True))
+            else:
+                animation.append(self._acquire_frame(item, None, True))
+        self._animations.append(animation)
+        return len(self._animations) - 1
+
+    def create_group(self, surfaces) -> int:
+        """Adds surfaces moved together and returns the handle of the group."""
+        group = {"surfaces": [], "local": [], "visible": True}
+        try:
+            for item in surfaces:
+                if isinstance(item, tuple):
+                    surface = self._add_surface(*item)
+                elif isinstance(item, dict):
+                    surface = self._add_surface(**item)
+                else:
+                    raise TypeError("A surface must be a tuple or a dict of the arguments of add_surface")
+                surface.rm = False  # The group keeps its surfaces
+                surface.grouped = True
+                group["surfaces"].append(surface)
+                group["local"].append((surface.A, surface.B, surface.C))
+        except Exception:
+            del self._surfaces[:len(group["surfaces"])]  # They are on top of the stack
+            raise
+        self._groups.append(group)
+        return len(self._groups) - 1
+
+    def set_group_transform(self, group, translation=None, yaw=0., visible=True, rad=False) -> None:
+        """Moves, turns, shows or hides a group of surfaces."""
+        if not 0 <= group < len(self._groups):
+            raise ValueError("Unknown group")
+        group = self._groups[group]
+        tx, ty, tz = _vec(0., 0., 0.) if translation is None else _vec(*translation)
+        yaw = np.float32(yaw) if rad else _radians(yaw)
+
+        visible = bool(visible)
+        if group["visible"] != visible:
+            group["visible"] = visible
+            if visible:
+                for surface in group["surfaces"]:
+                    self._surfaces.insert(0, surface)
+            else:
+                hidden = {id(surface) for surface in group["surfaces"]}
+                self._surfaces = [surface for surface in self._surfaces if id(surface) not in hidden]
+
+        cos_yaw, sin_yaw = np.cos(yaw), np.sin(yaw)
+        for surface, points in zip(group["surfaces"], group["local"]):
+            surface.set_geometry(*((x * cos_yaw + z * sin_yaw + tx, y + ty, z * cos_yaw - x * sin_yaw + tz)
+                                   for x, y, z in points))
+
+    def create_portal(self, A_x, A_y, A_z, B_x, B_y, B_z, room, open=True) -> int:
+        """Adds an opening through which the surfaces of a room are seen and returns its handle."""
+        _check_room(room, 1)  # The room 0 is always traversed
+        A, B = _vec(A_x, A_y, A_z), _vec(B_x, B_y, B_z)
+        self._portals.append({"min": tuple(map(min, A, B)), "max": tuple(map(max, A, B)), "room": room,
+                              "open": bool(open)})
+        return len(self._portals) - 1
+
+    def set_portal(self, portal, open) -> None:
+        """Opens or closes a portal."""
+        if not 0 <= portal < len(self._portals):
+            raise ValueError("Unknown portal")
+        self._portals[portal]["open"] = bool(open)
+
+    def clear_surfaces(self) -> None:
+        """Clears all surfaces from the caster."""
+        for group in self._groups:  # The groups are kept, without any surface.
+            group["surfaces"].clear()
+            group["local"].clear()
+            group["visible"] = True
+        self._surfaces = []
+        self._static_version += 1
+        self._sweep_images()
+
+    # LIGHTS
+
+    @staticmethod
+    def _make_light(x, y, z, intensity=1., red=1., green=1., blue=1., direction_x=None, direction_y=None,
+                    direction_z=None, enabled=True) -> _Light:
+        direction = None if direction_x is None else _vec(direction_x, direction_y or 0., direction_z or 0.)
+        return _Light(_vec(x, y, z), intensity, (red, green, blue), direction, bool(enabled))
+
+    def add_light(self, *args, **kwargs) -> None:
+        """Adds a light to the scene."""
+        self._lights.insert(0, self._make_light(*args, **kwargs))
+
+    def create_light(self, *args, **kwargs) -> int:
+        """Adds a persistent light to the scene and returns its handle."""
+        light = self._make_light(*args, **kwargs)
+        light.persistent = True  # The light stays until the caster is destroyed
+        self._lights.insert(0, light)
+        self._light_handles.append(light)
+        return len(self._light_handles) - 1
+
+    def set_light(self, handle, *, pos=None, intensity=None, color=None, direction=_UNSET, enabled=None) -> None:
+        """Changes or enables/disables a light created with create_light."""
+        if not 0 <= handle < len(self._light_handles):
+            raise ValueError("Unknown light")
+        light = self._light_handles[handle]
+        # Parse everything before changing the light, so a wrong argument does not leave it half updated.
+        new_pos = light.pos if pos is None else _vec(*pos)
+        new_intensity = light.intensity if intensity is None else np.float32(intensity)
+        new_color = light.color if color is None else tuple(min(np.float32(c), np.float32(1.)) for c in _vec(*color))
+        new_direction = light.direction
+        if direction is None:  # A light without direction is a point light
+            new_direction = None
+        elif direction is not _UNSET:
+            new_direction = _vec(*direction)
+        light.pos, light.intensity, light.color, light.direction = new_pos, new_intensity, new_color, new_direction
+        if enabled is not None:
+            light.enabled = bool(enabled)
+
+    def clear_lights(self) -> None:
+        """Clears all lights from the caster."""
+        self._lights = [light for light in self._lights if light.persistent]
+
+    # SCENES
+
+    def make_scene(self) -> Scene:
+        """Moves the persistent surfaces of the caster into a Scene shared by other casters."""
+        scene = object.__new__(Scene)
+        scene._surfaces = [surface for surface in self._surfaces if surface.is_static()]
+        self._surfaces = [surface for surface in self._surfaces if not surface.is_static()]
+        self._static_version += 1
+        return scene
+
+    def load_scene(self, path) -> None:
+        """Maps a compiled scene file and adds its surfaces to the caster."""
+        data = np.fromfile(path, np.uint8)
+        size = len(data)
+        if size < SCENE_HEADER.itemsize:
+            raise ValueError("Not a valid scene file")
+        header = data[:SCENE_HEADER.itemsize].view(SCENE_HEADER)[0]
+        texture_count, surface_count = int(header["texture_count"]), int(header["surface_count"])
+        box_count = int(header["box_count"])
+        textures_offset, surfaces_offset = int(header["textures_offset"]), int(header["surfaces_offset"])
+        boxes_offset = int(header["boxes_offset"])
+        if header["magic"] != SCENE_MAGIC or header["version"] != SCENE_VERSION \
+                or textures_offset + SCENE_TEXTURE.itemsize * texture_count > size \
+                or surfaces_offset + SCENE_SURFACE.itemsize * surface_count > size \
+                or boxes_offset + SCENE_BOX.itemsize * box_count > size:
+            raise ValueError("Not a valid scene file")
+        textures = data[textures_offset:textures_offset + SCENE_TEXTURE.itemsize * texture_count].view(SCENE_TEXTURE)
+        records = data[surfaces_offset:surfaces_offset + SCENE_SURFACE.itemsize * surface_count].view(SCENE_SURFACE)
+        boxes = data[boxes_offset:boxes_offset + SCENE_BOX.itemsize * box_count].view(SCENE_BOX)
+
+        # Every texture of the file becomes an image, the pixels are BGRA.
+        # The opacity mask and the bounding box of the visible pixels were computed by the compiler.
+        images = []
+        for texture in textures:
+            width, height, offset = int(texture["width"]), int(texture["height"]), int(texture["pixels_offset"])
+            opaque_x, opaque_y, opaque_width, opaque_height = (int(value) for value in texture["opaque"])
+            mask_offset, (mask_size, _) = int(texture["opacity_offset"]), _opacity_size(width, height)
+            if width == 0 or height == 0 or offset + 4 * width * height > size or mask_offset + mask_size > size \
+                    or opaque_width == 0 or opaque_height == 0 \
+                    or opaque_x + opaque_width > width or opaque_y + opaque_height > height:
+                raise ValueError("Not a valid scene file")
+            pixels = data[offset:offset + 4 * width * height].reshape(height, width, 4)
+            image = _Image(pixels[:, :, 2::-1].copy(), pixels[:, :, 3].copy(), prepare=False)
+            image.opacity = data[mask_offset:mask_offset + mask_size].tobytes()
+            image.opaque = (opaque_x, opaque_y, opaque_width, opaque_height)
+            image.crop = (np.float32(opaque_x) / np.float32(width), np.float32(opaque_y) / np.float32(height),
+                          np.float32(opaque_x + opaque_width) / np.float32(width),
+                          np.float32(opaque_y + opaque_height) / np.float32(height))
+            image.prepared = True
+            images.append(image)
+
+        def load_record(record) -> _Surface:
+            if record["texture"] >= texture_count or record["room"] >= MAX_ROOMS:
+                raise ValueError("Not a valid scene file")
+            image = images[record["texture"]]
+            x, y, width, height = (int(value) for value in record["rect"])
+            if width == 0 or height == 0 or x + width > image.alpha.shape[1] or y + height > image.alpha.shape[0]:
+                raise ValueError("Not a valid scene file")
+            surface = _Surface(image, (x, y, width, height), False)
+            # Everything was computed by the compiler, no need to call set_geometry.
+            surface.A, surface.B, surface.C = (_vec(*record[key]) for key in ("A", "B", "C"))
+            surface.normal, surface.min, surface.max = (_vec(*record[key]) for key in ("normal", "min", "max"))
+            surface.set_constants()
+            surface.room = int(record["room"])
+            return surface
+
+        surfaces = []
+        for record in records:
+            surfaces.insert(0, load_record(record))
+        for record in boxes:  # Then the boxes, after all the quads
+            if record["room"] >= MAX_ROOMS:
+                raise ValueError("Not a valid scene file")
+            faces = [None if face["texture"] == SCENE_NO_TEXTURE else load_record(face) for face in record["faces"]]
+            box = _Box(_vec(*record["min"]), _vec(*record["max"]), faces, False)
+            box.room = int(record["room"])
+            surfaces.insert(0, box)
+        self._surfaces[:0] = surfaces
+        self._static_version += 1
+
+    def save_scene(self, path) -> None:
+        """Compiles the persistent surfaces of the caster into a scene file."""
+        # Only the persistent surfaces are saved, in the order they were added (the list is a stack).
+        # The surfaces of the scene of the caster were added before its own ones.
+        scene_surfaces = self._scene._surfaces if self._scene is not None else []
+        surfaces = [surface for surface in self._surfaces if surface.is_static()] + scene_surfaces
+        surfaces.reverse()
+        quads = [surface for surface in surfaces if surface.faces is None]
+        boxes = [surface for surface in surfaces if surface.faces is not None]
+
+        images = []
+        for surface in surfaces:
+            for textured in surface.textured():
+                if not any(image is textured.image for image in images):
+                    images.append(textured.image)
+
+        def align(offset: int) -> int:
+            return (offset + SCENE_ALIGNMENT - 1) & ~(SCENE_ALIGNMENT - 1)
+
+        header = np.zeros(1, SCENE_HEADER)
+        header["magic"], header["version"] = SCENE_MAGIC, SCENE_VERSION
+        header["texture_count"], header["surface_count"], header["box_count"] = len(images), len(quads), len(boxes)
+        header["textures_offset"] = SCENE_HEADER.itemsize
+        header["surfaces_offset"] = SCENE_HEADER.itemsize + SCENE_TEXTURE.itemsize * len(images)
+        header["boxes_offset"] = int(header["surfaces_offset"][0]) + SCENE_SURFACE.itemsize * len(quads)
+
+        textures = np.zeros(len(images), SCENE_TEXTURE)
+        offset = align(int(header["boxes_offset"][0]) + SCENE_BOX.itemsize * len(boxes))
+        for texture, image in zip(textures, images):
+            if not image.prepared:
+                image.prepare()
+            height, width = image.alpha.shape
+            texture["width"], texture["height"], texture["pixels_offset"] = width, height, offset
+            texture["opaque"] = image.opaque
+            texture["opacity_offset"] = align(offset + 4 * width * height)
+            offset = align(int(texture["opacity_offset"]) + len(image.opacity))
+
+        def save_record(record, surface: _Surface, room: int) -> None:
+            record["texture"] = next(i for i, image in enumerate(images) if image is surface.image)
+            record["rect"] = surface.texture
+            for key, value in (("A", surface.A), ("B", surface.B), ("C", surface.C), ("normal", surface.normal),
+                               ("min", surface.min), ("max", surface.max)):
+                record[key] = value
+            record["room"] = room
+
+        records = np.zeros(len(quads), SCENE_SURFACE)
+        for record, surface in zip(records, quads):
+            save_record(record, surface, surface.room)
+
+        box_records = np.zeros(len(boxes), SCENE_BOX)
+        for record, box in zip(box_records, boxes):
+            record["min"], record["max"], record["room"] = box.min, box.max, box.room
+            for face_record, face in zip(record["faces"], box.faces):
+                if face is None:
+                    face_record["texture"] = SCENE_NO_TEXTURE
+                else:
+                    save_record(face_record, face, box.room)
+
+        with open(path, "wb") as file:
+            for part in (header, textures, records, box_records):
+                file.write(part.tobytes())
+            written = int(header["boxes_offset"][0]) + SCENE_BOX.itemsize * len(boxes)
+            for texture, image in zip(textures, images):
+                file.write(bytes(int(texture["pixels_offset"]) - written))
+                pixels = np.dstack((image.rgb[:, :, ::-1], image.alpha))
+                file.write(pixels.tobytes())
+                written = int(texture["pixels_offset"]) + pixels.nbytes
+                file.write(bytes(int(texture["opacity_offset"]) - written))
+                file.write(image.opacity)
+                written = int(texture["opacity_offset"]) + len(image.opacity)
+
+    # CASTS
+
+    def _orient_billboards(self, angle_y) -> None:
+        """Turn the billboards toward a camera looking at the given angle around the y axis."""
+        dx, dz = -np.sin(angle_y), np.cos(angle_y)
+        for surface in self._surfaces:
+            if surface.billboard:
+                surface.orient(dx, dz)
+
+    def _all_surfaces(self) -> list[_Surface]:
+        """All the surfaces in the order they are traced: the ones of the caster, then the ones of the scene."""
+        return self._surfaces + (self._scene._surfaces if self._scene is not None else [])
+
+    @staticmethod
+    def _on_screen(box_min: tuple, box_max: tuple, origin: tuple, forward: tuple, plane_width, plane_height,
+                   width: int, height: int) -> bool:
+        """If a bounding box may be seen on the screen, from the projection of its corners like project_box of casting.cpp.
+        @param forward: The ray of the center of the screen.
+        """
+        forward_length2 = forward[0] * forward[0] + forward[2] * forward[2]
+        right_y = plane_height * np.sqrt(forward_length2)
+        xs, ys = [], []
+        for i in range(8):
+            corner = tuple((box_max[axis] + EPSILON if i & (1 << axis) else box_min[axis] - EPSILON) - origin[axis]
+                           for axis in range(3))
+            depth = corner[0] * forward[0] + corner[2] * forward[2]
+            if depth <= EPSILON:
+                continue  # Behind the camera
+            column = (corner[2] * forward[0] - corner[0] * forward[2]) / (depth * plane_width)
+            row = (corner[1] * forward_length2 / depth - forward[1]) / right_y
+            xs.append((np.float32(.5) - column) * np.float32(width) - np.float32(1.))
+            ys.append((np.float32(.5) - row) * np.float32(height) - np.float32(1.))
+        if not xs:
+            return False
+        if len(xs) < 8:  # Crossing the plane of the camera, the projection is unbounded
+            return True
+        # A margin of two pixels for the rounding of the positions of the pixels
+        return max(xs) + 2. >= 0. and max(ys) + 2. >= 0. and min(xs) - 2. <= width - 1. and min(ys) - 2. <= height - 1.
+
+    def _find_hidden_rooms(self, origin: tuple, angle_x, angle_y, fov, view_distance, width: int, height: int) -> set[int]:
+        """The rooms the camera is not in, and not seen through any open portal on the screen."""
+        bounds = {}
+        for surface in self._all_surfaces():
+            if surface.room:
+                box = bounds.get(surface.room, (surface.min, surface.max))
+                bounds[surface.room] = (tuple(map(min, box[0], surface.min)), tuple(map(max, box[1], surface.max)))
+        seen = {room for room, (box_min, box_max) in bounds.items()
+                if all(box_min[axis] - EPSILON <= origin[axis] <= box_max[axis] + EPSILON for axis in range(3))}
+
+        plane_width = np.float32(2.) * np.tan(fov)
+        plane_height = plane_width * np.float32(height) / np.float32(width)
+        forward = (np.cos(angle_y) * view_distance, np.sin(angle_x) * plane_height * view_distance,
+                   np.sin(angle_y) * view_distance)
+        for portal in self._portals:
+            if portal["open"] and portal["room"] not in seen and self._on_screen(
+                    portal["min"], portal["max"], origin, forward, plane_width, plane_height, width, height):
+                seen.add(portal["room"])
+        return set(range(1, MAX_ROOMS)) - seen
+
+    def _trace(self, surfaces: list[_Surface], origin: tuple, rays: tuple, max_dist) -> tuple:
+        """Find the closest opaque pixel hit by each ray.
+        @param surfaces: The surfaces, in the order they are traced. The first one wins the ties.
+        @param origin: The camera.
+        @param rays: The x, y and z of the direction of every ray, its length is the view distance.
+        @param max_dist: The view distance.
+        :return: The distance, the colour (before the lights), the point hit and the surfaces tested of each ray.
+        """
+        count = len(rays[0])
+        best = np.full(count, max_dist, np.float32)
+        colour = np.zeros((count, 3), np.uint8)
+        inter = np.zeros((3, count), np.float32)
+        tested = np.full(count, len(surfaces), np.int32)  # Without any culling, every ray tests every surface
+        ray_length = _length(rays)
+
+        for surface in surfaces:
+            if surface.faces is not None:
+                self._trace_box(surface, origin, rays, max_dist, best, colour, inter)
+                continue
+
+            facing = -_dot(surface.normal, _sub(origin, surface.A))
+            with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                normal_dot_direction = _dot(surface.normal, rays)
+                fac = facing / normal_dot_direction
+            candidates = np.nonzero((np.abs(normal_dot_direction) >= EPSILON) & (fac >= 0.) & (fac <= 1.))[0]
+            if not len(candidates):
+                continue
+
+            ray = tuple(component[candidates] for component in rays)
+            point = _add(origin, _scale(ray, fac[candidates]))
+            distance = _length(_sub(origin, point))
+            inside = (distance <= ray_length[candidates]) & (distance >= EPSILON)
+            for axis in range(3):
+                inside &= (surface.min[axis] - point[axis] <= EPSILON) & (point[axis] - surface.max[axis] <= EPSILON)
+            inside &= distance < best[candidates]
+            if not inside.any():
+                continue
+            self._hit(surface, candidates[inside], tuple(component[inside] for component in point), distance[inside],
+                      max_dist, best, colour, inter)
+
+        return best, colour, inter, tested
+
+    @staticmethod
+    def _hit(surface: _Surface, candidates: np.ndarray, point: tuple, distance: np.ndarray, max_dist,
+             best: np.ndarray, colour: np.ndarray, inter: np.ndarray) -> np.ndarray:
+        """Read the texels of a surface where some rays cross it, the opaque ones become the closest hits of their rays.
+        @param candidates: The rays crossing the surface closer than their closest hit.
+        @param point: The points where they cross it, and distance their distance to the camera.
+        :return: Which candidates hit an opaque texel.
+        """
+        # The texel hit, from the distances of the point to the left and bottom sides
+        tex_x, tex_y, width, height = surface.texture
+        x_dist = _length(_cross(_sub(surface.C, surface.A), _sub(point, surface.A))) / surface.height_length
+        x = (x_dist * np.float32(width) / surface.width_length).astype(np.int64)
+        y_dist = _length(_cross(_sub(surface.B, surface.C), _sub(point, surface.C))) / surface.width_length
+        y = height - (y_dist * np.float32(height) / surface.height_length).astype(np.int64)
+        on_texture = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        x = np.where(on_texture, x, 0) + tex_x
+        y = np.where(on_texture, y, 0) + tex_y
+        opaque = on_texture & (surface.image.alpha[y, x] != 0)
+
+        hits = candidates[opaque]
+        best[hits] = distance[opaque]
+        for axis in range(3):
+            inter[axis, hits] = point[axis][opaque]
+        quotient = np.float32(1.) - distance[opaque] / np.float32(max_dist)
+        colour[hits] = (surface.image.rgb[y[opaque], x[opaque]] * quotient[:, None]).astype(np.uint8)
+        return opaque
+
+    @staticmethod
+    def _slab_test(box: _Box, origin: tuple, rays: tuple) -> tuple:
+        """Where each ray enters and leaves a box, like slab_test of casting.cpp.
+        :return: The positions along the rays and the faces where they enter and where they leave, and which rays cross the box.
+        """
+        count = len(rays[0])
+        t = [np.full(count, -np.inf, np.float32), np.full(count, np.inf, np.float32)]
+        faces = [np.zeros(count, np.int64), np.zeros(count, np.int64)]
+        crossed = np.ones(count, bool)
+        for axis in range(3):
+            direction = rays[axis]
+            parallel = direction == 0.
+            crossed &= ~parallel | ((origin[axis] >= box.min[axis]) & (origin[axis] <= box.max[axis]))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t_low = (box.min[axis] - origin[axis]) / direction
+                t_high = (box.max[axis] - origin[axis]) / direction
+            down = t_low > t_high  # Going down the axis, the upper face is crossed first
+            ends = (np.where(down, t_high, t_low), np.where(down, t_low, t_high))
+            end_faces = (np.where(down, 2 * axis + 1, 2 * axis), np.where(down, 2 * axis, 2 * axis + 1))
+            for end, closer in ((0, np.greater), (1, np.less)):
+                update = ~parallel & closer(ends[end], t[end])
+                t[end] = np.where(update, ends[end], t[end])
+                faces[end] = np.where(update, end_faces[end], faces[end])
+        crossed &= (t[0] <= t[1]) & (t[1] >= 0.) & (t[0] <= 1.)
+        return t, faces, crossed
+
+    def _trace_box(self, box: _Box, origin: tuple, rays: tuple, max_dist, best: np.ndarray, colour: np.ndarray,
+                   inter: np.ndarray) -> None:
+        """Trace a box like trace_box of casting.cpp: the texel is read on the face where a ray enters,
+        or on the face where it leaves if the first one is missing or transparent there. The arguments are the ones of _trace.
+        """
+        t, faces, pending = self._slab_test(box, origin, rays)
+        for end in range(2):
+            for index, face in enumerate(box.faces):
+                if face is None:
+                    continue
+                candidates = np.nonzero(pending & (faces[end] == index) & (t[end] >= 0.) & (t[end] <= 1.))[0]
+                if not len(candidates):
+                    continue
+                ray = tuple(component[candidates] for component in rays)
+                point = _add(origin, _scale(ray, t[end][candidates]))
+                distance = _length(_sub(origin, point))
+                near = distance >= EPSILON
+                closer = distance < best[candidates]
+                pending[candidates[near & ~closer]] = False  # The other face is even further
+                inside = near & closer
+                for axis in range(3):
+                    inside &= (face.min[axis] - point[axis] <= EPSILON) & (point[axis] - face.max[axis] <= EPSILON)
+                hit = self._hit(face, candidates[inside], tuple(component[inside] for component in point),
+                                distance[inside], max_dist, best, colour, inter)
+                pending[candidates[inside][hit]] = False
+
+    def _shade(self, colour: np.ndarray, inter: np.ndarray) -> tuple:
+        """Apply the lights of the caster to the colours.
+        :return: The colours lit, and the lights evaluated by each pixel.
+        """
+        evaluated = np.zeros(len(colour), np.int32)
+        if not self._lights:  # Without lights, the pixels are kept as they are
+            return colour, evaluated
+        lit = np.nonzero(colour.any(axis=1))[0]
+        point = tuple(inter[:, lit])
+        lighting = np.zeros((3, len(lit)), np.float32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for light in self._lights:
+                if not light.enabled:
+                    continue
+                evaluated[lit] += 1
+                w = _sub(point, light.pos)
+                dist_sq = _dot(w, w)
+                dist = np.sqrt(dist_sq)
+                if light.direction is None:
+                    ratio = np.where(dist_sq < light.intensity * light.intensity, dist / light.intensity, np.inf)
+                else:
+                    # The distance from the point to the axis of the spotlight
+                    axis = _sub(light.direction, light.pos)
+                    axis_length2 = _dot(axis, axis)
+                    ps = _dot(w, axis)
+                    projection = _add(light.pos, _scale(axis, ps / axis_length2))
+                    dist2 = np.where(ps <= 0., dist, np.where(ps >= axis_length2, _length(_sub(point, light.direction)),
+                                                             _length(_sub(point, projection))))
+                    ratio = (dist2 * np.sqrt(axis_length2)) / (dist * light.intensity)
+                reached = ratio < 1.
+                for channel in range(3):
+                    lighting[channel] += np.where(reached, (np.float32(1.) - ratio) * light.color[channel], 0.)
+        np.minimum(lighting, np.float32(1.), out=lighting)  # Prevent the pixels from being too bright
+
+        colour = colour.copy()
+        colour[lit] = (colour[lit] * lighting.T).astype(np.uint8)
+        return colour, evaluated
+
+    def _get_pose(self, name: str | None, width: int, height: int, camera: tuple, progressive: int) -> _Pose:
+        """The pose of a name, traced again if the camera, the size of the screen or the persistent surfaces changed."""
+        pose = self._poses.setdefault(name, _Pose())
+        if pose.size == (width, height) and pose.static_version == self._static_version and pose.camera == camera:
+            if pose.progressive != progressive:
+                pose.progressive = progressive
+                pose.level = 0  # Already traced pixels are kept, the others are refined again from the coarsest grid
+            return pose
+        pose.size = (width, height)
+        pose.camera = camera
+        pose.static_version = self._static_version
+        pose.progressive = progressive
+        pose.level = 0
+        pose.baked = np.zeros((height, width), bool)
+        return pose
+
+    @staticmethod
+    def _get_rays(width: int, height: int, angle_x, angle_y, fov, view_distance) -> tuple:
+        """The directions of the rays of the columns (x, z) and rows (y) of a screen, like the ray tables of casting.cpp."""
+        plane_width = np.float32(2.) * np.tan(fov)
+        plane_height = plane_width * np.float32(height) / np.float32(width)
+        # The positions are the center of the pixels, accumulated from 0.5 the same way as the extension.
+        columns = np.full(width + 1, -np.float32(1.) / np.float32(width), np.float32)
+        rows = np.full(height + 1, -np.float32(1.) / np.float32(height), np.float32)
+        columns[0] = rows[0] = .5
+        columns = np.add.accumulate(columns)[1:]
+        rows = np.add.accumulate(rows)[1:]
+
+        forward_x = np.cos(angle_y) * view_distance
+        forward_y = np.sin(angle_x) * plane_height * view_distance
+        forward_z = np.sin(angle_y) * view_distance
+        return (forward_x + columns * (-forward_z * plane_width), forward_y + rows * (plane_height * view_distance),
+                forward_z + columns * (forward_x * plane_width))
+
+    def raycasting(self, dst_surface, x=0., y=0., z=0., angle_x=0., angle_y=0., fov=120., view_distance=1000.,
+                   rad=False, scissor=None, mask=None, pose=None, progressive=1, cost=None, block=1, gbuffer=None,
+                   size=None, budget=0) -> None:
+        """Display the scene using raycasting."""
+        fov, view_distance = np.float32(fov), np.float32(view_distance)
+        if fov <= 0.:
+            raise ValueError("fov must be greater than 0")
+        if view_distance <= 0.:
+            raise ValueError("view_distance must be greater than 0")
+        if progressive not in (1, 2, 4, 8):
+            raise ValueError("progressive must be 1, 2, 4 or 8")
+        if budget < 0:
+            raise ValueError("budget can't be negative")
+        if block not in (1, 2, 4, 8):
+            raise ValueError("block must be 1, 2, 4 or 8")
+        if block > 1 and (pose is not None or progressive > 1):
+            raise ValueError("block can't be used with a pose or a progressive cast")
+        if pose is not None and not isinstance(pose, str):
+            raise TypeError("pose must be a string")
+
+        screen = self._get_screen(dst_surface)
+        width, height = screen.shape[:2]
+        if size is not None:
+            if not isinstance(size, tuple):
+                raise TypeError("size must be a (width, height) tuple")
+            size_width, size_height = (int(value) for value in size)
+            if size_width <= 0 or size_height <= 0 or size_width > width or size_height > height:
+                raise ValueError("size must be positive and can't be larger than dst_surface")
+            width, height = size_width, size_height
+
+        # Only the pixels inside the scissor rect and not fully covered by the mask are cast.
+        cast = np.zeros((height, width), bool)
+        if scissor is None:
+            cast[:, :] = True
+        else:
+            scissor_x, scissor_y, scissor_width, scissor_height = (int(value) for value in scissor)
+            cast[max(0, scissor_y):max(0, scissor_y + scissor_height), max(0, scissor_x):max(0, scissor_x + scissor_width)] = True
+        if mask is not None:
+            coverage = np.frombuffer(mask, np.uint8)
+            if len(coverage) != width * height:
+                raise ValueError("mask must have one byte per pixel cast")
+            cast &= coverage.reshape(height, width) != 255
+
+        costs = None
+        if cost is not None:
+            view = memoryview(cost)
+            if view.readonly:
+                raise BufferError("Object is not writable.")
+            if view.itemsize != 2 or view.format[-1] != "H" or view.nbytes != 4 * width * height:
+                raise ValueError("cost must hold two unsigned shorts per pixel cast")
+            costs = np.frombuffer(view.cast("B"), np.uint16).reshape(height, width, 2)
+            costs[:] = 0
+
+        samples = None
+        if gbuffer is not None:
+            view = memoryview(gbuffer)
+            if view.readonly:
+                raise BufferError("Object is not writable.")
+            if view.nbytes != GSAMPLE.itemsize * width * height:
+                raise ValueError("gbuffer must hold 16 bytes per pixel cast")
+            samples = np.frombuffer(view.cast("B"), GSAMPLE).reshape(height, width)
+            samples[:] = np.zeros((), GSAMPLE)
+
+        if not rad:  # If the given angles are in degrees, convert them to radians.
+            angle_x, angle_y, fov = _radians(angle_x), _radians(angle_y), _radians(fov)
+        angle_x, angle_y = np.float32(angle_x), np.float32(angle_y)
+        origin = _vec(x, y, z)
+
+        self._orient_billboards(angle_y)
+        self._surfaces.sort(key=lambda surface: surface.distance(origin))  # Stable, like depth_sort
+        # The surfaces of a room are only seen through its portals
+        hidden = self._find_hidden_rooms(origin, angle_x, angle_y, fov, view_distance, width, height)
+        if hidden != self._hidden_rooms:
+            self._hidden_rooms = hidden
+            self._static_version += 1
+        # The scene is shared, its surfaces are sorted aside, after the ones of the caster like find_scene_surfaces
+        scene_surfaces = self._scene._surfaces if self._scene is not None else []
+        scene_surfaces = sorted(scene_surfaces, key=lambda surface: surface.distance(origin))
+        surfaces = [surface for surface in self._surfaces + scene_surfaces if surface.room not in hidden]
+
+        # With a pose or a progressive cast, the pixels not refined yet copy the closest pixel of a coarser grid
+        copied = np.zeros((height, width), bool)
+        pose_state = None
+        if pose is not None or progressive > 1:
+            camera = tuple(np.float32(value) for value in (x, y, z, angle_x, angle_y, fov, view_distance))
+            pose_state = self._get_pose(pose, width, height, camera, progressive)
+            blocks = (-(-width // progressive)) * (-(-height // progressive))
+            pose_state.level = min(pose_state.level + budget // blocks, progressive * progressive - 1)
+            step = progressive  # Size of the finest grid fully traced
+            while step > 1 and (progressive * 2 // step) ** 2 <= pose_state.level + 1:
+                step //= 2
+            ranks = np.array([[_refine_rank(column, row, progressive) for column in range(progressive)]
+                              for row in range(progressive)])
+            ys, xs = np.mgrid[:height, :width]
+            source_y, source_x = ys - ys % step, xs - xs % step
+            copied = cast & ~pose_state.baked & (ranks[ys % progressive, xs % progressive] > pose_state.level) \
+                & cast[source_y, source_x]
+            pose_state.baked |= cast & ~copied
+
+        ray_x, ray_y, ray_z = self._get_rays(width, height, angle_x, angle_y, fov, view_distance)
+        rows, columns = np.nonzero(cast & ~copied)
+        _, colour, inter, tested = self._trace(surfaces, origin, (ray_x[columns], ray_y[rows], ray_z[columns]),
+                                                view_distance)
+        if samples is not None:
+            samples["red"][rows, columns] = colour[:, 0]
+            samples["green"][rows, columns] = colour[:, 1]
+            samples["blue"][rows, columns] = colour[:, 2]
+            samples["inter"][rows, columns] = inter.T
+        colour, evaluated = self._shade(colour, inter)
+        if costs is not None:
+            costs[rows, columns, 0] = np.minimum(tested, 0xffff)
+            costs[rows, columns, 1] = np.minimum(evaluated, 0xffff)
+
+        frame = np.zeros((height, width, 3), np.uint8)
+        frame[rows, columns] = colour
+        if pose_state is not None:
+            # The sources are traced by this cast, an empty one leaves the pixel untouched
+            frame[copied] = frame[source_y[copied], source_x[copied]]
+            if samples is not None:
+                samples[copied] = samples[source_y[copied], source_x[copied]]
+            if pose_state.level < progressive * progressive - 1:
+                pose_state.level += 1  # The next frame refines one more pixel per block
+        self._display(screen, frame)
+
+        self._sweep_images()  # The images of the volatile surfaces are kept until the next cast
+        self._surfaces = [surface for surface in self._surfaces if not surface.rm]
+
+    @staticmethod
+    def _get_screen(dst_surface) -> np.ndarray:
+        """The red, green and blue channels of a pygame Surface or of a (buffer, width, height[, pitch]) tuple."""
+        if isinstance(dst_surface, tuple):
+            return buffer_pixels(dst_surface, "dst_surface", True)[:, :, 2::-1]
+        try:
+            return pixels3d(dst_surface)
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError("dst_surface is not a valid surface") from None
+
+    @staticmethod
+    def _display(screen: np.ndarray, frame: np.ndarray) -> None:
+        """Write the pixels of the frame that are not empty, repeated to fill the screen if it is larger."""
+        height, width = frame.shape[:2]
+        rows = np.arange(screen.shape[1]) * height // screen.shape[1]
+        columns = np.arange(screen.shape[0]) * width // screen.shape[0]
+        frame = frame[rows][:, columns].transpose(1, 0, 2)
+        written = frame.any(axis=2)
+        screen[written] = frame[written]
+
+    def relight(self, dst_surface, gbuffer) -> None:
+        """Apply the lights to a G-buffer filled by raycasting and display it."""
+        screen = self._get_screen(dst_surface)
+        width, height = screen.shape[:2]
+        view = memoryview(gbuffer)
+        if view.nbytes != GSAMPLE.itemsize * width * height:
+            raise ValueError("gbuffer must hold 16 bytes per pixel of dst_surface")
+        samples = np.frombuffer(view.cast("B"), GSAMPLE).reshape(-1)
+        colour = np.stack((samples["red"], samples["green"], samples["blue"]), axis=1)
+        colour, _ = self._shade(colour, samples["inter"].T)
+        self._display(screen, colour.reshape(height, width, 3))
+
+    def single_cast(self, x=0., y=0., z=0., angle_x=0., angle_y=0., max_distance=1000., rad=False) -> float:
+        """Compute a single raycast and return the position in space of the closest intersection."""
+        max_distance = np.float32(max_distance)
+        if max_distance <= 0.:
+            raise ValueError("max_distance must be greater than 0")
+        if not rad:  # If the given angles are in degrees, convert them to radians.
+            angle_x, angle_y = _radians(angle_x), _radians(angle_y)
+        angle_x, angle_y = np.float32(angle_x), np.float32(angle_y)
+        ray = (np.array([np.cos(angle_y) * max_distance]), np.array([np.sin(angle_x) * max_distance]),
+               np.array([np.sin(angle_y) * max_distance]))
+        self._orient_billboards(angle_y)
+        distance = self._trace(self._all_surfaces(), _vec(x, y, z), ray, max_distance)[0]
+        return float(distance[0])
+
+    def cast_pixels(self, pixels, width, height, x=0., y=0., z=0., angle_x=0., angle_y=0., fov=120.,
+                    view_distance=1000., rad=False) -> list[float]:
+        """Compute the raycasts of some pixels of the screen and return the distance of the closest intersection of each."""
+        fov, view_distance = np.float32(fov), np.float32(view_distance)
+        if width <= 0 or height <= 0:
+            raise ValueError("width and height must be greater than 0")
+        if fov <= 0.:
+            raise ValueError("fov must be greater than 0")
+        if view_distance <= 0.:
+            raise ValueError("view_distance must be greater than 0")
+        try:
+            pixels = [(int(pixel_x), int(pixel_y)) for pixel_x, pixel_y in pixels]
+        except (TypeError, ValueError):
+            raise TypeError("pixels must be a sequence of (x, y) pairs") from None
+        if any(not (0 <= pixel_x < width and 0 <= pixel_y < height) for pixel_x, pixel_y in pixels):
+            raise ValueError("pixel outside of the screen")
+
+        if not rad:  # If the given angles are in degrees, convert them to radians.
+            angle_x, angle_y, fov = _radians(angle_x), _radians(angle_y), _radians(fov)
+        angle_x, angle_y = np.float32(angle_x), np.float32(angle_y)
+        ray_x, ray_y, ray_z = self._get_rays(width, height, angle_x, angle_y, fov, view_distance)
+        columns = np.array([pixel_x for pixel_x, _ in pixels], np.int64)
+        rows = np.array([pixel_y for _, pixel_y in pixels], np.int64)
+        self._orient_billboards(angle_y)
+        distance = self._trace(self._all_surfaces(), _vec(x, y, z),
+                               (ray_x[columns], ray_y[rows], ray_z[columns]), view_distance)[0]
+        return distance.tolist()
+
@@ -0,0 +1,29 @@
+"""Compile the static surfaces of the room into a scene file.
+
+The textures are stored already decoded, in the pixel format of the caster, with their opacity masks,
+so RayCaster.load_scene only has to map the file in memory.
+Run it again every time the static surfaces or their textures change:
+
+    python -m scripts.scene_compiler
+"""
+
+from pygame import display as pg_display, HIDDEN
+
+from scripts.backend import RayCaster
+
+from scripts.surface_loader import add_static_surfaces, SCENE_PATH
+
+
+def compile_scene(path: str = SCENE_PATH) -> None:
+    """Build the static surfaces and save them in a scene file.
+    @param path: The path of the scene file to write.
+    """
+    caster = RayCaster()
+    add_static_surfaces(caster)
+    caster.save_scene(path)
+
+
+if __name__ == "__main__":
+    pg_display.set_mode((1, 1), HIDDEN)  # convert_alpha needs a display
+    compile_scene()
+    print(f"Scene compiled in {SCENE_PATH}")
@@ -1,10 +1,39 @@
-from nostalgiaeraycasting import RayCaster
+from os.path import exists
 
+from scripts.backend import RayCaster
 
-from scripts.utils import load_image
+
+from scripts.utils import load_image, load_atlas, add_atlas_surface, AtlasFrame, join_path
+
+
+SCENE_PATH: str = join_path("data", "scene.nscn")  # Built by scripts/scene_compiler.py
+CORRIDOR: int = 1  # The room behind the door, only seen through the portal of the door
 
 
 def load_static_surfaces(caster: RayCaster) -> None:
+    """Add the static surfaces of the room to the caster.
+    Uses the compiled scene if there is one, otherwise decodes every texture.
+    A scene compiled for another version of the caster is compiled again, when it can be written.
+    @param caster: The caster to fill.
+    """
+    if exists(SCENE_PATH):
+        try:
+            caster.load_scene(SCENE_PATH)
+            return
+        except ValueError:  # Not a scene file of this version
+            pass
+        try:
+            compiler = RayCaster()
+            add_static_surfaces(compiler)
+            compiler.save_scene(SCENE_PATH)  # Like scripts/scene_compiler.py
+            caster.load_scene(SCENE_PATH)
+            return
+        except OSError:  # Read-only, the textures are decoded every time
+            pass
+    add_static_surfaces(caster)
+
+
+def add_static_surfaces(caster: RayCaster) -> None:
     # WALLS
 
     # {"image", "A_x", "A_y", "A_z", "B_x", "B_y", "B_z","C_x", "C_y", "C_z", "rm", NULL};
@@ -49,18 +78,21 @@ def load_static_surfaces(caster: RayCaster) -> None:
     caster.add_surface(
         load_image("data", "images", "textures", "corridor_wall.png"),
         2.501, 2.3, -0.4,
-        10.5, 0., -0.4
+        10.5, 0., -0.4,
+        room=CORRIDOR,
     )
     caster.add_surface(
         load_image("data", "images", "textures", "black.png"),
         2.501, 4., -0.3,
-        10.5, -2., -0.3
+        10.5, -2., -0.3,
+        room=CORRIDOR,
     )
 
     caster.add_surface(
         load_image("data", "images", "textures", "corridor_wall.png"),
         2.501, 2.3, -1.6,
-        10.5, 0., -1.6
+        10.5, 0., -1.6,
+        room=CORRIDOR,
     )
 
     caster.add_surface(
@@ -68,6 +100,7 @@ def load_static_surfaces(caster: RayCaster) -> None:
         10.5, -0.01, -0.39,
         2.5, -0.01, -1.61,
         2.5, -0.01, -0.39,
+        room=CORRIDOR,
     )
 
     caster.add_surface(
@@ -75,95 +108,76 @@ def load_static_surfaces(caster: RayCaster) -> None:
         10.5, 2.3, -0.39,
         2.51, 2.3, -1.61,
         2.51, 2.3, -0.39,
+        room=CORRIDOR,
     )
 
-    # BED
-    caster.add_surface(
-        load_image("data", "images", "props", "top_bed.png"),
-        -0.8, 0.4, 3.5,
-        0.8, 0.4, 1.5,
-        -0.8, 0.4, 1.5
-    )
+    # PROPS, packed together so their pixels are acquired once.
+    # The faces of the boxes are seen from outside, some textures were drawn the other way around.
+    props: dict[str, AtlasFrame] = load_atlas("data", "images", "props", names=[
+        "top_bed", "bed_left", "bed_right", "front_bed",
+        "wardrobe_right_door", "wardrobe_left", "wardrobe_right", "wardrobe_top",
+        "nightstand_front", "nightstand_left", "nightstand_right", "nightstand_top",
+        "closet_front", "closet_left", "closet_right", "closet_top",
+        "table_front", "table_side", "table_top", "photo",
+    ], flipped={
+        "bed_right": (True, True),
+        "wardrobe_left": (True, False),
+        "wardrobe_top": (True, False),
+    })
+
+    # The furniture against the walls is made of boxes, without the faces that are never seen.
+    # Faces: -x, +x, -y, +y, -z, +z
 
-    caster.add_surface(
-        load_image("data", "images", "props", "bed_left.png"),
-        -0.79, 0.4, 3.5,
-        -0.79, 0, 1.5)
-    caster.add_surface(
-        load_image("data", "images", "props", "bed_right.png"),
-        0.79, 0, 3.5,
-        0.79, 0.4, 1.5)
+    # BED
+    caster.add_box(
+        -0.8, 0.0, 1.5,
+        0.8, 0.4, 3.5,
+        (props["bed_left"], props["bed_right"], None, props["top_bed"], props["front_bed"], None))
 
-    caster.add_surface(
-        load_image("data", "images", "props", "front_bed.png"),
-        -0.8, 0.4, 1.51,
-        0.8, 0.0, 1.51)
+    # WARDROBE, opened by the left door (see interactions.Wardrobe)
 
-    # WARDROBE
+    caster.add_box(
+        -1.6, 0.0, -3.5,
+        0.0, 2.0, -3.2,
+        (props["wardrobe_right"], props["wardrobe_left"], None, props["wardrobe_top"], None, None))
 
-    caster.add_surface(
-        load_image("data", "images", "props", "wardrobe_right_door.png"),
+    add_atlas_surface(
+        caster,
+        props["wardrobe_right_door"],
         -0.8, 2.0, -3.2,
         -1.6, 0.0, -3.2)
 
-    caster.add_surface(
-        load_image("data", "images", "props", "wardrobe_left.png"),
-        0.0, 2.0, -3.2,
-        0.0, 0.0, -3.5)
-
-    caster.add_surface(
-        load_image("data", "images", "props", "wardrobe_right.png"),
-        -1.6, 2.0, -3.2,
-        -1.6, 0.0, -3.5)
-
-    caster.add_surface(
-        load_image("data", "images", "props", "wardrobe_top.png"),
-        -0.0, 2.0, -3.2,
-        -1.6, 2.01, -3.5,
-        -0.0, 2.01, -3.5)
-
-    #NIGHTSTAND
+    # NIGHTSTAND
 
-    caster.add_surface(
-        load_image("data", "images", "props", "nightstand_front.png"),
-        0.9, 0.5, 3.01,
-        1.5, 0.0, 3.01)
-
-    caster.add_surface(
-        load_image("data", "images", "props", "nightstand_left.png"),
-        0.9, 0.5, 3.5,
-        0.9, 0.0, 3.0)
-
-    caster.add_surface(
-        load_image("data", "images", "props", "nightstand_right.png"),
-        1.5, 0.5, 3.0,
-        1.5, 0.0, 3.5)
-
-    caster.add_surface(
-        load_image("data", "images", "props", "nightstand_top.png"),
-        0.9, 0.5, 3.5,
-        1.5, 0.5, 3.0,
-        0.9, 0.5, 3.0)
+    caster.add_box(
+        0.9, 0.0, 3.0,
+        1.5, 0.5, 3.5,
+        (props["nightstand_left"], props["nightstand_right"], None, props["nightstand_top"], props["nightstand_front"],
+         None))
 
     # CLOSET
 
-    caster.add_surface(
-        load_image("data", "images", "props", "closet_front.png"),
+    add_atlas_surface(
+        caster,
+        props["closet_front"],
         -2.0, 1.1, 2.2,
         -1.0, 0.0, 2.5)
 
-    caster.add_surface(
-        load_image("data", "images", "props", "closet_left.png"),
+    add_atlas_surface(
+        caster,
+        props["closet_left"],
         -2.0, 1.1, 2.2,
         -2.3, 0.0, 3.2)
 
-    caster.add_surface(
-        load_image("data", "images", "props", "closet_right.png"),
+    add_atlas_surface(
+        caster,
+        props["closet_right"],
         -1.0, 1.1, 2.5,
         -1.3, 0.0, 3.5)
 
-    caster.add_surface(
-        load_image("data", "images", "props", "closet_top.png"),
+    add_atlas_surface(
+        caster,
+        props["closet_top"],
         -2.3, 1.09, 2.2,
         -1.0, 1.09, 3.5,
         -1.0, 1.09, 2.2,
@@ -171,24 +185,14 @@ def load_static_surfaces(caster: RayCaster) -> None:
 
     # LITTLE TABLE
 
-    caster.add_surface(
-        load_image("data", "images", "props", "table_front.png"),
+    caster.add_box(
+        0.9, 0.0, -3.5,
         2.0, 0.4, -3.1,
-        0.9, 0.0, -3.1)
+        (props["table_side"], None, None, props["table_top"], None, props["table_front"]))
 
-    caster.add_surface(
-        load_image("data", "images", "props", "table_side.png"),
-        0.9, 0.4, -3.1,
-        0.9, 0.0, -3.5)
-
-    caster.add_surface(
-        load_image("data", "images", "props", "table_top.png"),
-        0.9, 0.4, -3.1,
-        2.0, 0.4, -3.5,
-        0.9, 0.4, -3.5)
-
-    caster.add_surface(
-        load_image("data", "images", "props", "photo.png"),
+    add_atlas_surface(
+        caster,
+        props["photo"],
         1.4, 0.65, -3.3,
         1.1, 0.4, -3.2,
         1.4, 0.4, -3.2)
@@ -1,14 +1,15 @@
-from typing import Generator
-from math import sin, cos, radians
+from typing import Generator, NamedTuple
 from enum import Enum, auto
+from array import array
 
 from os.path import join as join_path
 from os import listdir
 
-from pygame import Surface, Rect
-from pygame.image import load as pg_image_load
+from pygame import Surface, Rect, SRCALPHA, BLEND_RGBA_MAX
+from pygame.image import load as pg_image_load, tobytes as pg_image_tobytes, frombytes as pg_image_frombytes
+from pygame.transform import flip as pg_flip
 
-from nostalgiaeraycasting import RayCaster
+from scripts.backend import RayCaster
 
 
 MAP_COLLISIONS: tuple[Rect, ...] = (
@@ -58,6 +59,132 @@ def lazy_load_images(*path: str) -> Generator:
         yield load_image(path, file_path)
 
 
+class AtlasFrame(NamedTuple):
+    """An image packed in a texture atlas."""
+    image: Surface  # The atlas page holding the image
+    rect: tuple[int, int, int, int]  # x, y, width, height of the image in the page
+
+
+def pack_atlas(images: list[Surface], page_width: int = 2048, page_height: int = 2048) -> list[AtlasFrame]:
+    """Pack images into as few atlas pages as possible.
+    The raycaster shares the pixels of a page between all the surfaces using it,
+    so the frames of an animation or the props of the room are only decoded and acquired once.
+    @param images: The images to pack.
+    @param page_width: The maximum width of a page, wider images get a page of their own width.
+    @param page_height: The maximum height of a page.
+    :return: The frame of every image, in the same order as the images.
+    """
+    # Shelf packing: the images are sorted by height and placed left to right on rows.
+    order: list[int] = sorted(range(len(images)), key=lambda i: images[i].get_height(), reverse=True)
+    pages: list[list[int]] = []  # width, height of every page
+    placements: list[tuple[int, int, int]] = [(0, 0, 0)] * len(images)  # page, x, y of every image
+
+    x = y = shelf_height = 0
+    for i in order:
+        width, height = images[i].get_size()
+        if pages and x + width > pages[-1][0]:  # Next shelf
+            x, y, shelf_height = 0, y + shelf_height, 0
+        if not pages or y + height > page_height or width > pages[-1][0]:  # Next page
+            pages.append([max(page_width, width), 0])
+            x = y = shelf_height = 0
+
+        placements[i] = (len(pages) - 1, x, y)
+        x += width
+        shelf_height = max(shelf_height, height)
+        pages[-1][1] = max(pages[-1][1], y + height)
+
+    surfaces: list[Surface] = []
+    for width, height in pages:
+        surfaces.append(Surface((width, height), SRCALPHA).convert_alpha())
+
+    frames: list[AtlasFrame] = []
+    for image, (page, x, y) in zip(images, placements):
+        surfaces[page].blit(image, (x, y), special_flags=BLEND_RGBA_MAX)
+        frames.append(AtlasFrame(surfaces[page], (x, y, *image.get_size())))
+    return frames
+
+
+def load_atlas(*path: str, names: list[str], flipped: dict[str, tuple[bool, bool]] | None = None) -> dict[str, AtlasFrame]:
+    """Load images from a directory into a texture atlas.
+    @param path: The path to the directory.
+    @param names: The names of the images, without the .png extension.
+    @param flipped: The images to flip before packing them, horizontally and vertically, by name.
+    :return: The frame of every image, by name.
+    """
+    flipped = flipped or {}
+    images: list[Surface] = []
+    for name in names:
+        image = load_image(*path, f"{name}.png")
+        images.append(pg_flip(image, *flipped[name]) if name in flipped else image)
+    return dict(zip(names, pack_atlas(images)))
+
+
+def add_atlas_surface(caster: RayCaster, frame: AtlasFrame, *coords: float, **kwargs) -> None:
+    """Add a surface displaying an image of a texture atlas.
+    @param caster: The caster to add the surface to.
+    @param frame: The image to display.
+    @param coords: The coordinates of the surface, as for RayCaster.add_surface.
+    """
+    caster.add_surface(frame.image, *coords, rect=frame.rect, **kwargs)
+
+
+def coverage_mask(overlay: Surface) -> bytes:
+    """Get the coverage of an overlay, to skip the pixels it hides in RayCaster.raycasting.
+    @param overlay: The overlay, with the size of the surface it is blitted on.
+    :return: The alpha of every pixel, row by row. 255 means the pixel is fully covered.
+    """
+    return pg_image_tobytes(overlay, "RGBA")[3::4]
+
+
+def cost_buffer(size: tuple[int, int]) -> array:
+    """Create a buffer receiving the cost of every pixel in RayCaster.raycasting.
+    @param size: The size of the surface cast.
+    :return: Two unsigned shorts per pixel: the surfaces tested against the ray and the lights evaluated.
+    """
+    return array("H", bytes(4 * size[0] * size[1]))
+
+
+def gbuffer(size: tuple[int, int]) -> bytearray:
+    """Create a G-buffer for the deferred mode of RayCaster.raycasting, lit again with RayCaster.relight.
+    @param size: The size of the surface cast.
+    :return: 16 bytes per pixel: the pixel before the lights and the point hit (x, y, z).
+    """
+    return bytearray(16 * size[0] * size[1])
+
+
+def gradient_palette(*stops: tuple[int, int, int]) -> list[tuple[int, int, int]]:
+    """Create a palette of 256 colours going through the given colours.
+    @param stops: The colours, evenly spaced in the palette.
+    :return: The palette.
+    """
+    palette = []
+    for i in range(256):
+        position = i * (len(stops) - 1) / 255
+        step = min(int(position), len(stops) - 2)
+        ratio = position - step
+        palette.append(tuple(round(a + (b - a) * ratio) for a, b in zip(stops[step], stops[step + 1])))
+    return palette
+
+
+HEATMAP_PALETTE: list[tuple[int, int, int]] = gradient_palette(
+    (0, 0, 0), (0, 0, 255), (0, 255, 0), (255, 0, 0), (255, 255, 255)
+)
+
+
+def cost_heatmap(cost: array, size: tuple[int, int], max_cost: int = 0) -> Surface:
+    """Show the cost of every pixel written by RayCaster.raycasting in false colours.
+    @param cost: The buffer given to RayCaster.raycasting, see cost_buffer.
+    @param size: The size of the surface cast.
+    @param max_cost: The cost shown in white. By default, the cost of the most expensive pixel.
+    :return: The heatmap, from black (nothing done) to white.
+    """
+    totals = [surfaces + lights for surfaces, lights in zip(cost[0::2], cost[1::2])]
+    max_cost = max_cost or max(totals) or 1
+    heatmap = pg_image_frombytes(bytes(min(255, total * 255 // max_cost) for total in totals), size, "P")
+    heatmap.set_palette(HEATMAP_PALETTE)
+    return heatmap
+
+
 def repeat_texture(texture: Surface, repeat_x: int = 1, repeat_y: int = 1) -> Surface:
     """Repeat a texture.
     @param texture: The texture to repeat.
@@ -115,18 +242,3 @@ def set_stereo_volume(player, sound_pos, channel, hear_distance: float = 7., hea
     ) / hear_stereo_distance))
 
     channel.set_volume(volume * ((stereo_dist + 1) / 2), volume * ((-stereo_dist + 1) / 2))
-
-
-def add_surface_toward_player_2d(caster: RayCaster, player, image: Surface, pos: tuple[float, float, float], width, height):
-    # {"image", "A_x", "A_y", "A_z", "B_x", "B_y", "B_z","C_x", "C_y", "C_z", "rm", NULL};
-    caster.add_surface(
-        image,
-        pos[0] + (width / 2) * cos(radians(player.angle_y + 90)),
-        pos[1] + height,
-        pos[2] + (width / 2) * sin(radians(player.angle_y + 90)),
-
-        pos[0] - (width / 2) * cos(radians(player.angle_y + 90)),
-        pos[1],
-        pos[2] - (width / 2) * sin(radians(player.angle_y + 90)),
-        rm=True
-    )
@@ -9,7 +9,7 @@ from scripts.display import DISPLAY
 from scripts.utils import load_image
 
 
-from nostalgiaefilters import vignette, fish, distortion
+from scripts.backend import vignette, fish, distortion
 
 
 hand_visual: Surface = load_image("data", "images", "visuals", "hand.png")